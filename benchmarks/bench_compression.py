@@ -0,0 +1,64 @@
+"""
+Bytes on the wire and encoding latency of the initial sync of a room, for each compression level.
+
+Run with `python benchmarks/bench_compression.py`, results are printed as JSON.
+"""
+import json
+import time
+
+from pycrdt import Doc, YSyncMessageType, create_sync_message, handle_sync_message
+
+from cocat import DB
+from cocat.compression import Compression
+
+EVENT_NB = 10_000
+LEVELS: list[int | None] = [None, 1, 6, 9]
+
+
+def make_sync_message() -> bytes:
+    db = DB()
+    with db.transaction():
+        for i in range(EVENT_NB):
+            db.create_event(
+                start=f"2025-01-01T00:00:{i % 60:02}",
+                stop=f"2025-01-02T00:00:{i % 60:02}",
+                author="John",
+                tags=["tag0", f"tag{i % 10}"],
+                attributes={"index": i},
+            )
+    # the reply of the room to the first message of a new client
+    client_doc: Doc = Doc()
+    reply = handle_sync_message(create_sync_message(client_doc)[1:], db.doc)
+    assert reply is not None and reply[1] == YSyncMessageType.SYNC_STEP2
+    return reply
+
+
+def bench(message: bytes, level: int | None) -> dict[str, float | int | str | None]:
+    compression = Compression(threshold=len(message) + 1 if level is None else 0, level=level or 0)
+    t0 = time.perf_counter()
+    frame = compression.encode(message)
+    t1 = time.perf_counter()
+    assert compression.decode(frame) == message
+    t2 = time.perf_counter()
+    return {
+        "level": level,
+        "events": EVENT_NB,
+        "message_size": len(message),
+        "bytes_on_wire": len(frame),
+        "ratio": len(message) / len(frame),
+        "encode_seconds": t1 - t0,
+        "decode_seconds": t2 - t1,
+    }
+
+
+def run() -> list[dict[str, float | int | str | None]]:
+    message = make_sync_message()
+    return [bench(message, level) for level in LEVELS]
+
+
+def main() -> None:
+    print(json.dumps(run(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
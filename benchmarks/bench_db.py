@@ -0,0 +1,231 @@
+"""
+Duration of the hot paths of the database, catalogues and events, for each number of events.
+
+Run with `python benchmarks/bench_db.py`, results are printed as JSON.
+"""
+import json
+import time
+from collections.abc import Callable
+from typing import Any
+
+from cocat import DB
+
+EVENT_NBS = [10_000]
+JSON_EVENT_NBS = [10_000, 100_000]
+# the number of catalogues referencing the deleted events
+CATALOGUE_NB = 100
+# the number of events deleted, or read for each property
+SAMPLE_NB = 1_000
+
+Result = dict[str, Any]
+
+
+def event_kwargs(i: int) -> dict[str, Any]:
+    return {
+        "start": f"2025-01-01T{i // 3600 % 24:02}:{i // 60 % 60:02}:{i % 60:02}",
+        "stop": f"2025-01-02T{i // 3600 % 24:02}:{i // 60 % 60:02}:{i % 60:02}",
+        "author": "John",
+        "tags": ["tag0", f"tag{i % 10}"],
+        "rating": i % 10,
+        "attributes": {"index": i},
+    }
+
+
+def make_db(event_nb: int) -> DB:
+    db = DB()
+    with db.transaction():
+        for i in range(event_nb):
+            db.create_event(**event_kwargs(i))
+    return db
+
+
+def measure(name: str, event_nb: int, func: Callable[[], Any], operations: int | None = None) -> Result:
+    t0 = time.perf_counter()
+    func()
+    duration = time.perf_counter() - t0
+    operations = event_nb if operations is None else operations
+    return {
+        "benchmark": name,
+        "events": event_nb,
+        "operations": operations,
+        "seconds": duration,
+        "operations_per_second": operations / duration,
+    }
+
+
+def bench_create_event(event_nb: int) -> Result:
+    db = DB()
+
+    def create() -> None:
+        for i in range(event_nb):
+            db.create_event(**event_kwargs(i))
+
+    return measure("create_event", event_nb, create)
+
+
+def bench_bulk_create_event(event_nb: int) -> Result:
+    return measure("bulk_create_event", event_nb, lambda: make_db(event_nb))
+
+
+def bench_json(event_nb: int) -> list[Result]:
+    db = make_db(event_nb)
+    data = ""
+
+    def to_json() -> None:
+        nonlocal data
+        data = db.to_json()
+
+    return [
+        measure("to_json", event_nb, to_json),
+        measure("from_json", event_nb, lambda: DB.from_json(data)),
+    ]
+
+
+def bench_dynamic_events(event_nb: int) -> list[Result]:
+    db = make_db(event_nb)
+    events = sorted(db.events, key=lambda event: event.start)
+    db.create_catalogue(name="static", author="John", events=events[: event_nb // 2])
+    catalogue = db.create_catalogue(name="dynamic", author="John")
+    results = []
+    for name, condition in [
+        ("dynamic_events", "event.rating > 4"),
+        ("dynamic_events_catalogue_reference", "event.rating > 4 and event in catalogue('static')"),
+    ]:
+        catalogue.set_dynamic_filter(condition)
+        results.append(measure(name, event_nb, lambda: catalogue.dynamic_events))
+    for name, query in [
+        ("query_dynamic_events", db.query().where(rating__gt=4)),
+        ("query_dynamic_events_catalogue_reference", db.query().where(rating__gt=4).in_catalogue("static")),
+        ("query_time_range", db.query().where(start__lt=events[event_nb // 100].start).order_by("start")),
+    ]:
+        catalogue.set_dynamic_filter(query)
+        results.append(measure(name, event_nb, lambda: catalogue.dynamic_events))
+    return results
+
+
+def bench_event_properties(event_nb: int) -> list[Result]:
+    db = make_db(event_nb)
+    events = list(db.events)[:SAMPLE_NB]
+    results = []
+    for name in ["start", "stop", "author", "rating", "tags", "attributes"]:
+
+        def read(name: str = name) -> None:
+            for event in events:
+                getattr(event, name)
+
+        results.append(measure(f"event_{name}", event_nb, read, len(events)))
+    fields = ["start", "stop", "author", "rating", "tags"]
+
+    def read_properties() -> None:
+        for event in events:
+            for name in fields:
+                getattr(event, name)
+
+    def get() -> None:
+        for event in events:
+            event.get(*fields)
+
+    uuids = [event.uuid for event in events]
+    results.append(measure("event_properties", event_nb, read_properties, len(events)))
+    results.append(measure("event_get", event_nb, get, len(events)))
+    results.append(measure("read_events", event_nb, lambda: db.read_events(uuids, fields), len(events)))
+    return results
+
+
+def bench_event_delete(event_nb: int) -> Result:
+    db = make_db(event_nb)
+    events = list(db.events)
+    for i in range(CATALOGUE_NB):
+        db.create_catalogue(name=f"catalogue{i}", author="John", events=events[:SAMPLE_NB])
+
+    def delete() -> None:
+        for event in events[:SAMPLE_NB]:
+            event.delete()
+
+    result = measure("event_delete", event_nb, delete, SAMPLE_NB)
+    result["catalogues"] = CATALOGUE_NB
+    return result
+
+
+def bench_change_callbacks(event_nb: int) -> Result:
+    db = make_db(event_nb)
+    events = list(db.events)
+    calls = 0
+
+    def callback(value: Any) -> None:
+        nonlocal calls
+        calls += 1
+
+    for event in events:
+        event.on_change_rating(callback)
+    # the changes made by another database trigger the callbacks
+    remote_db = DB()
+    db.sync(remote_db)
+
+    def change() -> None:
+        with remote_db.transaction():
+            for event in remote_db.events:
+                event.rating = 10
+
+    result = measure("events_changed_callbacks", event_nb, change)
+    assert calls == event_nb
+    return result
+
+
+def bench_update_events(event_nb: int) -> list[Result]:
+    db = make_db(event_nb)
+    events = list(db.events)
+
+    def update() -> None:
+        for event in events:
+            event.rating = 10
+            event.add_tags("tag10")
+
+    def bulk_update() -> None:
+        db.update_events(events, rating=11)
+        db.add_tags(events, "tag11")
+
+    return [
+        measure("update_events", event_nb, update),
+        measure("bulk_update_events", event_nb, bulk_update),
+    ]
+
+
+def bench_sync(event_nb: int) -> list[Result]:
+    db = make_db(event_nb)
+    remote_db = DB()
+    results = [measure("sync_initial", event_nb, lambda: db.sync(remote_db))]
+    assert len(remote_db._event_maps) == event_nb
+
+    def create() -> None:
+        with db.transaction():
+            for i in range(event_nb):
+                db.create_event(**event_kwargs(i))
+
+    results.append(measure("sync_update", event_nb, create))
+    assert len(remote_db._event_maps) == 2 * event_nb
+    return results
+
+
+def run(event_nbs: list[int] = EVENT_NBS, json_event_nbs: list[int] = JSON_EVENT_NBS) -> list[Result]:
+    results: list[Result] = []
+    for event_nb in json_event_nbs:
+        results.extend(bench_json(event_nb))
+    for event_nb in event_nbs:
+        results.append(bench_create_event(event_nb))
+        results.append(bench_bulk_create_event(event_nb))
+        results.extend(bench_dynamic_events(event_nb))
+        results.extend(bench_event_properties(event_nb))
+        results.append(bench_event_delete(event_nb))
+        results.append(bench_change_callbacks(event_nb))
+        results.extend(bench_update_events(event_nb))
+        results.extend(bench_sync(event_nb))
+    return results
+
+
+def main() -> None:
+    print(json.dumps(run(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
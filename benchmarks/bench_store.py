@@ -0,0 +1,65 @@
+"""
+Write throughput of a room update file, for each durability mode.
+
+Run with `python benchmarks/bench_store.py`, results are printed as JSON.
+"""
+import json
+import tempfile
+import time
+from pathlib import Path
+
+import anyio
+from pycrdt import Doc, Map
+
+from cocat.app.store import Fsync, UpdateFile
+
+UPDATE_NB = 2_000
+FSYNCS: list[Fsync] = ["update", "periodic", "never"]
+FLUSH_INTERVALS = [0, 0.01]
+
+
+def make_updates() -> list[bytes]:
+    doc: Doc = Doc()
+    map = doc.get("map", type=Map)
+    updates: list[bytes] = []
+    doc.observe(lambda event: updates.append(event.update))
+    for i in range(UPDATE_NB):
+        map[str(i % 100)] = i
+    return updates
+
+
+async def bench(directory: Path, updates: list[bytes], fsync: Fsync, flush_interval: float) -> dict[str, float | int | str]:
+    path = directory / f"{fsync}_{flush_interval}.y"
+    t0 = time.perf_counter()
+    async with UpdateFile(path, fsync=fsync, flush_interval=flush_interval) as update_file:
+        for update in updates:
+            await update_file.write(update)
+            # let the periodic tasks run, as in a room
+            await anyio.sleep(0)
+    duration = time.perf_counter() - t0
+    return {
+        "fsync": fsync,
+        "flush_interval": flush_interval,
+        "updates": len(updates),
+        "seconds": duration,
+        "updates_per_second": len(updates) / duration,
+        "file_size": path.stat().st_size,
+    }
+
+
+async def run() -> list[dict[str, float | int | str]]:
+    updates = make_updates()
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for fsync in FSYNCS:
+            for flush_interval in FLUSH_INTERVALS:
+                results.append(await bench(Path(directory), updates, fsync, flush_interval))
+    return results
+
+
+async def main() -> None:
+    print(json.dumps(await run(), indent=2))
+
+
+if __name__ == "__main__":
+    anyio.run(main)
@@ -0,0 +1,77 @@
+"""
+Runs all the benchmarks, or some of them.
+
+Run with `python benchmarks/run.py`, results are printed as JSON, or written to the file given
+with `--output`, for instance to compare them with the results of another commit.
+"""
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+from importlib.metadata import version
+from pathlib import Path
+from typing import Any
+
+import anyio
+
+import bench_compression
+import bench_db
+import bench_store
+
+SUITES = ["db", "store", "compression"]
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=Path(__file__).parent, text=True, stderr=subprocess.DEVNULL
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--suite", action="append", choices=SUITES, dest="suites",
+        help="a benchmark suite to run, can be repeated (default: all)",
+    )
+    parser.add_argument(
+        "--events", type=int, nargs="+", default=bench_db.EVENT_NBS,
+        help="the numbers of events of the database benchmarks",
+    )
+    parser.add_argument(
+        "--json-events", type=int, nargs="+", default=bench_db.JSON_EVENT_NBS,
+        help="the numbers of events of the JSON conversion benchmarks",
+    )
+    parser.add_argument("--output", type=Path, help="the file to write the results to")
+    args = parser.parse_args()
+
+    results: dict[str, Any] = {}
+    for suite in args.suites or SUITES:
+        print(f"Running {suite} benchmarks", file=sys.stderr)
+        if suite == "db":
+            results[suite] = bench_db.run(args.events, args.json_events)
+        elif suite == "store":
+            results[suite] = anyio.run(bench_store.run)
+        elif suite == "compression":
+            results[suite] = bench_compression.run()
+    report = {
+        "timestamp": time.time(),
+        "commit": git_commit(),
+        "cocat": version("cocat"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    data = json.dumps(report, indent=2)
+    if args.output is None:
+        print(data)
+    else:
+        args.output.write_text(data)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,10 @@
 from .db import DB as DB
 from .catalogue import Catalogue as Catalogue
 from .event import Event as Event
+from .instrumentation import Tracer as Tracer
 from .models import CatalogueModel as CatalogueModel
 from .models import EventModel as EventModel
+from .query import Query as Query
 from .api import create_catalogue as create_catalogue
 from .api import create_event as create_event
 from .api import load_catalogue as load_catalogue
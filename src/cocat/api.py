@@ -1,13 +1,18 @@
 from datetime import datetime
 from collections.abc import Iterable
-from typing import Any
+from typing import Any, cast
 from uuid import UUID
+from weakref import WeakKeyDictionary
 
+import anyio
 import httpx
 from anyio import Lock
 from cocat import DB, Catalogue, Event
-from pycrdt import Doc
-from wiredb import connect
+from cocat.compression import ClientWire, StaleClientError
+from cocat.db import copy_map, rebase_map
+from cocat.report import read_state
+from cocat.updates import HEADER, TruncatedUpdatesError, decode_updates
+from pycrdt import Doc, Map, write_message
 
 
 class Session:
@@ -20,12 +25,68 @@ class Session:
         self.file_path = file_path
         self.room_id = room_id
         self.lock = Lock()
+        # the values of the items of a document when it was last synchronized with the room
+        self._bases: WeakKeyDictionary[Doc, dict[str, dict[str, Any]]] = WeakKeyDictionary()
 
     async def connect(self, doc: Doc) -> None:
         async with self.lock:
-            async with connect("websocket", id=f"room/{self.room_id}", doc=doc, host=self.host, port=self.port, cookies=self.cookies) as self.client:
-                async with connect("file", doc=doc, path=self.file_path) as self.file:
-                    pass
+            try:
+                epoch = await self.get_epoch()
+            except httpx.HTTPStatusError:
+                # the connection to the room reports why the room cannot be accessed
+                file_state = None
+            else:
+                if read_state(doc.get_state()) and doc.get("meta", type=Map).get("epoch") != epoch:
+                    # don't merge the room state into a document of another epoch
+                    raise StaleClientError("The document belongs to another epoch of the room")
+                # load the local updates first, so that the state vector sent to the server
+                # makes it reply with the missing updates only
+                file_state = await load_updates(self.file_path, doc, epoch)
+                if file_state is None:
+                    # no local cache, download the room snapshot, which the server caches
+                    await self.download_snapshot(doc)
+            async with ClientWire(f"room/{self.room_id}", doc, host=self.host, port=self.port, cookies=self.cookies) as self.client:
+                pass
+            await save_updates(self.file_path, doc, file_state)
+            bases = {}
+            with doc.transaction():
+                for item in [*self.events.values(), *self.catalogues.values()]:
+                    maps = item.db._event_maps if isinstance(item, Event) else item.db._catalogue_maps
+                    if item.db.doc is doc and item._uuid in maps:
+                        bases[item._uuid] = cast(dict[str, Any], item._map.to_py())
+            self._bases[doc] = bases
+
+    async def get_epoch(self) -> str | None:
+        async with httpx.AsyncClient(cookies=self.cookies) as client:
+            response = await client.get(f"{self.host}:{self.port}/room/{self.room_id}/epoch")
+        response.raise_for_status()
+        return response.json()["epoch"]
+
+    async def save(self, item: Event | Catalogue) -> None:
+        try:
+            await self.connect(item.db.doc)
+        except StaleClientError:
+            # the room history was compacted since the item was created or loaded:
+            # give its changes since it was last synchronized to a database of the current epoch,
+            # and move the item to it
+            base = self._bases.get(item.db.doc, {}).get(item._uuid, {})
+            db = DB()
+            await self.connect(db.doc)
+            with db.transaction():
+                maps = db._event_maps if isinstance(item, Event) else db._catalogue_maps
+                if item._uuid in maps:
+                    rebase_map(maps[item._uuid], item._map, base)
+                else:
+                    maps[item._uuid] = copy_map(item._map)
+            item._db = db
+            item._map = maps[item._uuid]
+            await self.connect(db.doc)
+
+    async def download_snapshot(self, doc: Doc) -> None:
+        async with httpx.AsyncClient(cookies=self.cookies) as client:
+            response = await client.get(f"{self.host}:{self.port}/room/{self.room_id}/snapshot")
+        if response.status_code == 200:
+            doc.apply_update(response.content)
 
     def create_catalogue(
         self,
@@ -99,6 +160,58 @@ class Session:
 SESSION = Session()
 
 
+async def load_updates(file_path: str, doc: Doc, epoch: str | None = None) -> bytes | None:
+    path = anyio.Path(file_path)
+    if not await path.exists():
+        return None
+
+    truncated = False
+    try:
+        updates = decode_updates(await path.read_bytes())
+    except TruncatedUpdatesError as exc:
+        # the last append was interrupted, the updates before it are kept
+        updates = exc.updates
+        truncated = True
+    if updates is None:
+        # the file was not fully written, it is rewritten from the room
+        await path.unlink()
+        return None
+    file_doc: Doc = Doc()
+    with file_doc.transaction():
+        for update in updates:
+            file_doc.apply_update(update)
+    if file_doc.get("meta", type=Map).get("epoch") != epoch:
+        # the room history was compacted since the updates were cached, they are all
+        # in the compacted room but cannot be merged with it
+        await path.unlink()
+        return None
+    if truncated:
+        # no update can be appended after the truncated one
+        await write_updates(path, file_doc.get_update())
+    doc.apply_update(file_doc.get_update())
+    return file_doc.get_state()
+
+
+async def save_updates(file_path: str, doc: Doc, file_state: bytes | None) -> None:
+    if file_state is None:
+        # the file was not loaded into the document, it is replaced
+        await write_updates(anyio.Path(file_path), doc.get_update())
+        return
+
+    update = doc.get_update(file_state)
+    if update == bytes([0, 0]):
+        return
+    async with await anyio.open_file(file_path, mode="ab") as f:
+        await f.write(write_message(update))
+
+
+async def write_updates(path: anyio.Path, update: bytes) -> None:
+    # the file is replaced at once, so that it is never left partially written
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    await tmp_path.write_bytes(HEADER + write_message(update))
+    await tmp_path.replace(path)
+
+
 def set_config(*, host: str | None = None, port: int | None = None, file_path: str | None = None, room_id: str | None = None) -> None:
     """
     Sets the configuration of the current session.
@@ -106,7 +219,7 @@ def set_config(*, host: str | None = None, port: int | None = None, file_path: s
     Args:
         host: The host name of the database web server.
         port: The port number of the database web server.
-        file_path: The path to the file where updates will be stored.
+        file_path: The path to the file where updates will be cached locally.
         room_id: The ID of the room to connect to.
     """
     if host is not None:
@@ -239,7 +352,7 @@ async def save_catalogue(catalogue: Catalogue | UUID | str) -> None:
     else:
         uuid_or_name = str(catalogue)
     catalogue = SESSION.get_local_catalogue(uuid_or_name)
-    await SESSION.connect(catalogue.db.doc)
+    await SESSION.save(catalogue)
 
 
 async def load_event(uuid: UUID | str) -> Event:
@@ -267,4 +380,4 @@ async def save_event(event: Event | UUID | str) -> None:
     else:
         uuid = str(event)
     event = SESSION.get_local_event(uuid)
-    await SESSION.connect(event.db.doc)
+    await SESSION.save(event)
@@ -1,50 +1,107 @@
+import json
+from collections.abc import Iterator
 from contextlib import asynccontextmanager
+from datetime import datetime
 from functools import partial
-from pathlib import Path
+from hmac import compare_digest
+from time import perf_counter
 from typing import Annotated, Any
 
-from anyio import sleep_forever
-from anyio.abc import TaskStatus
-from fastapi import Cookie, Depends, FastAPI, WebSocket, WebSocketDisconnect, status
+from anyio import create_task_group
+from fastapi import Cookie, Depends, FastAPI, Header, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
 from fastapi_users import BaseUserManager, models
 from pycrdt import Channel
-from wiredb import Room, RoomManager, connect
 
+from ..compression import SUBPROTOCOL, WS_STALE_CLIENT, CompressedChannel, Compression, StaleClientError
+from .bulk import BulkCreator, iter_items
+from .channel import Overflow, QueueMetrics, QueuedChannel
 from .db import create_db_and_tables
+from .metrics import MetricsWriter, ServerMetrics, monitor_loop_lag
+from .query import get_event_dicts, query_events
+from .room import StoredRoom, StoredRoomManager
+from .store import Fsync, StoreType, create_store
 from .schemas import UserCreate, UserRead, UserUpdate
-from .users import auth_backend, fastapi_users, get_user_manager, get_jwt_strategy
-
-
-class StoredRoom(Room):
-    def __init__(self, directory: str, *args: Any, **kwargs: Any):
-        super().__init__(*args, **kwargs)
-        self._directory = directory
-
-    async def run(self, *args: Any, **kwargs: Any):
-        await self.task_group.start(self.connect_to_file)
-        await super().run(*args, **kwargs)
-
-    async def connect_to_file(self, *, task_status: TaskStatus[None]) -> None:
-        async with connect("file", doc=self.doc, path=f"{Path(self._directory) / self.id.lstrip('/')}.y"):
-            task_status.started()
-            await sleep_forever()
+from .users import UserAuth
 
 
 class CocatApp:
-    def __init__(self, update_dir: str, db_path: str = "./test.db") -> None:
+    def __init__(
+        self,
+        update_dir: str,
+        db_path: str = "./test.db",
+        *,
+        store: StoreType = "file",
+        compaction_size: int | None = None,
+        compaction_updates: int | None = None,
+        idle_timeout: float | None = None,
+        memory_budget: int | None = None,
+        flush_interval: float = 0,
+        flush_size: int | None = None,
+        fsync: Fsync = "never",
+        fsync_interval: float = 1,
+        auth_cache_ttl: float = 60,
+        auth_cache_size: int = 1000,
+        broadcast_window: float = 0,
+        broadcast_max_delay: float = 0.1,
+        compression_threshold: int | None = 1024,
+        compression_level: int = 6,
+        compression_max_size: int = 64 * 1024 * 1024,
+        send_queue_size: int = 1000,
+        send_queue_overflow: Overflow = "merge",
+        thread_threshold: int | None = 1_000_000,
+        metrics: bool = True,
+        metrics_token: str | None = None,
+        metrics_rooms: int = 20,
+    ) -> None:
+        self.queue_metrics = QueueMetrics()
+        self.metrics = ServerMetrics()
+        self.metrics_rooms = metrics_rooms
+        compression = None if compression_threshold is None else Compression(
+            compression_threshold, compression_level, compression_max_size
+        )
+        self.auth = auth = UserAuth(auth_cache_ttl, auth_cache_size)
+        fastapi_users = auth.fastapi_users
+        room_store = create_store(
+            store,
+            update_dir,
+            compaction_size=compaction_size,
+            compaction_updates=compaction_updates,
+            flush_interval=flush_interval,
+            flush_size=flush_size,
+            fsync=fsync,
+            fsync_interval=fsync_interval,
+            flush_latency=self.metrics.storage_flush,
+        )
 
         @asynccontextmanager
         async def lifespan(app: FastAPI):
-            async with RoomManager(partial(StoredRoom, update_dir)) as self.room_manager:
+            room_manager = StoredRoomManager(
+                partial(
+                    StoredRoom,
+                    room_store,
+                    broadcast_window=broadcast_window,
+                    broadcast_max_delay=broadcast_max_delay,
+                    thread_threshold=thread_threshold,
+                    metrics=self.metrics,
+                ),
+                idle_timeout=idle_timeout,
+                memory_budget=memory_budget,
+            )
+            async with room_store.start(), room_manager as self.room_manager, create_task_group() as tg:
                 await create_db_and_tables(db_path)
+                tg.start_soon(monitor_loop_lag, self.metrics)
                 yield
+                tg.cancel_scope.cancel()
 
         self.app = app = FastAPI(lifespan=lifespan)
 
+        current_user = fastapi_users.current_user(active=True)
         current_superuser = fastapi_users.current_user(active=True, superuser=True)
+        optional_superuser = fastapi_users.current_user(active=True, superuser=True, optional=True)
 
         app.include_router(
-            fastapi_users.get_auth_router(auth_backend), prefix="/auth/jwt", tags=["auth"]
+            fastapi_users.get_auth_router(auth.auth_backend), prefix="/auth/jwt", tags=["auth"]
         )
         app.include_router(
             fastapi_users.get_register_router(UserRead, UserCreate),
@@ -68,6 +125,121 @@ class CocatApp:
             tags=["users"],
         )
 
+        if metrics:
+            async def metrics_auth(
+                user: models.UP | None = Depends(optional_superuser),
+                authorization: Annotated[str | None, Header()] = None,
+            ) -> None:
+                # a scraper which cannot log in can authenticate with the metrics token
+                if user is not None:
+                    return
+                if (
+                    metrics_token is not None
+                    and authorization is not None
+                    and compare_digest(authorization.encode(), f"Bearer {metrics_token}".encode())
+                ):
+                    return
+                raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED)
+
+            @app.get("/metrics", dependencies=[Depends(metrics_auth)])
+            async def get_metrics() -> Response:
+                return Response(self.render_metrics(), media_type="text/plain; version=0.0.4")
+
+        @app.get("/room/{id}/snapshot", dependencies=[Depends(current_user)])
+        async def get_snapshot(
+            id: str,
+            if_none_match: Annotated[str | None, Header()] = None,
+        ) -> Response:
+            async with self.room_manager.use_room(id) as room, room.lock:
+                etag, update = room.get_snapshot()
+            headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+            if if_none_match is not None and etag in (tag.strip() for tag in if_none_match.split(",")):
+                return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+            return Response(update, media_type="application/octet-stream", headers=headers)
+
+        @app.get("/room/{id}/epoch", dependencies=[Depends(current_user)])
+        async def get_epoch(id: str) -> dict[str, str | None]:
+            async with self.room_manager.use_room(id) as room, room.lock:
+                return {"epoch": room.epoch}
+
+        @app.post("/room/{id}/compact", dependencies=[Depends(current_superuser)])
+        async def compact_history(id: str) -> dict[str, str | None]:
+            async with self.room_manager.use_room(id) as room:
+                return {"epoch": await room.compact_history()}
+
+        @app.get("/room/{id}/events", dependencies=[Depends(current_user)])
+        async def get_events(
+            id: str,
+            start: datetime | None = None,
+            stop: datetime | None = None,
+            tag: Annotated[list[str], Query()] = [],
+            offset: Annotated[int, Query(ge=0)] = 0,
+            limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = MAX_PAGE_SIZE,
+        ) -> StreamingResponse:
+            async with self.room_manager.use_room(id) as room, room.lock:
+                uuids = query_events(room.db, start=start, stop=stop, tags=tag).uuids()
+                events = get_event_dicts(room.db, uuids[offset:offset + limit])
+            return events_response(events, offset, limit, len(uuids))
+
+        @app.get("/room/{id}/catalogues/{name}/events", dependencies=[Depends(current_user)])
+        async def get_catalogue_events(
+            id: str,
+            name: str,
+            start: datetime | None = None,
+            stop: datetime | None = None,
+            tag: Annotated[list[str], Query()] = [],
+            offset: Annotated[int, Query(ge=0)] = 0,
+            limit: Annotated[int, Query(ge=1, le=MAX_PAGE_SIZE)] = MAX_PAGE_SIZE,
+        ) -> StreamingResponse:
+            async with self.room_manager.use_room(id) as room, room.lock:
+                try:
+                    uuids = query_events(room.db, start=start, stop=stop, tags=tag, catalogue=name).uuids()
+                except RuntimeError as exc:
+                    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(exc))
+                events = get_event_dicts(room.db, uuids[offset:offset + limit])
+            return events_response(events, offset, limit, len(uuids))
+
+        @app.post("/room/{id}/events:bulk", dependencies=[Depends(current_user)])
+        async def bulk_create(
+            id: str,
+            request: Request,
+            chunk_size: Annotated[int, Query(ge=1, le=MAX_CHUNK_SIZE)] = 1000,
+        ) -> dict[str, list[str]]:
+            async with self.room_manager.use_room(id) as room:
+                # the room database is replaced if the room history is compacted
+                creator = BulkCreator(lambda: room.db, room.lock)
+                try:
+                    await creator.create(iter_items(request.stream()), chunk_size)
+                except ValueError as exc:
+                    raise HTTPException(
+                        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                        detail={
+                            "error": str(exc),
+                            "events": creator.events,
+                            "catalogues": creator.catalogues,
+                        },
+                    )
+            return {"events": creator.events, "catalogues": creator.catalogues}
+
+        async def websocket_auth(
+            websocket: WebSocket,
+            fastapiusersauth: Annotated[str | None, Cookie()] = None,
+            user_manager: BaseUserManager[models.UP, models.ID] = Depends(auth.get_user_manager),
+        ) -> WebSocket | None:
+            accept_websocket = False
+            if fastapiusersauth is not None:
+                strategy = auth.jwt_strategy
+                start = perf_counter()
+                user = await strategy.read_token(fastapiusersauth, user_manager)
+                strategy.metrics.record(perf_counter() - start)
+                if user:
+                    accept_websocket = True
+            if accept_websocket:
+                return websocket
+
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+            return None
+
         @app.websocket("/room/{id}")
         async def connect_room(
             id: str,
@@ -76,33 +248,92 @@ class CocatApp:
             if websocket is None:
                 return
 
-            await websocket.accept()
-            ywebsocket = YWebSocket(websocket, id)
-            room = await self.room_manager.get_room(ywebsocket.path)
-            await room.serve(ywebsocket)
+            channel: Channel = YWebSocket(websocket, id, self.metrics)
+            if compression is not None and SUBPROTOCOL in websocket.scope.get("subprotocols", []):
+                await websocket.accept(subprotocol=SUBPROTOCOL)
+                channel = CompressedChannel(channel, compression)
+            else:
+                await websocket.accept()
+            queued_channel = QueuedChannel(
+                channel,
+                partial(websocket.close, code=status.WS_1013_TRY_AGAIN_LATER),
+                max_size=send_queue_size,
+                overflow=send_queue_overflow,
+                metrics=self.queue_metrics,
+            )
+            async with create_task_group() as tg:
+                tg.start_soon(queued_channel.run)
+                try:
+                    async with self.room_manager.use_room(channel.path) as room:
+                        await room.serve(queued_channel)
+                except StaleClientError as exc:
+                    await websocket.close(code=WS_STALE_CLIENT, reason=str(exc))
+                tg.cancel_scope.cancel()
+
+    def render_metrics(self) -> str:
+        """
+        Returns:
+            The metrics of the server, in the Prometheus text exposition format.
+        """
+        rooms = self.room_manager.rooms
+        auth_metrics = self.auth.jwt_strategy.metrics
+        # only the largest rooms have their own labels, so that the number of series is bounded
+        largest_rooms = sorted(rooms.items(), key=lambda item: item[1].size, reverse=True)
+        labelled_rooms = largest_rooms[:self.metrics_rooms]
+        other_rooms = [room for _, room in largest_rooms[self.metrics_rooms:]]
+        client_samples = [({"room": id}, room.client_nb) for id, room in labelled_rooms]
+        size_samples = [({"room": id}, room.size) for id, room in labelled_rooms]
+        if other_rooms:
+            client_samples.append(({"room": OTHER_ROOMS}, sum(room.client_nb for room in other_rooms)))
+            size_samples.append(({"room": OTHER_ROOMS}, sum(room.size for room in other_rooms)))
+        writer = MetricsWriter()
+        writer.add("cocat_rooms_loaded", "gauge", "The number of loaded rooms.", len(rooms))
+        writer.add("cocat_room_clients", "gauge", "The number of clients connected to a room.", client_samples)
+        writer.add("cocat_room_storage_bytes", "gauge", "The size of the storage of a room.", size_samples)
+        writer.add("cocat_messages_received_total", "counter", "The number of messages received from the clients.", self.metrics.messages_received)
+        writer.add("cocat_messages_sent_total", "counter", "The number of messages sent to the clients.", self.metrics.messages_sent)
+        writer.add("cocat_received_bytes_total", "counter", "The number of bytes received from the clients.", self.metrics.bytes_received)
+        writer.add("cocat_sent_bytes_total", "counter", "The number of bytes sent to the clients.", self.metrics.bytes_sent)
+        writer.add_histogram("cocat_update_apply_seconds", "The time it takes to apply a message from a client.", self.metrics.update_apply)
+        writer.add_histogram("cocat_storage_flush_seconds", "The time it takes to write updates to the storage.", self.metrics.storage_flush)
+        writer.add_histogram("cocat_auth_seconds", "The time it takes to authenticate a websocket connection.", auth_metrics.latency)
+        writer.add("cocat_auth_cache_hits_total", "counter", "The number of authentications served from the cache.", auth_metrics.cache_hits)
+        writer.add("cocat_send_queue_messages", "gauge", "The number of messages queued for the clients.", self.queue_metrics.queued)
+        writer.add("cocat_send_queue_overflows_total", "counter", "The number of send queue overflows.", self.queue_metrics.overflows)
+        writer.add("cocat_send_queue_disconnections_total", "counter", "The number of clients disconnected by a send queue overflow.", self.queue_metrics.disconnections)
+        writer.add("cocat_event_loop_last_lag_seconds", "gauge", "The last measured lag of the event loop.", self.metrics.last_loop_lag)
+        writer.add_histogram("cocat_event_loop_lag_seconds", "The lag of the event loop.", self.metrics.loop_lag)
+        return writer.render()
+
+
+MAX_PAGE_SIZE = 1000
+# the label of the rooms which are aggregated in the metrics
+OTHER_ROOMS = "_other"
+MAX_CHUNK_SIZE = 10000
+
 
+def events_response(events: list[dict[str, Any]], offset: int, limit: int, total: int) -> StreamingResponse:
+    headers = {"X-Total-Count": str(total)}
+    if offset + limit < total:
+        headers["X-Next-Offset"] = str(offset + limit)
+    return StreamingResponse(iter_json(events), media_type="application/json", headers=headers)
 
-async def websocket_auth(
-    websocket: WebSocket,
-    fastapiusersauth: Annotated[str | None, Cookie()] = None,
-    user_manager: BaseUserManager[models.UP, models.ID] = Depends(get_user_manager),
-) -> WebSocket | None:
-    accept_websocket = False
-    if fastapiusersauth is not None:
-        user = await get_jwt_strategy().read_token(fastapiusersauth, user_manager)  # type: ignore[func-returns-value,arg-type]
-        if user:
-            accept_websocket = True
-    if accept_websocket:
-        return websocket
 
-    await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
-    return None
+def iter_json(items: list[dict[str, Any]]) -> Iterator[bytes]:
+    # encode the items one at a time, so that the encoded response is never held in memory at once
+    yield b"["
+    for i, item in enumerate(items):
+        if i:
+            yield b","
+        yield json.dumps(item).encode()
+    yield b"]"
 
 
 class YWebSocket(Channel):
-    def __init__(self, websocket: WebSocket, path: str) -> None:
+    def __init__(self, websocket: WebSocket, path: str, metrics: ServerMetrics) -> None:
         self._websocket = websocket
         self._path = path
+        self._metrics = metrics
 
     @property
     def path(self) -> str:
@@ -110,12 +341,17 @@ class YWebSocket(Channel):
 
     async def __anext__(self):
         try:
-            return await self._websocket.receive_bytes()
+            return await self.recv()
         except WebSocketDisconnect:
             raise StopAsyncIteration()
 
     async def send(self, message: bytes) -> None:
         await self._websocket.send_bytes(message)
+        self._metrics.messages_sent += 1
+        self._metrics.bytes_sent += len(message)
 
     async def recv(self) -> bytes:
-        return await self._websocket.receive_bytes()
+        message = await self._websocket.receive_bytes()
+        self._metrics.messages_received += 1
+        self._metrics.bytes_received += len(message)
+        return message
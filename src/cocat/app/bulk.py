@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+import codecs
+import json
+from collections.abc import AsyncIterator, Callable
+from typing import Any
+from uuid import UUID
+
+from anyio import Lock
+from anyio.lowlevel import checkpoint
+
+from ..catalogue import Catalogue
+from ..db import DB
+from ..event import Event
+from ..models import CatalogueModel, EventModel
+
+
+class ItemParser:
+    """
+    An incremental parser for a JSON array or for JSON Lines.
+    """
+    def __init__(self) -> None:
+        self._decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._array: bool | None = None
+        self._array_closed = False
+        self._expect_comma = False
+
+    def feed(self, data: bytes, final: bool = False) -> list[Any]:
+        """
+        Args:
+            data: The next chunk of data.
+            final: Whether this is the last chunk of data.
+
+        Returns:
+            The items that could be parsed.
+        """
+        buffer = self._buffer + self._text_decoder.decode(data, final)
+        items = []
+        pos = 0
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos == len(buffer):
+                break
+            if self._array is None:
+                self._array = buffer[pos] == "["
+                if self._array:
+                    pos += 1
+                    continue
+            if self._array:
+                if self._array_closed:
+                    raise ValueError("Unexpected data after the JSON array")
+                if buffer[pos] == "]":
+                    self._array_closed = True
+                    pos += 1
+                    continue
+                if self._expect_comma:
+                    if buffer[pos] != ",":
+                        raise ValueError("Expected ',' between the items of the JSON array")
+                    self._expect_comma = False
+                    pos += 1
+                    continue
+            try:
+                item, end = self._decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as exc:
+                if final:
+                    raise ValueError(f"Invalid JSON: {exc}")
+                # the item may be incomplete, wait for more data
+                break
+            if end == len(buffer) and not final and isinstance(item, (int, float)) and not isinstance(item, bool):
+                # the digits of a number may continue in the next chunk
+                break
+            pos = end
+            items.append(item)
+            self._expect_comma = self._array
+        self._buffer = buffer[pos:]
+        if final and self._array and not self._array_closed:
+            raise ValueError("Unterminated JSON array")
+        return items
+
+
+async def iter_items(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """
+    Args:
+        chunks: The chunks of a JSON array or of JSON Lines.
+
+    Yields:
+        The parsed items.
+    """
+    parser = ItemParser()
+    async for chunk in chunks:
+        for item in parser.feed(chunk):
+            yield item
+    for item in parser.feed(b"", final=True):
+        yield item
+
+
+class BulkCreator:
+    """
+    Creates events and catalogues in a database from their JSON representation,
+    in chunked transactions.
+    """
+    def __init__(self, db: DB | Callable[[], DB], lock: Lock | None = None) -> None:
+        """
+        Args:
+            db: The database in which to create the events and catalogues, or a callable
+                returning it when a chunk is applied, if the database can be replaced.
+            lock: The lock to hold while applying a chunk, if the database can be updated
+                in a worker thread.
+        """
+        self._get_db = (lambda: db) if isinstance(db, DB) else db
+        self._lock = Lock() if lock is None else lock
+        self._index = 0
+        self.events: list[str] = []
+        self.catalogues: list[str] = []
+
+    async def create(self, items: AsyncIterator[Any], chunk_size: int = 1000) -> None:
+        """
+        Creates events and catalogues. An item with a `name` is a catalogue, whose `events`
+        are the UUIDs of existing events (or of events created before it), otherwise it is
+        an event. The items of a chunk are all validated before the chunk is applied in
+        a single transaction.
+
+        Args:
+            items: The events and catalogues to create.
+            chunk_size: The number of items applied in a transaction.
+
+        Raises:
+            ValueError: An item is not valid. The chunks before it have been applied.
+        """
+        chunk = []
+        async for item in items:
+            chunk.append(item)
+            if len(chunk) == chunk_size:
+                async with self._lock:
+                    self._apply(chunk)
+                chunk = []
+                # let the room send the update of the chunk
+                await checkpoint()
+        if chunk:
+            async with self._lock:
+                self._apply(chunk)
+
+    def _apply(self, chunk: list[Any]) -> None:
+        db = self._get_db()
+        models: list[EventModel | CatalogueModel] = []
+        event_uuids: set[str] = set()
+        catalogue_uuids: set[str] = set()
+        for item in chunk:
+            try:
+                if not isinstance(item, dict):
+                    raise ValueError("not a JSON object")
+                model: EventModel | CatalogueModel
+                if "name" in item:
+                    model = CatalogueModel(**item)
+                    uuid = str(model.uuid)
+                    if uuid in catalogue_uuids or uuid in db._catalogue_maps:
+                        raise ValueError(f"a catalogue already exists with UUID: {uuid}")
+                    catalogue_uuids.add(uuid)
+                    model.events = [normalize_event_uuid(uuid) for uuid in model.events]
+                    for uuid in model.events:
+                        if uuid not in event_uuids and uuid not in db._event_maps:
+                            raise ValueError(f"no event found with UUID: {uuid}")
+                else:
+                    model = EventModel(**item)
+                    uuid = str(model.uuid)
+                    if uuid in event_uuids or uuid in db._event_maps:
+                        raise ValueError(f"an event already exists with UUID: {uuid}")
+                    event_uuids.add(uuid)
+            except ValueError as exc:
+                raise ValueError(f"Item {self._index}: {exc}")
+            models.append(model)
+            self._index += 1
+
+        with db.transaction():
+            for model in models:
+                uuid = str(model.uuid)
+                if isinstance(model, EventModel):
+                    db._event_maps[uuid] = Event.new(model, db)._map
+                    self.events.append(uuid)
+                else:
+                    db._catalogue_maps[uuid] = Catalogue.new(model, db)._map
+                    self.catalogues.append(uuid)
+
+
+def normalize_event_uuid(uuid: str) -> str:
+    """
+    Args:
+        uuid: The UUID of an event, in any of the forms accepted by `UUID`.
+
+    Returns:
+        The UUID in its canonical form, as the events are stored.
+    """
+    try:
+        return str(UUID(uuid))
+    except ValueError:
+        raise ValueError(f"no event found with UUID: {uuid}")
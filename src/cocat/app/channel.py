@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import logging
+from collections import deque
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
+from typing import Literal
+
+from anyio import Event
+from pycrdt import Channel, Decoder, YMessageType, YSyncMessageType, create_update_message, merge_updates
+
+Overflow = Literal["merge", "disconnect"]
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(eq=False)
+class QueueMetrics:
+    """
+    The metrics of the send queues of the clients.
+    """
+    overflows: int = 0
+    disconnections: int = 0
+    max_size: int = 0
+    queues: set[QueuedChannel] = field(default_factory=set)
+
+    @property
+    def queued(self) -> int:
+        """
+        Returns:
+            The number of messages in all the queues.
+        """
+        return sum(queue.size for queue in self.queues)
+
+
+class QueuedChannel(Channel):
+    """
+    A channel which queues the messages to send, so that a slow client doesn't slow down
+    the room it is connected to. The queue is drained by the `run` task.
+    """
+    def __init__(
+        self,
+        channel: Channel,
+        close: Callable[[], Awaitable[None]],
+        *,
+        max_size: int = 1000,
+        overflow: Overflow = "merge",
+        metrics: QueueMetrics | None = None,
+    ) -> None:
+        """
+        Args:
+            channel: The channel to send the messages through.
+            close: The callable used to close the connection.
+            max_size: The number of queued messages above which the queue overflows.
+            overflow: What to do when the queue overflows: merge the queued updates into one,
+                or disconnect the client, which will have to synchronize again.
+            metrics: The metrics in which to record the queue activity.
+        """
+        self._channel = channel
+        self._close = close
+        self._max_size = max_size
+        self._overflow = overflow
+        self._metrics = QueueMetrics() if metrics is None else metrics
+        self._queue: deque[bytes] = deque()
+        self._ready = Event()
+        self._disconnected = False
+
+    @property
+    def path(self) -> str:
+        return self._channel.path
+
+    @property
+    def size(self) -> int:
+        """
+        Returns:
+            The number of queued messages.
+        """
+        return len(self._queue)
+
+    async def __anext__(self) -> bytes:
+        return await self._channel.__anext__()
+
+    async def recv(self) -> bytes:
+        return await self._channel.recv()
+
+    async def send(self, message: bytes) -> None:
+        if self._disconnected:
+            raise RuntimeError("Client disconnected")
+        self._queue.append(message)
+        if len(self._queue) > self._max_size:
+            self._metrics.overflows += 1
+            if self._overflow == "merge":
+                merge_queued_updates(self._queue)
+            else:
+                self._disconnected = True
+                self._metrics.disconnections += 1
+                self._queue.clear()
+        self._metrics.max_size = max(self._metrics.max_size, len(self._queue))
+        self._ready.set()
+        if self._disconnected:
+            raise RuntimeError("Client disconnected, its send queue overflowed")
+
+    async def run(self) -> None:
+        """
+        Sends the queued messages until the client is disconnected.
+        """
+        self._metrics.queues.add(self)
+        try:
+            while True:
+                await self._ready.wait()
+                self._ready = Event()
+                while self._queue:
+                    await self._channel.send(self._queue.popleft())
+                if self._disconnected:
+                    await self._close()
+                    return
+        except Exception:
+            # the connection is closed
+            logger.warning("Could not send a message to a client of room %s", self.path, exc_info=True)
+            self._disconnected = True
+            self._queue.clear()
+        finally:
+            self._metrics.queues.discard(self)
+
+
+def merge_queued_updates(queue: deque[bytes]) -> None:
+    """
+    Merges the update messages of a queue into one, at the end of the queue.
+    The other messages keep their order.
+
+    Args:
+        queue: The queue of messages.
+    """
+    updates = []
+    messages = []
+    for message in queue:
+        if message[0] == YMessageType.SYNC and message[1] == YSyncMessageType.SYNC_UPDATE:
+            update = Decoder(message[2:]).read_message()
+            assert update is not None
+            updates.append(update)
+        else:
+            messages.append(message)
+    queue.clear()
+    queue.extend(messages)
+    if updates:
+        queue.append(create_update_message(merge_updates(*updates)))
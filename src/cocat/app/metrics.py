@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+from bisect import bisect_left
+from collections.abc import Iterable, Sequence
+from dataclasses import dataclass, field
+
+from anyio import current_time, sleep
+
+# the default buckets of the Prometheus client libraries, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+Labels = dict[str, str]
+
+
+class Histogram:
+    """
+    A histogram of observed values, such as latencies.
+    """
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        """
+        Args:
+            buckets: The upper bounds of the buckets, in increasing order.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """
+        Args:
+            value: The observed value.
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+@dataclass(eq=False)
+class ServerMetrics:
+    """
+    The metrics of the server which are not held by its components.
+    """
+    messages_received: int = 0
+    messages_sent: int = 0
+    bytes_received: int = 0
+    bytes_sent: int = 0
+    update_apply: Histogram = field(default_factory=Histogram)
+    storage_flush: Histogram = field(default_factory=Histogram)
+    loop_lag: Histogram = field(default_factory=Histogram)
+    last_loop_lag: float = 0
+
+
+async def monitor_loop_lag(metrics: ServerMetrics, interval: float = 0.5) -> None:
+    """
+    Measures how late the event loop wakes up a sleeping task, which shows how busy it is.
+
+    Args:
+        metrics: The metrics in which to record the lag.
+        interval: The time (in seconds) between measurements.
+    """
+    while True:
+        start = current_time()
+        await sleep(interval)
+        metrics.last_loop_lag = max(0, current_time() - start - interval)
+        metrics.loop_lag.observe(metrics.last_loop_lag)
+
+
+class MetricsWriter:
+    """
+    Writes metrics in the Prometheus text exposition format.
+    """
+    def __init__(self) -> None:
+        self._lines: list[str] = []
+
+    def add(
+        self,
+        name: str,
+        type: str,
+        help: str,
+        samples: float | Iterable[tuple[Labels, float]],
+    ) -> None:
+        """
+        Args:
+            name: The metric name.
+            type: The metric type (`"counter"` or `"gauge"`).
+            help: The metric description.
+            samples: The value of the metric, or its values for each set of labels.
+        """
+        self._add_header(name, type, help)
+        if isinstance(samples, (int, float)):
+            samples = [({}, samples)]
+        for labels, value in samples:
+            self._add_sample(name, labels, value)
+
+    def add_histogram(self, name: str, help: str, histogram: Histogram) -> None:
+        """
+        Args:
+            name: The metric name.
+            help: The metric description.
+            histogram: The histogram of the metric.
+        """
+        self._add_header(name, "histogram", help)
+        cumulative_count = 0
+        for bound, count in zip((*histogram.buckets, "+Inf"), histogram.counts):
+            cumulative_count += count
+            self._add_sample(f"{name}_bucket", {"le": str(bound)}, cumulative_count)
+        self._add_sample(f"{name}_sum", {}, histogram.sum)
+        self._add_sample(f"{name}_count", {}, histogram.count)
+
+    def render(self) -> str:
+        """
+        Returns:
+            The metrics as text.
+        """
+        return "\n".join(self._lines) + "\n"
+
+    def _add_header(self, name: str, type: str, help: str) -> None:
+        self._lines.append(f"# HELP {name} {help}")
+        self._lines.append(f"# TYPE {name} {type}")
+
+    def _add_sample(self, name: str, labels: Labels, value: float) -> None:
+        if labels:
+            label_str = ",".join(f'{key}="{escape_label(val)}"' for key, val in labels.items())
+            name = f"{name}{{{label_str}}}"
+        self._lines.append(f"{name} {value}")
+
+
+def merge_metrics(metrics: Iterable[tuple[Labels, str]]) -> str:
+    """
+    Merges metrics in the Prometheus text exposition format, such as the metrics of several processes.
+
+    Args:
+        metrics: The metrics to merge, with the labels to add to each of their samples.
+
+    Returns:
+        The merged metrics, where the samples of a metric are grouped under its header.
+    """
+    families: dict[str, tuple[list[str], list[str]]] = {}
+    for labels, text in metrics:
+        headers: list[str] = []
+        samples: list[str] = []
+        for line in text.splitlines():
+            if line.startswith("# "):
+                # "# HELP name ..." or "# TYPE name ..."
+                headers, samples = families.setdefault(line.split(" ", 3)[2], ([], []))
+                if line not in headers:
+                    headers.append(line)
+            elif line:
+                samples.append(add_labels(line, labels))
+    return "".join(
+        "\n".join(headers + samples) + "\n"
+        for headers, samples in families.values()
+    )
+
+
+def add_labels(sample: str, labels: Labels) -> str:
+    """
+    Args:
+        sample: A sample in the Prometheus text exposition format.
+        labels: The labels to add to the sample.
+
+    Returns:
+        The sample with the labels.
+    """
+    if not labels:
+        return sample
+    label_str = ",".join(f'{key}="{escape_label(val)}"' for key, val in labels.items())
+    name, labelled, rest = sample.partition("{")
+    if labelled:
+        return f"{name}{{{label_str},{rest}"
+    name, value = sample.split(" ", 1)
+    return f"{name}{{{label_str}}} {value}"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
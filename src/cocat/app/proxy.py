@@ -0,0 +1,214 @@
+from __future__ import annotations
+
+from bisect import bisect
+from collections.abc import Sequence
+from contextlib import asynccontextmanager
+from hashlib import sha256
+from typing import Generic, TypeVar
+
+import httpx
+from anyio import CancelScope, create_task_group, fail_after, sleep
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.responses import StreamingResponse
+from httpx_ws import (
+    AsyncWebSocketSession,
+    WebSocketDisconnect as WorkerWebSocketDisconnect,
+    WebSocketNetworkError,
+    WebSocketUpgradeError,
+    aconnect_ws,
+)
+from starlette.background import BackgroundTask
+from starlette.websockets import WebSocketState
+
+from .metrics import merge_metrics
+
+T = TypeVar("T")
+
+# headers which only apply to a single connection and must not be forwarded
+HOP_BY_HOP_HEADERS = {
+    "connection",
+    "content-length",
+    "host",
+    "keep-alive",
+    "proxy-authenticate",
+    "proxy-authorization",
+    "te",
+    "trailer",
+    "transfer-encoding",
+    "upgrade",
+}
+MAX_MESSAGE_SIZE = 1 << 30
+
+
+class HashRing(Generic[T]):
+    """
+    A consistent hash ring, which maps keys to nodes so that only a fraction of the keys
+    are mapped to other nodes when the number of nodes changes.
+    """
+    def __init__(self, nodes: Sequence[T], replicas: int = 100) -> None:
+        """
+        Args:
+            nodes: The nodes of the ring.
+            replicas: The number of points of each node on the ring.
+        """
+        points = sorted(
+            (hash_key(f"{i}-{replica}"), node)
+            for i, node in enumerate(nodes)
+            for replica in range(replicas)
+        )
+        self._hashes = [hash for hash, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def get(self, key: str) -> T:
+        """
+        Args:
+            key: The key to map.
+
+        Returns:
+            The node the key is mapped to.
+        """
+        index = bisect(self._hashes, hash_key(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+def hash_key(key: str) -> int:
+    return int.from_bytes(sha256(key.encode()).digest()[:8], "big")
+
+
+class ProxyApp:
+    """
+    An application which forwards the requests for a room to the worker owning the room,
+    and the other requests to the first worker. The metrics of all the workers are merged.
+    """
+    def __init__(self, worker_urls: Sequence[str]) -> None:
+        """
+        Args:
+            worker_urls: The URLs of the workers.
+        """
+        self._worker_urls = worker_urls
+        self._ring = HashRing(worker_urls)
+
+        @asynccontextmanager
+        async def lifespan(app: FastAPI):
+            async with httpx.AsyncClient(timeout=None) as self._client:
+                await self._wait_for_workers()
+                yield
+
+        self.app = app = FastAPI(lifespan=lifespan)
+
+        @app.websocket("/room/{id}")
+        async def connect_room(id: str, websocket: WebSocket):
+            url = f"{self.get_worker_url(id).replace('http', 'ws', 1)}/room/{id}"
+            headers = {"cookie": websocket.headers.get("cookie", "")}
+            subprotocols = websocket.scope.get("subprotocols") or None
+            worker_websocket: AsyncWebSocketSession
+            try:
+                async with aconnect_ws(
+                    url,
+                    self._client,
+                    headers=headers,
+                    subprotocols=subprotocols,
+                    keepalive_ping_interval_seconds=None,
+                    max_message_size_bytes=MAX_MESSAGE_SIZE,
+                ) as worker_websocket:
+                    await websocket.accept(subprotocol=worker_websocket.subprotocol)
+                    async with create_task_group() as tg:
+                        tg.start_soon(forward_to_worker, websocket, worker_websocket, tg.cancel_scope)
+                        tg.start_soon(forward_to_client, worker_websocket, websocket, tg.cancel_scope)
+            except WebSocketUpgradeError:
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                return
+
+            if websocket.client_state == WebSocketState.CONNECTED:
+                await websocket.close()
+
+        @app.get("/metrics")
+        async def get_metrics(request: Request) -> Response:
+            headers = [(key, value) for key, value in request.headers.items() if key not in HOP_BY_HOP_HEADERS]
+            metrics = []
+            for i, worker_url in enumerate(self._worker_urls):
+                worker_response = await self._client.get(f"{worker_url}/metrics", headers=headers)
+                if worker_response.status_code != status.HTTP_200_OK:
+                    return Response(
+                        worker_response.content,
+                        status_code=worker_response.status_code,
+                        media_type=worker_response.headers.get("content-type"),
+                    )
+                metrics.append(({"worker": str(i)}, worker_response.text))
+            return Response(merge_metrics(metrics), media_type="text/plain; version=0.0.4")
+
+        @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"])
+        async def forward(path: str, request: Request) -> StreamingResponse:
+            parts = path.split("/")
+            if parts[0] == "room" and len(parts) > 1:
+                worker_url = self.get_worker_url(parts[1])
+            else:
+                worker_url = self._worker_urls[0]
+            worker_request = self._client.build_request(
+                request.method,
+                f"{worker_url}/{path}",
+                params=request.url.query,
+                headers=[(key, value) for key, value in request.headers.items() if key not in HOP_BY_HOP_HEADERS],
+                content=request.stream(),
+            )
+            worker_response = await self._client.send(worker_request, stream=True)
+            response = StreamingResponse(
+                worker_response.aiter_raw(),
+                status_code=worker_response.status_code,
+                background=BackgroundTask(worker_response.aclose),
+            )
+            response.raw_headers.extend(
+                (key.lower().encode("latin-1"), value.encode("latin-1"))
+                for key, value in worker_response.headers.multi_items()
+                if key.lower() not in HOP_BY_HOP_HEADERS
+            )
+            return response
+
+    def get_worker_url(self, room_id: str) -> str:
+        """
+        Args:
+            room_id: The room ID.
+
+        Returns:
+            The URL of the worker owning the room.
+        """
+        return self._ring.get(room_id)
+
+    async def _wait_for_workers(self, timeout: float = 60) -> None:
+        with fail_after(timeout):
+            for url in self._worker_urls:
+                while True:
+                    try:
+                        await self._client.get(url)
+                    except httpx.TransportError:
+                        await sleep(0.1)
+                    else:
+                        break
+
+
+async def forward_to_worker(
+    websocket: WebSocket, worker_websocket: AsyncWebSocketSession, cancel_scope: CancelScope
+) -> None:
+    try:
+        while True:
+            await worker_websocket.send_bytes(await websocket.receive_bytes())
+    except (WebSocketDisconnect, WebSocketNetworkError):
+        pass
+    finally:
+        cancel_scope.cancel()
+
+
+async def forward_to_client(
+    worker_websocket: AsyncWebSocketSession, websocket: WebSocket, cancel_scope: CancelScope
+) -> None:
+    try:
+        while True:
+            await websocket.send_bytes(bytes(await worker_websocket.receive_bytes()))
+    except WorkerWebSocketDisconnect as exc:
+        # let the client know why the worker closed the connection (e.g. a stale document)
+        if exc.code >= 4000 and websocket.client_state == WebSocketState.CONNECTED:
+            await websocket.close(code=exc.code, reason=exc.reason or None)
+    except (WebSocketNetworkError, WebSocketDisconnect):
+        pass
+    finally:
+        cancel_scope.cancel()
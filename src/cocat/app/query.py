@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+from collections.abc import Iterable
+from datetime import datetime
+from typing import Any
+
+from ..db import DB
+from ..query import Query
+
+
+def query_events(
+    db: DB,
+    *,
+    start: datetime | None = None,
+    stop: datetime | None = None,
+    tags: Iterable[str] = (),
+    catalogue: str | None = None,
+) -> Query:
+    """
+    Args:
+        db: The database to query.
+        start: If given, only the events which stop after this date are selected.
+        stop: If given, only the events which start before this date are selected.
+        tags: Only the events which have all these tags are selected.
+        catalogue: If given, only the events of this catalogue (UUID or name) are selected.
+
+    Returns:
+        The query of the selected events, sorted by start date (and by UUID for the same date,
+        so that the pages of the events don't overlap).
+    """
+    query = db.query().order_by("start", "uuid")
+    if start is not None:
+        query = query.where(stop__gte=start)
+    if stop is not None:
+        query = query.where(start__lte=stop)
+    for tag in tags:
+        query = query.where(tags__contains=tag)
+    if catalogue is not None:
+        query = query.in_catalogue(catalogue)
+    return query
+
+
+def get_event_dicts(db: DB, uuids: Iterable[str]) -> list[dict[str, Any]]:
+    """
+    Args:
+        db: The database of the events.
+        uuids: The UUIDs of the events to get.
+
+    Returns:
+        The events as dictionaries.
+    """
+    with db.transaction():
+        return [db.get_event(uuid).to_dict() for uuid in uuids]
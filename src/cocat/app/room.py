@@ -0,0 +1,497 @@
+from __future__ import annotations
+
+from collections.abc import AsyncGenerator, Callable
+from contextlib import asynccontextmanager
+from hashlib import sha256
+
+from math import inf
+from threading import get_ident
+from typing import TypeVar
+
+from anyio import (
+    TASK_STATUS_IGNORED,
+    CancelScope,
+    Lock,
+    WouldBlock,
+    create_memory_object_stream,
+    current_time,
+    get_cancelled_exc_class,
+    sleep,
+    to_thread,
+)
+from anyio.abc import TaskStatus
+from anyio.streams.memory import MemoryObjectReceiveStream, MemoryObjectSendStream
+from pycrdt import (
+    Channel,
+    Decoder,
+    TransactionEvent,
+    YMessageType,
+    YSyncMessageType,
+    create_sync_message,
+    create_update_message,
+    handle_sync_message,
+    merge_updates,
+)
+from wiredb import Room, RoomManager
+
+from ..compression import StaleClientError
+from ..db import DB
+from ..report import read_state
+from .metrics import ServerMetrics
+from .store import RoomStore
+
+
+T = TypeVar("T")
+
+
+class Clock:
+    """
+    The clock used by the rooms and the room manager to measure time and to wait.
+    """
+    def time(self) -> float:
+        """
+        Returns:
+            The current time (in seconds), as given by the event loop.
+        """
+        return current_time()
+
+    async def sleep(self, delay: float) -> None:
+        """
+        Args:
+            delay: The time (in seconds) to wait for.
+        """
+        await sleep(delay)
+
+
+class StoredRoom(Room):
+    def __init__(
+        self,
+        store: RoomStore,
+        id: str,
+        *,
+        broadcast_window: float = 0,
+        broadcast_max_delay: float = 0.1,
+        thread_threshold: int | None = 1_000_000,
+        metrics: ServerMetrics | None = None,
+        clock: Clock | None = None,
+    ) -> None:
+        """
+        Args:
+            store: The store of the room.
+            id: The room ID.
+            broadcast_window: The time (in seconds) during which the updates received by the room
+                are merged before being sent to the clients, or 0 to send every update.
+            broadcast_max_delay: The maximum time (in seconds) during which the updates are merged,
+                if the room keeps receiving updates.
+            thread_threshold: The size (in bytes) above which a message received from a client
+                is applied in a worker thread, or `None` to apply every message in the event loop.
+            metrics: The metrics in which to record the time it takes to apply a message.
+            clock: The clock used to merge the updates, by default the event loop clock.
+        """
+        super().__init__(id)
+        self._broadcast_window = broadcast_window
+        self._broadcast_max_delay = broadcast_max_delay
+        self._thread_threshold = thread_threshold
+        self._metrics = metrics
+        self._clock = Clock() if clock is None else clock
+        self._compacting = False
+        self._storage = store.open(id)
+        self._db: DB | None = None
+        self._snapshot: tuple[str, bytes] | None = None
+        self._lock = Lock()
+        self._write_lock = Lock()
+        self._thread_id = get_ident()
+        # incremented when the document is replaced, so that the updates of the previous
+        # document are neither stored nor broadcast
+        self._generation = 0
+        self._update_streams: set[MemoryObjectSendStream[tuple[int, bytes]]] = set()
+        self._pending_updates: list[bytes] = []
+        self._client_scopes: dict[Channel, CancelScope] = {}
+        self._retired_clients: set[int] = set()
+        self._subscription = self.doc.observe(self._on_update)
+
+    @property
+    def size(self) -> int:
+        """
+        Returns:
+            The size of the room storage, used as an estimate of the room memory footprint.
+        """
+        return self._storage.size
+
+    @property
+    def client_nb(self) -> int:
+        """
+        Returns:
+            The number of clients connected to the room.
+        """
+        return len(self._clients)
+
+    @property
+    def epoch(self) -> str | None:
+        """
+        Returns:
+            The epoch of the room document, which changes when its history is compacted.
+        """
+        return self.db.epoch
+
+    @property
+    def lock(self) -> Lock:
+        """
+        Returns:
+            The lock which must be held to access the room document, since it can be
+            updated in a worker thread.
+        """
+        return self._lock
+
+    @property
+    def db(self) -> DB:
+        """
+        Returns:
+            The database of the room, created when first accessed.
+        """
+        if self._db is None:
+            self._db = DB(doc=self.doc)
+        return self._db
+
+    def get_snapshot(self) -> tuple[str, bytes]:
+        """
+        Gets the room state as an update, which is cached until the room changes.
+
+        Returns:
+            The ETag of the snapshot, derived from the update, and the update.
+        """
+        if self._snapshot is None:
+            # the state vector doesn't change when content is deleted
+            update = self.doc.get_update()
+            self._snapshot = (f'"{sha256(update).hexdigest()}"', update)
+        return self._snapshot
+
+    @asynccontextmanager
+    async def updates(self) -> AsyncGenerator[MemoryObjectReceiveStream[tuple[int, bytes]]]:
+        """
+        Subscribes to the updates of the room document, wherever they are applied.
+
+        Yields:
+            The stream of updates, with the generation of the document they were applied to.
+        """
+        send_stream, receive_stream = create_memory_object_stream[tuple[int, bytes]](max_buffer_size=inf)
+        self._update_streams.add(send_stream)
+        try:
+            async with receive_stream:
+                yield receive_stream
+        finally:
+            self._update_streams.discard(send_stream)
+            send_stream.close()
+
+    def _on_update(self, event: TransactionEvent) -> None:
+        self._snapshot = None
+        # the event cannot leave the thread it was created in, and the streams cannot be
+        # used outside the event loop thread
+        update = event.update
+        if get_ident() == self._thread_id:
+            self._send_update(update)
+        else:
+            self._pending_updates.append(update)
+
+    def _send_update(self, update: bytes) -> None:
+        for stream in self._update_streams:
+            stream.send_nowait((self._generation, update))
+
+    def _send_pending_updates(self) -> None:
+        updates = self._pending_updates
+        self._pending_updates = []
+        for update in updates:
+            self._send_update(update)
+
+    async def apply_sync_message(self, message: bytes) -> bytes | None:
+        """
+        Applies a sync message received from a client, in a worker thread if it is larger
+        than the thread threshold. The room lock must be held.
+
+        Args:
+            message: The sync message, without its message type.
+
+        Returns:
+            The reply to send to the client, if any.
+        """
+        start = current_time()
+        try:
+            if self._thread_threshold is None or len(message) < self._thread_threshold:
+                async with self.doc.new_transaction():
+                    return handle_sync_message(message, self.doc)
+            try:
+                return await to_thread.run_sync(handle_sync_message, message, self.doc)
+            finally:
+                self._send_pending_updates()
+        finally:
+            if self._metrics is not None:
+                self._metrics.update_apply.observe(current_time() - start)
+
+    async def serve(self, client: Channel, *, task_status: TaskStatus[None] = TASK_STATUS_IGNORED) -> None:
+        """
+        Synchronizes a client with the room, until it disconnects or the room history is compacted.
+
+        Args:
+            client: The client to serve.
+            task_status: The task status that is set when the client is synchronizing.
+
+        Raises:
+            StaleClientError: The client document holds history dropped by a compaction.
+        """
+        self._clients.add(client)
+        started = False
+        try:
+            with CancelScope() as self._client_scopes[client]:
+                async with self._lock:
+                    sync_message = create_sync_message(self.doc)
+                await client.send(sync_message)
+                task_status.started()
+                started = True
+                async for message in client:
+                    if message[0] == YMessageType.SYNC:
+                        if message[1] == YSyncMessageType.SYNC_STEP1:
+                            self._check_client(message[2:])
+                        async with self._lock:
+                            reply = await self.apply_sync_message(message[1:])
+                        if reply is not None:
+                            await client.send(reply)
+        except (StaleClientError, get_cancelled_exc_class()):
+            raise
+        except BaseException:
+            pass
+        finally:
+            if not started:
+                task_status.started()
+            del self._client_scopes[client]
+            self._remove_client(client)
+
+    def _check_client(self, payload: bytes) -> None:
+        state = Decoder(payload).read_message()
+        if state is not None and not self._retired_clients.isdisjoint(read_state(state)):
+            raise StaleClientError("The client document holds history dropped by a compaction of the room")
+
+    async def run(self, *, task_status: TaskStatus[None] = TASK_STATUS_IGNORED) -> None:
+        await self.task_group.start(self.connect_to_storage)
+        async with self.updates() as updates:
+            task_status.started()
+            async for generation, update in updates:
+                if self._broadcast_window > 0:
+                    generation, update = await self._merge_updates(generation, update, updates)
+                if self._clients and generation == self._generation:
+                    await self._broadcast(create_update_message(update))
+
+    async def _merge_updates(
+        self,
+        generation: int,
+        update: bytes,
+        updates: MemoryObjectReceiveStream[tuple[int, bytes]],
+    ) -> tuple[int, bytes]:
+        received = [(generation, update)]
+        start = self._clock.time()
+        while True:
+            await self._clock.sleep(min(self._broadcast_window, start + self._broadcast_max_delay - self._clock.time()))
+            if not receive_updates(updates, received) or self._clock.time() - start >= self._broadcast_max_delay:
+                break
+        # only the updates of the last document can be broadcast
+        generation = received[-1][0]
+        merged = [update for update_generation, update in received if update_generation == generation]
+        return generation, merged[0] if len(merged) == 1 else merge_updates(*merged)
+
+    async def _broadcast(self, message: bytes) -> None:
+        for client in set(self._clients):
+            try:
+                await client.send(message)
+            except get_cancelled_exc_class():
+                self._remove_client(client)
+                raise
+            except BaseException:
+                self._remove_client(client)
+
+    async def connect_to_storage(self, *, task_status: TaskStatus[None]) -> None:
+        async with self._storage:
+            async with self._lock:
+                await self._storage.load(self.doc)
+                # the loaded updates are already stored
+                self._pending_updates.clear()
+                self._retired_clients = self.db.retired_clients
+            async with self.updates() as updates:
+                task_status.started()
+                self._check_compaction()
+                async for generation, update in updates:
+                    async with self._write_lock:
+                        if generation == self._generation:
+                            await self._storage.write(update)
+                            self._check_compaction()
+
+    async def compact_history(self) -> str:
+        """
+        Replaces the room document with a compacted one, which only holds the live state,
+        and replaces the stored updates with it. The clients are disconnected, and must
+        synchronize a document of the new epoch when they reconnect: the documents which
+        hold the dropped history are refused.
+
+        Returns:
+            The new epoch of the room.
+        """
+        # no update of the previous document can be stored once it is replaced
+        async with self._write_lock:
+            async with self._lock:
+                if self._thread_threshold is None or self.size < self._thread_threshold:
+                    db = self.db.compact()
+                else:
+                    db = await to_thread.run_sync(self.db.compact)
+                self.doc.unobserve(self._subscription)
+                self._generation += 1
+                self._doc = db.doc
+                self._db = db
+                self._snapshot = None
+                self._retired_clients = db.retired_clients
+                self._subscription = self.doc.observe(self._on_update)
+                for scope in self._client_scopes.values():
+                    scope.cancel()
+            await self._storage.reset(self.doc, self._lock)
+        assert db.epoch is not None
+        return db.epoch
+
+    async def close(self) -> None:
+        """
+        Flushes the room state to its snapshot and stops the room.
+        """
+        with CancelScope(shield=True):
+            await self._storage.compact(self.doc, self._lock)
+        self.task_group.cancel_scope.cancel()
+
+    def _check_compaction(self) -> None:
+        if self._storage.needs_compaction and not self._compacting:
+            self._compacting = True
+            self.task_group.start_soon(self._compact)
+
+    async def _compact(self) -> None:
+        try:
+            await self._storage.compact(self.doc, self._lock)
+        finally:
+            self._compacting = False
+
+
+def receive_updates(updates: MemoryObjectReceiveStream[T], received: list[T]) -> bool:
+    """
+    Receives the updates which are available without waiting.
+
+    Args:
+        updates: The stream of document updates.
+        received: The list to which the updates are appended.
+
+    Returns:
+        Whether updates were received.
+    """
+    size = len(received)
+    while True:
+        try:
+            received.append(updates.receive_nowait())
+        except WouldBlock:
+            return len(received) > size
+
+
+class StoredRoomManager(RoomManager):
+    """
+    A room manager which unloads the rooms that are not used by any client.
+    """
+    _rooms: dict[str, StoredRoom]  # type: ignore[assignment]
+    _room_factory: Callable[[str], StoredRoom]
+
+    def __init__(
+        self,
+        room_factory: Callable[[str], StoredRoom],
+        *,
+        idle_timeout: float | None = None,
+        memory_budget: int | None = None,
+        clock: Clock | None = None,
+    ) -> None:
+        """
+        Args:
+            room_factory: The callable used to create a room.
+            idle_timeout: The time (in seconds) after which a room that is not used is unloaded,
+                or `None` to keep it loaded.
+            memory_budget: The total size (in bytes) of the loaded rooms above which the least
+                recently used rooms are unloaded, or `None` for no limit.
+            clock: The clock used to wait for the idle timeout, by default the event loop clock.
+        """
+        super().__init__(room_factory)
+        self._idle_timeout = idle_timeout
+        self._memory_budget = memory_budget
+        self._clock = Clock() if clock is None else clock
+        self._users: dict[str, int] = {}
+        self._idle_scopes: dict[str, CancelScope] = {}
+
+    @property
+    def rooms(self) -> dict[str, StoredRoom]:
+        """
+        Returns:
+            The loaded rooms, from the least to the most recently used.
+        """
+        return dict(self._rooms)
+
+    async def _create_room(self, id: str, *, task_status: TaskStatus[StoredRoom]):  # type: ignore[override]
+        async with self._room_factory(id) as room:
+            task_status.started(room)
+
+    @asynccontextmanager
+    async def use_room(self, id: str) -> AsyncGenerator[StoredRoom]:
+        """
+        Gets a room, loading it if needed. The room cannot be unloaded while it is used.
+
+        Args:
+            id: The room ID.
+
+        Yields:
+            The room.
+        """
+        async with self._lock:
+            if id in self._rooms:
+                room = self._rooms.pop(id)
+            else:
+                room = await self._task_group.start(self._create_room, id)
+            self._rooms[id] = room
+            self._users[id] = self._users.get(id, 0) + 1
+            if (idle_scope := self._idle_scopes.pop(id, None)) is not None:
+                idle_scope.cancel()
+            await self._enforce_memory_budget()
+        try:
+            yield room
+        finally:
+            with CancelScope(shield=True):
+                async with self._lock:
+                    self._users[id] -= 1
+                    if self._users[id] == 0:
+                        del self._users[id]
+                        if self._idle_timeout is not None:
+                            # the scope is registered before the task starts, so that it can be cancelled
+                            self._idle_scopes[id] = idle_scope = CancelScope()
+                            self._task_group.start_soon(self._unload_when_idle, id, idle_scope)
+                    await self._enforce_memory_budget()
+
+    async def _unload_when_idle(self, id: str, idle_scope: CancelScope) -> None:
+        assert self._idle_timeout is not None
+        with idle_scope:
+            await self._clock.sleep(self._idle_timeout)
+            async with self._lock:
+                if id not in self._users and id in self._rooms:
+                    await self._unload(id)
+
+    async def _enforce_memory_budget(self) -> None:
+        if self._memory_budget is None:
+            return
+
+        size = sum(room.size for room in self._rooms.values())
+        for id, room in list(self._rooms.items()):
+            if size <= self._memory_budget:
+                break
+            if id not in self._users:
+                size -= room.size
+                await self._unload(id)
+
+    async def _unload(self, id: str) -> None:
+        room = self._rooms.pop(id)
+        if (idle_scope := self._idle_scopes.pop(id, None)) is not None:
+            idle_scope.cancel()
+        await room.close()
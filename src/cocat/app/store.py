@@ -0,0 +1,660 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import sys
+from abc import ABC, abstractmethod
+from collections.abc import AsyncGenerator, Callable
+from contextlib import asynccontextmanager, nullcontext
+from functools import partial
+from pathlib import Path
+from typing import Any, Literal, TypeVar
+
+import anyio
+from anyio import AsyncContextManagerMixin, CancelScope, Lock, create_task_group, current_time, open_file, sleep, to_thread
+from pycrdt import Doc, merge_updates, write_message
+
+from ..db import DB
+from ..updates import HEADER, decode_updates
+from .metrics import Histogram
+
+if sys.version_info >= (3, 11):
+    from typing import Self
+else:  # pragma: nocover
+    from typing_extensions import Self
+
+SNAPSHOT_VERSION = "0.0.1"
+SNAPSHOT_HEADER = SNAPSHOT_VERSION.encode() + bytes([0])
+# size of the field holding the length of the state vector in a snapshot
+LENGTH_SIZE = 8
+
+Fsync = Literal["update", "periodic", "never"]
+StoreType = Literal["file", "sqlite"]
+T = TypeVar("T")
+
+
+class RoomStorage(AsyncContextManagerMixin, ABC):
+    """
+    The storage where the updates of a room are appended, and which can be compacted
+    into a snapshot of the room state.
+    """
+    def __init__(
+        self,
+        *,
+        compaction_size: int | None = None,
+        compaction_updates: int | None = None,
+        flush_interval: float = 0,
+        flush_size: int | None = None,
+        fsync: Fsync = "never",
+        fsync_interval: float = 1,
+        flush_latency: Histogram | None = None,
+    ) -> None:
+        """
+        Args:
+            compaction_size: The number of bytes written since the last compaction above which
+                the storage should be compacted, or `None` to not compact based on size.
+            compaction_updates: The number of updates written since the last compaction above which
+                the storage should be compacted, or `None` to not compact based on the number of updates.
+            flush_interval: The time (in seconds) during which updates are buffered before being
+                merged and written to the storage, or 0 to write every update immediately.
+            flush_size: The number of buffered bytes above which updates are written to the storage
+                without waiting for `flush_interval`, or `None` for no limit.
+            fsync: When the storage is synchronized to the disk: after every write (`"update"`),
+                every `fsync_interval` seconds (`"periodic"`), or when the OS decides (`"never"`).
+            fsync_interval: The time (in seconds) between synchronizations to the disk,
+                if `fsync` is `"periodic"`.
+            flush_latency: The histogram in which to record the time it takes to write
+                the buffered updates, if any.
+        """
+        self._compaction_size = compaction_size
+        self._compaction_updates = compaction_updates
+        self._flush_interval = flush_interval
+        self._flush_size = flush_size
+        self._fsync = fsync
+        self._fsync_interval = fsync_interval
+        self._flush_latency = flush_latency
+        self._buffer: list[bytes] = []
+        self._buffer_size = 0
+        self._flush_scheduled = False
+        self._unsynced = False
+        self._lock = Lock()
+        self._compaction_lock = Lock()
+        self._size = 0
+        self._snapshot_size = 0
+        self._tail_size = 0
+        self._tail_updates = 0
+
+    @property
+    def size(self) -> int:
+        """
+        Returns:
+            The total size of the stored updates and snapshot.
+        """
+        return self._size + self._snapshot_size
+
+    @property
+    def needs_compaction(self) -> bool:
+        """
+        Returns:
+            Whether the updates written since the last compaction exceed a threshold.
+        """
+        if self._compaction_size is not None and self._tail_size > self._compaction_size:
+            return True
+        if self._compaction_updates is not None and self._tail_updates > self._compaction_updates:
+            return True
+        return False
+
+    @asynccontextmanager
+    async def __asynccontextmanager__(self) -> AsyncGenerator[Self]:
+        async with self._open():
+            async with create_task_group() as self._task_group:
+                if self._fsync == "periodic":
+                    self._task_group.start_soon(self._sync_periodically)
+                try:
+                    yield self
+                finally:
+                    with CancelScope(shield=True):
+                        await self.flush()
+                        if self._unsynced:
+                            await self._sync()
+                    self._task_group.cancel_scope.cancel()
+
+    @abstractmethod
+    def _open(self) -> Any:
+        """
+        Returns:
+            An async context manager which opens the storage.
+        """
+
+    async def load(self, doc: Doc) -> None:
+        """
+        Applies the snapshot (if any) and then the stored updates to a document.
+        They are applied in a worker thread, so that loading a large room doesn't block
+        the event loop: the document must not be accessed until it is loaded.
+
+        Args:
+            doc: The document to apply the updates to.
+        """
+        snapshot, updates = await self._read()
+        await to_thread.run_sync(apply_updates, doc, snapshot, updates)
+        self._tail_updates = len(updates)
+
+    @abstractmethod
+    async def _read(self) -> tuple[bytes | None, list[bytes]]:
+        """
+        Reads the storage.
+
+        Returns:
+            The snapshot (if any) and the updates written after it.
+        """
+
+    @abstractmethod
+    async def _append(self, update: bytes) -> int:
+        """
+        Appends an update to the storage.
+
+        Args:
+            update: The update to append.
+
+        Returns:
+            The number of bytes written.
+        """
+
+    @abstractmethod
+    async def _position(self) -> int:
+        """
+        Returns:
+            The position of the last update in the storage.
+        """
+
+    @abstractmethod
+    async def _replace_snapshot(self, state: bytes, update: bytes, position: int) -> None:
+        """
+        Replaces the snapshot, and removes the updates up to a position.
+
+        Args:
+            state: The state vector of the snapshot.
+            update: The update of the snapshot.
+            position: The position of the last update in the snapshot.
+        """
+
+    @abstractmethod
+    async def _sync(self) -> None:
+        """
+        Synchronizes the storage to the disk.
+        """
+
+    async def write(self, update: bytes) -> None:
+        """
+        Appends an update to the storage, or buffers it if a flush interval was set.
+
+        Args:
+            update: The update to append.
+        """
+        self._buffer.append(update)
+        self._buffer_size += len(update)
+        if self._flush_interval == 0 or (self._flush_size is not None and self._buffer_size > self._flush_size):
+            await self.flush()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._task_group.start_soon(self._flush_later)
+
+    async def flush(self) -> None:
+        """
+        Merges the buffered updates and appends them to the storage.
+        """
+        async with self._lock:
+            if not self._buffer:
+                return
+
+            update = self._buffer[0] if len(self._buffer) == 1 else merge_updates(*self._buffer)
+            self._buffer.clear()
+            self._buffer_size = 0
+            with CancelScope(shield=True):
+                start = current_time()
+                size = await self._append(update)
+                self._size += size
+                self._tail_size += size
+                self._tail_updates += 1
+                if self._fsync == "update":
+                    await self._sync()
+                elif self._fsync == "periodic":
+                    self._unsynced = True
+                if self._flush_latency is not None:
+                    self._flush_latency.observe(current_time() - start)
+
+    async def _flush_later(self) -> None:
+        await sleep(self._flush_interval)
+        self._flush_scheduled = False
+        await self.flush()
+
+    async def _sync_periodically(self) -> None:
+        while True:
+            await sleep(self._fsync_interval)
+            if self._unsynced:
+                async with self._lock:
+                    self._unsynced = False
+                    await self._sync()
+
+    async def compact(self, doc: Doc, doc_lock: Lock | None = None) -> None:
+        """
+        Replaces the snapshot with the state of a document, and only keeps the updates
+        that were written while compacting.
+
+        Args:
+            doc: The document which holds (at least) the stored updates.
+            doc_lock: The lock to hold while reading the document, if it can be updated in a worker thread.
+        """
+        async with self._compaction_lock:
+            async with self._lock:
+                position = await self._position()
+                tail_updates = self._tail_updates
+                async with nullcontext() if doc_lock is None else doc_lock:
+                    state = doc.get_state()
+                    update = doc.get_update()
+                # the buffered updates are already in the document
+                self._buffer.clear()
+                self._buffer_size = 0
+            await self._replace_snapshot(state, update, position)
+            self._tail_updates -= tail_updates
+
+    async def reset(self, doc: Doc, doc_lock: Lock | None = None) -> None:
+        """
+        Replaces the snapshot with the state of a document which doesn't hold the stored
+        updates, such as a compacted document, and removes the stored and buffered updates.
+        The updates written while resetting are kept, so they must be updates of the document.
+
+        Args:
+            doc: The document to replace the stored updates with.
+            doc_lock: The lock to hold while reading the document, if it can be updated in a worker thread.
+        """
+        async with self._compaction_lock:
+            async with self._lock:
+                position = await self._position()
+                async with nullcontext() if doc_lock is None else doc_lock:
+                    state = doc.get_state()
+                    update = doc.get_update()
+                self._buffer.clear()
+                self._buffer_size = 0
+            await self._replace_snapshot(state, update, position)
+            self._tail_updates = 0
+
+
+class RoomStore(ABC):
+    """
+    A store which holds the updates of all the rooms.
+    """
+    def __init__(self, **kwargs: Any) -> None:
+        """
+        Args:
+            kwargs: The arguments passed to the storage of each room.
+        """
+        self._kwargs = kwargs
+
+    @asynccontextmanager
+    async def start(self) -> AsyncGenerator[Self]:
+        """
+        Starts the store, and stops it when exiting the context manager.
+        """
+        yield self
+
+    @abstractmethod
+    def open(self, room_id: str) -> RoomStorage:
+        """
+        Args:
+            room_id: The ID of the room.
+
+        Returns:
+            The storage of the room, which must be used as an async context manager.
+        """
+
+    @abstractmethod
+    async def room_ids(self) -> list[str]:
+        """
+        Returns:
+            The IDs of the rooms in the store.
+        """
+
+
+class FileStore(RoomStore):
+    """
+    A store which holds the updates of each room in a file.
+    """
+    def __init__(self, directory: Path | str, **kwargs: Any) -> None:
+        """
+        Args:
+            directory: The directory where the files are stored.
+            kwargs: The arguments passed to the [UpdateFile][cocat.app.store.UpdateFile] of each room.
+        """
+        super().__init__(**kwargs)
+        self._directory = Path(directory)
+
+    def open(self, room_id: str) -> UpdateFile:
+        return UpdateFile(self._directory / f"{room_id.lstrip('/')}.y", **self._kwargs)
+
+    async def room_ids(self) -> list[str]:
+        return sorted(path.stem for path in self._directory.glob("*.y"))
+
+
+class UpdateFile(RoomStorage):
+    """
+    A file where the updates of a room are appended, and which can be compacted
+    into a snapshot file.
+    """
+    def __init__(self, path: Path | str, **kwargs: Any) -> None:
+        """
+        Args:
+            path: The path to the file.
+            kwargs: The arguments passed to [RoomStorage][cocat.app.store.RoomStorage].
+        """
+        super().__init__(**kwargs)
+        self._path = anyio.Path(path)
+        self._snapshot_path = self._path.with_suffix(".snapshot")
+
+    @property
+    def path(self) -> anyio.Path:
+        return self._path
+
+    @property
+    def snapshot_path(self) -> anyio.Path:
+        return self._snapshot_path
+
+    @asynccontextmanager
+    async def _open(self) -> AsyncGenerator[None]:
+        if not await self._path.exists() or (await self._path.stat()).st_size == 0:
+            await self._path.write_bytes(HEADER)
+        async with await open_file(self._path, mode="ab", buffering=0) as self._file:
+            self._size = await self._file.tell()
+            yield
+
+    async def _read(self) -> tuple[bytes | None, list[bytes]]:
+        snapshot = None
+        if await self._snapshot_path.exists():
+            _, snapshot = await read_snapshot(self._snapshot_path)
+            self._snapshot_size = (await self._snapshot_path.stat()).st_size
+        updates = await read_updates(self._path)
+        self._tail_size = self._size - len(HEADER)
+        return snapshot, updates
+
+    async def _append(self, update: bytes) -> int:
+        message = write_message(update)
+        await self._file.write(message)
+        return len(message)
+
+    async def _position(self) -> int:
+        return self._size
+
+    async def _sync(self) -> None:
+        await to_thread.run_sync(os.fsync, self._file.wrapped.fileno())
+
+    async def _replace_snapshot(self, state: bytes, update: bytes, position: int) -> None:
+        snapshot = SNAPSHOT_HEADER + len(state).to_bytes(LENGTH_SIZE, "little") + state + update
+        tmp_snapshot_path = self._snapshot_path.with_name(f"{self._snapshot_path.name}.tmp")
+        await self._write_new_file(tmp_snapshot_path, snapshot)
+        tmp_path = self._path.with_name(f"{self._path.name}.tmp")
+        # writers are only blocked while the updates written since the position are copied
+        async with self._lock:
+            with CancelScope(shield=True):
+                # the snapshot must be replaced before the update file,
+                # so that no update is lost if the process stops in between
+                await tmp_snapshot_path.replace(self._snapshot_path)
+                self._snapshot_size = len(snapshot)
+                tail = await self._read_from(position)
+                await self._write_new_file(tmp_path, HEADER + tail)
+                await self._file.aclose()
+                await tmp_path.replace(self._path)
+                self._file = await open_file(self._path, mode="ab", buffering=0)
+                self._size = len(HEADER) + len(tail)
+                self._tail_size = len(tail)
+
+    async def _write_new_file(self, path: anyio.Path, data: bytes) -> None:
+        async with await open_file(path, mode="wb") as f:
+            await f.write(data)
+            if self._fsync != "never":
+                await f.flush()
+                await to_thread.run_sync(os.fsync, f.wrapped.fileno())
+
+    async def _read_from(self, position: int) -> bytes:
+        async with await open_file(self._path, mode="rb") as f:
+            await f.seek(position)
+            return await f.read()
+
+
+class SQLiteStore(RoomStore):
+    """
+    A store which holds the updates and snapshots of all the rooms in an SQLite database.
+    """
+    def __init__(self, path: Path | str, **kwargs: Any) -> None:
+        """
+        Args:
+            path: The path to the database.
+            kwargs: The arguments passed to the [SQLiteStorage][cocat.app.store.SQLiteStorage] of each room.
+        """
+        super().__init__(**kwargs)
+        self._path = Path(path)
+        self._lock = Lock()
+
+    @asynccontextmanager
+    async def start(self) -> AsyncGenerator[Self]:
+        synchronous = {"update": "FULL", "periodic": "NORMAL", "never": "OFF"}[self._kwargs.get("fsync", "never")]
+        self._connection = await to_thread.run_sync(partial(sqlite3.connect, self._path, check_same_thread=False))
+        try:
+            await self.run(self._create_tables, synchronous)
+            yield self
+        finally:
+            with CancelScope(shield=True):
+                await self.run(self._connection.close)
+
+    async def run(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        Runs a function using the database connection in a worker thread,
+        one at a time.
+
+        Args:
+            func: The function to run.
+            args: The arguments to pass to the function.
+
+        Returns:
+            The function result.
+        """
+        async with self._lock:
+            return await to_thread.run_sync(func, *args)
+
+    def _create_tables(self, synchronous: str) -> None:
+        with self._connection:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(f"PRAGMA synchronous={synchronous}")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS updates "
+                "(id INTEGER PRIMARY KEY AUTOINCREMENT, room TEXT NOT NULL, data BLOB NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS updates_room ON updates (room, id)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots "
+                "(room TEXT PRIMARY KEY, state BLOB NOT NULL, data BLOB NOT NULL)"
+            )
+
+    def open(self, room_id: str) -> SQLiteStorage:
+        return SQLiteStorage(self, room_id.lstrip("/"), **self._kwargs)
+
+    async def room_ids(self) -> list[str]:
+        return await self.run(self._room_ids)
+
+    def _room_ids(self) -> list[str]:
+        rows = self._connection.execute("SELECT room FROM updates UNION SELECT room FROM snapshots ORDER BY room")
+        return [row[0] for row in rows]
+
+
+class SQLiteStorage(RoomStorage):
+    """
+    The rows of an SQLite database where the updates of a room are inserted, and which can be
+    compacted into a snapshot row.
+    """
+    def __init__(self, store: SQLiteStore, room_id: str, **kwargs: Any) -> None:
+        """
+        Args:
+            store: The store the database belongs to.
+            room_id: The ID of the room.
+            kwargs: The arguments passed to [RoomStorage][cocat.app.store.RoomStorage].
+        """
+        super().__init__(**kwargs)
+        self._store = store
+        self._room_id = room_id
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        return self._store._connection
+
+    @asynccontextmanager
+    async def _open(self) -> AsyncGenerator[None]:
+        yield
+
+    async def _read(self) -> tuple[bytes | None, list[bytes]]:
+        snapshot, updates = await self._store.run(self._select)
+        if snapshot is not None:
+            self._snapshot_size = len(snapshot)
+        self._size = self._tail_size = sum(len(update) for update in updates)
+        return snapshot, updates
+
+    def _select(self) -> tuple[bytes | None, list[bytes]]:
+        row = self._connection.execute("SELECT data FROM snapshots WHERE room = ?", (self._room_id,)).fetchone()
+        rows = self._connection.execute("SELECT data FROM updates WHERE room = ? ORDER BY id", (self._room_id,))
+        return None if row is None else row[0], [row[0] for row in rows]
+
+    async def _append(self, update: bytes) -> int:
+        await self._store.run(self._insert, update)
+        return len(update)
+
+    def _insert(self, update: bytes) -> None:
+        with self._connection:
+            self._connection.execute("INSERT INTO updates (room, data) VALUES (?, ?)", (self._room_id, update))
+
+    async def _position(self) -> int:
+        return await self._store.run(self._max_id)
+
+    def _max_id(self) -> int:
+        row = self._connection.execute("SELECT MAX(id) FROM updates WHERE room = ?", (self._room_id,)).fetchone()
+        return 0 if row[0] is None else row[0]
+
+    async def _sync(self) -> None:
+        # with synchronous=FULL, every commit is already synchronized
+        if self._fsync == "periodic":
+            await self._store.run(self._checkpoint)
+
+    def _checkpoint(self) -> None:
+        self._connection.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+
+    async def _replace_snapshot(self, state: bytes, update: bytes, position: int) -> None:
+        with CancelScope(shield=True):
+            tail_size = await self._store.run(self._replace_rows, state, update, position)
+        self._snapshot_size = len(update)
+        self._size = self._tail_size = tail_size
+
+    def _replace_rows(self, state: bytes, update: bytes, position: int) -> int:
+        with self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO snapshots (room, state, data) VALUES (?, ?, ?)",
+                (self._room_id, state, update),
+            )
+            self._connection.execute("DELETE FROM updates WHERE room = ? AND id <= ?", (self._room_id, position))
+            row = self._connection.execute(
+                "SELECT COALESCE(SUM(LENGTH(data)), 0) FROM updates WHERE room = ?",
+                (self._room_id,),
+            ).fetchone()
+        return row[0]
+
+
+def create_store(store: StoreType, update_dir: Path | str, **kwargs: Any) -> RoomStore:
+    """
+    Creates a room store.
+
+    Args:
+        store: The type of store: one file per room (`"file"`) or an SQLite database (`"sqlite"`).
+        update_dir: The directory where the files or the database are stored.
+        kwargs: The arguments passed to the storage of each room.
+
+    Returns:
+        The created store.
+    """
+    if store == "sqlite":
+        return SQLiteStore(Path(update_dir) / "rooms.db", **kwargs)
+    return FileStore(update_dir, **kwargs)
+
+
+def apply_updates(doc: Doc, snapshot: bytes | None, updates: list[bytes]) -> None:
+    """
+    Args:
+        doc: The document to apply the snapshot and updates to.
+        snapshot: The snapshot to apply first, if any.
+        updates: The updates to apply in a single transaction.
+    """
+    if snapshot is not None:
+        doc.apply_update(snapshot)
+    with doc.transaction():
+        for update in updates:
+            doc.apply_update(update)
+
+
+async def read_updates(path: anyio.Path) -> list[bytes]:
+    updates = decode_updates(await path.read_bytes())
+    if updates is None:
+        return []
+    return updates
+
+
+async def read_snapshot(path: anyio.Path) -> tuple[bytes, bytes]:
+    """
+    Reads a snapshot file.
+
+    Args:
+        path: The path to the snapshot file.
+
+    Returns:
+        The state vector and the update of the snapshot.
+    """
+    data = await path.read_bytes()
+    version_end = data.find(bytes([0]))
+    version = data[:version_end].decode()
+    if version != SNAPSHOT_VERSION:
+        raise RuntimeError(f'Snapshot version mismatch (got "{version}", expected "{SNAPSHOT_VERSION}")')
+    state_start = version_end + 1 + LENGTH_SIZE
+    state_end = state_start + int.from_bytes(data[version_end + 1:state_start], "little")
+    return data[state_start:state_end], data[state_end:]
+
+
+async def compact_room(store: RoomStore, room_id: str, history: bool = False) -> tuple[int, int]:
+    """
+    Compacts the storage of a room that is not in use, by moving its updates to the snapshot.
+
+    Args:
+        store: The (started) store the room belongs to.
+        room_id: The ID of the room.
+        history: Whether to also drop the deleted content and the history of the room,
+            see [DB.compact()][cocat.DB.compact].
+
+    Returns:
+        The size of the room storage before and after compaction.
+    """
+    doc: Doc = Doc()
+    async with store.open(room_id) as storage:
+        await storage.load(doc)
+        size = storage.size
+        if history:
+            await storage.reset(DB(doc).compact().doc)
+        else:
+            await storage.compact(doc)
+        return size, storage.size
+
+
+async def compact_file(path: Path | str) -> tuple[int, int]:
+    """
+    Compacts an update file that is not in use, by moving its updates to the snapshot file.
+
+    Args:
+        path: The path to the file.
+
+    Returns:
+        The size of the files before and after compaction.
+    """
+    path = Path(path)
+    return await compact_room(FileStore(path.parent), path.stem)
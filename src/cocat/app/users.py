@@ -1,5 +1,12 @@
+import os
 import uuid
+from collections import OrderedDict
+from collections.abc import AsyncGenerator
+from dataclasses import dataclass, field
+from time import monotonic, time
+from typing import Any
 
+import jwt
 from fastapi import Depends, Request
 from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin, models
 from fastapi_users.authentication import (
@@ -10,14 +17,26 @@ from fastapi_users.authentication import (
 from fastapi_users.db import SQLAlchemyUserDatabase
 
 from .db import User, get_user_db
+from .metrics import Histogram
 
-SECRET = str(uuid.uuid4())
+# the workers of a multi-process server share the secret of the server
+SECRET = os.environ.get("COCAT_SECRET") or str(uuid.uuid4())
 
 
 class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     reset_password_token_secret = SECRET
     verification_token_secret = SECRET
 
+    def __init__(self, user_db: SQLAlchemyUserDatabase, jwt_strategy: "CachedJWTStrategy | None" = None) -> None:
+        """
+        Args:
+            user_db: The user database.
+            jwt_strategy: The JWT strategy from which the tokens of a user are removed
+                when the user is updated or deleted.
+        """
+        super().__init__(user_db)
+        self._jwt_strategy = jwt_strategy
+
     async def on_after_register(self, user: User, request: Request | None = None):
         print(f"User {user.id} has registered.")
 
@@ -31,21 +50,124 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
     ):
         print(f"Verification requested for user {user.id}. Verification token: {token}")
 
+    async def on_after_update(
+        self, user: User, update_dict: dict[str, Any], request: Request | None = None
+    ):
+        if self._jwt_strategy is not None:
+            self._jwt_strategy.invalidate_user(user.id)
 
-async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db)):
-    yield UserManager(user_db)
-
-
-def get_jwt_strategy() -> JWTStrategy[models.UP, models.ID]:
-    return JWTStrategy(secret=SECRET, lifetime_seconds=3600)
+    async def on_after_delete(self, user: User, request: Request | None = None):
+        if self._jwt_strategy is not None:
+            self._jwt_strategy.invalidate_user(user.id)
 
 
-auth_backend: AuthenticationBackend = AuthenticationBackend(
-    name="cookie",
-    transport=CookieTransport(),
-    get_strategy=get_jwt_strategy,
-)
+async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db)):
+    yield UserManager(user_db)
 
-fastapi_users = FastAPIUsers[User, uuid.UUID](get_user_manager, [auth_backend])
 
-current_active_user = fastapi_users.current_user(active=True)
+@dataclass
+class AuthMetrics:
+    """
+    The metrics of the websocket authentication.
+    """
+    connections: int = 0
+    cache_hits: int = 0
+    total_latency: float = 0
+    max_latency: float = 0
+    latency: Histogram = field(default_factory=Histogram)
+
+    def record(self, latency: float) -> None:
+        self.connections += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.latency.observe(latency)
+
+
+class CachedJWTStrategy(JWTStrategy[models.UP, models.ID]):
+    """
+    A JWT strategy which caches the users of the validated tokens, so that the user database
+    is not queried every time a token is read.
+    """
+    def __init__(self, *args: Any, cache_ttl: float = 60, cache_size: int = 1000, **kwargs: Any) -> None:
+        """
+        Args:
+            cache_ttl: The time (in seconds) during which a validated token is cached.
+            cache_size: The maximum number of cached tokens.
+        """
+        super().__init__(*args, **kwargs)
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        self.metrics = AuthMetrics()
+        self._cache: OrderedDict[str, tuple[models.UP, float]] = OrderedDict()
+
+    async def read_token(
+        self, token: str | None, user_manager: BaseUserManager[models.UP, models.ID]
+    ) -> models.UP | None:
+        if token is None:
+            return None
+
+        now = monotonic()
+        if (entry := self._cache.get(token)) is not None:
+            cached_user, expires = entry
+            if now < expires:
+                self._cache.move_to_end(token)
+                self.metrics.cache_hits += 1
+                return cached_user
+            del self._cache[token]
+
+        user = await super().read_token(token, user_manager)
+        if user is not None and self.cache_ttl > 0 and self.cache_size > 0:
+            expires = now + self.cache_ttl
+            # the token has already been verified, it must not be cached after it expires
+            exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+            if exp is not None:
+                expires = min(expires, now + exp - time())
+            self._cache[token] = (user, expires)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return user
+
+    async def destroy_token(self, token: str, user: models.UP) -> None:
+        self._cache.pop(token, None)
+        await super().destroy_token(token, user)
+
+    def invalidate_user(self, user_id: Any) -> None:
+        """
+        Removes the tokens of a user from the cache.
+
+        Args:
+            user_id: The ID of the user.
+        """
+        for token, (user, _) in list(self._cache.items()):
+            if user.id == user_id:
+                del self._cache[token]
+
+
+class UserAuth:
+    """
+    The authentication of the users of an application, with its own JWT strategy
+    (and thus its own token cache and metrics).
+    """
+    def __init__(self, cache_ttl: float = 60, cache_size: int = 1000) -> None:
+        """
+        Args:
+            cache_ttl: The time (in seconds) during which a validated token is cached.
+            cache_size: The maximum number of cached tokens.
+        """
+        self.jwt_strategy: CachedJWTStrategy = CachedJWTStrategy(
+            secret=SECRET, lifetime_seconds=3600, cache_ttl=cache_ttl, cache_size=cache_size
+        )
+        self.auth_backend: AuthenticationBackend = AuthenticationBackend(
+            name="cookie",
+            transport=CookieTransport(),
+            get_strategy=self.get_jwt_strategy,
+        )
+        self.fastapi_users = FastAPIUsers[User, uuid.UUID](self.get_user_manager, [self.auth_backend])
+
+    def get_jwt_strategy(self) -> CachedJWTStrategy:
+        return self.jwt_strategy
+
+    async def get_user_manager(
+        self, user_db: SQLAlchemyUserDatabase = Depends(get_user_db)
+    ) -> AsyncGenerator[UserManager]:
+        yield UserManager(user_db, self.jwt_strategy)
@@ -19,7 +19,10 @@ class Mixin:
 
     def _callback(self, callback: Callable[..., None], origin: Any, *args: Any) -> None:
         if origin is not self:
-            callback(*args)
+            if self._db._instrumentation is None:
+                callback(*args)
+            else:
+                self._db._instrumentation.call(callback, *args)
 
     def _get_from_map(self, field: str) -> dict[str, Any]:
         with self._db.transaction():
@@ -33,8 +36,7 @@ class Mixin:
         with self._db.transaction():
             self._check_deleted()
             map = cast(Map, self._map[field])
-            map.clear()
-            map.update(value)
+            update_items(map, value)
 
     def _add_keys(self, field: str, keys: Iterable[str] | str) -> None:
         with self._db.transaction():
@@ -198,3 +200,36 @@ class Mixin:
             value: The author to set.
         """
         self._set("author", value)
+
+
+def update_items(map: Map, items: dict[str, Any]) -> None:
+    """
+    Gives a map the items of a dictionary, by only deleting the keys which are not in the dictionary
+    and setting the values which differ, so that the update is proportional to the change.
+
+    Args:
+        map: The map to update.
+        items: The items to give the map.
+    """
+    for key in [key for key in map.keys() if key not in items]:
+        del map[key]
+    for key, value in items.items():
+        if key not in map or not same_value(map[key], value):
+            map[key] = value
+
+
+def same_value(value0: Any, value1: Any) -> bool:
+    """
+    Args:
+        value0: A value stored in a map.
+        value1: Another value.
+
+    Returns:
+        Whether the values are the same, knowing that the integers stored in a map are read as floats,
+        including in the nested dictionaries and lists.
+    """
+    if isinstance(value0, dict) and isinstance(value1, dict):
+        return value0.keys() == value1.keys() and all(same_value(value0[key], value1[key]) for key in value0)
+    if isinstance(value0, (list, tuple)) and isinstance(value1, (list, tuple)):
+        return len(value0) == len(value1) and all(same_value(v0, v1) for v0, v1 in zip(value0, value1))
+    return value0 == value1 and isinstance(value0, bool) == isinstance(value1, bool)
@@ -9,7 +9,7 @@ from typing import Any, TYPE_CHECKING, cast
 from pycrdt import Map
 from simpleeval import SimpleEval  # type: ignore[import-untyped]
 
-from .base import Mixin
+from .base import Mixin, update_items
 from .event import Event
 from .models import CatalogueModel
 
@@ -20,6 +20,7 @@ else:  # pragma: nocover
 
 if TYPE_CHECKING:
     from .db import DB
+    from .query import Query
 
 
 @dataclass(eq=False)
@@ -27,7 +28,7 @@ class Catalogue(Mixin):
     _uuid: str
     _map: Map
     _db: "DB"
-    _condition: str | None = None
+    _condition: "str | Query | None" = None
 
     def _check_deleted(self):
         if self._uuid not in self._db._catalogue_maps:
@@ -53,12 +54,16 @@ class Catalogue(Mixin):
         with self._db.transaction():
             self._check_deleted()
             value = self._map[name]
+            if self._db._instrumentation is not None:
+                self._db._instrumentation.validations += 1
             model = CatalogueModel.__pydantic_validator__.validate_assignment(CatalogueModel.model_construct(), name, value)
             return getattr(model, name)
 
     def _set(self, name: str, value: Any) -> None:
         with self._db.transaction():
             self._check_deleted()
+            if self._db._instrumentation is not None:
+                self._db._instrumentation.validations += 1
             model = CatalogueModel.__pydantic_validator__.validate_assignment(CatalogueModel.model_construct(), name, value)
             val = getattr(model, name)
             self._map[name] = val
@@ -189,7 +194,7 @@ class Catalogue(Mixin):
 
     def set_dynamic_filter(
         self,
-        condition: str | None = None,
+        condition: "str | Query | None" = None,
     ) -> None:
         """
         Sets a condition that will be evaluated when accessing `catalogue.dynamic_events`.
@@ -197,6 +202,11 @@ class Catalogue(Mixin):
         ```py
         catalogue.set_dynamic_filter(f"event.start > datetime(2025, 1, 1) and event.stop <= datetime(2026, 1, 1) and event in catalogue('my_catalogue_name_or_uuid')")
         ```
+        The condition can also be a [Query][cocat.Query], which uses the indexes of the database
+        instead of evaluating an expression for every event:
+        ```py
+        catalogue.set_dynamic_filter(db.query().where(start__gt="2025-01-01", stop__lte="2026-01-01").in_catalogue("my_catalogue_name_or_uuid"))
+        ```
 
         Args:
             condition: The condition an event needs to match to be part of the catalogue.
@@ -242,13 +252,30 @@ class Catalogue(Mixin):
         if not self._condition:
             return set()
 
+        instrumentation = self._db._instrumentation
+        if not isinstance(self._condition, str):
+            uuids, evaluations = self._condition._run()
+            if instrumentation is not None:
+                instrumentation.dynamic_filter_evaluations += evaluations
+            with self._db.transaction():
+                return {Event.from_uuid(uuid, self._db) for uuid in uuids}
+
+        if instrumentation is None:
+            return self._filter_events(self._condition)
+
+        with instrumentation.span("dynamic_filter", catalogue=self._uuid):
+            events = self._filter_events(self._condition)
+            instrumentation.dynamic_filter_evaluations += len(self._db._event_maps)
+        return events
+
+    def _filter_events(self, condition: str) -> set[Event]:
         s = SimpleEval()
         s.functions = {"datetime": datetime, "catalogue": self._db.get_catalogue}
         events = set()
         with self._db.transaction():
             for event in self._db.events:
                 s.names = {"event": event}
-                if s.eval(self._condition):
+                if s.eval(condition):
                     events.add(event)
 
         return events
@@ -281,6 +308,4 @@ class Catalogue(Mixin):
         with self._db.transaction():
             self._check_deleted()
             events = cast(Map, self._map["events"])
-            events.clear()
-            for event in value:
-                self.add_events(event)
+            update_items(events, {event._uuid: True for event in value})
@@ -1,14 +1,34 @@
 import contextlib
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+from functools import partial
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
 
+import anyio
+import httpx
 from anycorn import Config, serve as anycorn_serve
-from anyio import Event, run
+from anyio import Event, fail_after, run, sleep
 from cyclopts import App
 from fastapi_users.exceptions import UserAlreadyExists
+from pycrdt import Doc
 
 from .app.app import CocatApp
+from .app.channel import Overflow
 from .app.db import create_db_and_tables, get_async_session, get_user_db
+from .app.proxy import ProxyApp
 from .app.schemas import UserCreate
+from .app.store import Fsync, StoreType, apply_updates, compact_room, create_store, read_snapshot, read_updates
 from .app.users import get_user_manager
+from .db import DB
+from .loadgen import run_load
 
 get_async_session_context = contextlib.asynccontextmanager(get_async_session)
 get_user_db_context = contextlib.asynccontextmanager(get_user_db)
@@ -23,6 +43,29 @@ def serve(
     port: int = 8000,
     update_dir: str = "",
     db_path: str = "./test.db",
+    store: StoreType = "file",
+    compaction_size: int | None = 1_000_000,
+    compaction_updates: int | None = 1_000,
+    idle_timeout: float | None = 60,
+    memory_budget: int | None = None,
+    flush_interval: float = 0,
+    flush_size: int | None = None,
+    fsync: Fsync = "never",
+    fsync_interval: float = 1,
+    auth_cache_ttl: float = 60,
+    auth_cache_size: int = 1000,
+    broadcast_window: float = 0,
+    broadcast_max_delay: float = 0.1,
+    compression_threshold: int | None = 1024,
+    compression_level: int = 6,
+    compression_max_size: int = 64 * 1024 * 1024,
+    send_queue_size: int = 1000,
+    send_queue_overflow: Overflow = "merge",
+    thread_threshold: int | None = 1_000_000,
+    metrics: bool = True,
+    metrics_token: str | None = None,
+    metrics_rooms: int = 20,
+    workers: int = 1,
 ):
     """
     Launch a server.
@@ -32,8 +75,96 @@ def serve(
         port: The server port number
         update_dir: The path to the directory where the room updates are saved
         db_path: The path to the user database
+        store: Where the room updates are stored: one file per room, or an SQLite database in the update directory
+        compaction_size: The number of bytes appended to a room storage above which it is compacted
+        compaction_updates: The number of updates appended to a room storage above which it is compacted
+        idle_timeout: The time (in seconds) after which a room with no client is unloaded
+        memory_budget: The total size (in bytes) of the loaded rooms above which the least recently used rooms are unloaded
+        flush_interval: The time (in seconds) during which room updates are buffered before being written (0 to write every update)
+        flush_size: The number of buffered bytes above which room updates are written without waiting for the flush interval
+        fsync: When room updates are synchronized to the disk: after every write, periodically, or never (left to the OS)
+        fsync_interval: The time (in seconds) between synchronizations to the disk, if fsync is periodic
+        auth_cache_ttl: The time (in seconds) during which a validated authentication token is cached (0 to disable caching, which is always the case with several workers)
+        auth_cache_size: The maximum number of cached authentication tokens
+        broadcast_window: The time (in seconds) during which the updates of a room are merged before being sent to its clients (0 to send every update)
+        broadcast_max_delay: The maximum time (in seconds) during which the updates of a room are merged, if it keeps receiving updates
+        compression_threshold: The size (in bytes) above which the messages exchanged with the clients supporting compression are compressed (None to disable compression)
+        compression_level: The zlib compression level of the messages, from 1 (fastest) to 9 (smallest)
+        compression_max_size: The size (in bytes) above which a compressed message received from a client is rejected once decompressed
+        send_queue_size: The number of messages queued for a client above which its queue overflows
+        send_queue_overflow: What to do when the queue of a client overflows: merge the queued updates, or disconnect the client
+        thread_threshold: The size (in bytes) above which a message received from a client is applied in a worker thread (None to apply every message in the event loop)
+        metrics: Whether to expose the server metrics at /metrics, in the Prometheus text format
+        metrics_token: A token with which the metrics can be requested as a bearer token, besides being logged in as a superuser
+        metrics_rooms: The number of largest rooms which have their own labels in the metrics, the other rooms being aggregated
+        workers: The number of worker processes, between which the rooms are distributed
     """
-    run(_serve, host, port, update_dir, db_path)
+    kwargs: dict[str, Any] = dict(
+        store=store,
+        compaction_size=compaction_size,
+        compaction_updates=compaction_updates,
+        idle_timeout=idle_timeout,
+        memory_budget=memory_budget,
+        flush_interval=flush_interval,
+        flush_size=flush_size,
+        fsync=fsync,
+        fsync_interval=fsync_interval,
+        auth_cache_ttl=auth_cache_ttl,
+        auth_cache_size=auth_cache_size,
+        broadcast_window=broadcast_window,
+        broadcast_max_delay=broadcast_max_delay,
+        compression_threshold=compression_threshold,
+        compression_level=compression_level,
+        compression_max_size=compression_max_size,
+        send_queue_size=send_queue_size,
+        send_queue_overflow=send_queue_overflow,
+        thread_threshold=thread_threshold,
+        metrics=metrics,
+        metrics_token=metrics_token,
+        metrics_rooms=metrics_rooms,
+    )
+    if workers > 1:
+        # a user updated or deleted through a worker would still be cached by the other workers
+        kwargs["auth_cache_ttl"] = 0
+        _serve_workers(host, port, update_dir, db_path, workers, kwargs)
+    else:
+        run(partial(_serve, host, port, update_dir, db_path, **kwargs))
+
+
+@app.command
+def compact(
+    *,
+    update_dir: str = "",
+    store: StoreType = "file",
+    room: str | None = None,
+    history: bool = False,
+):
+    """
+    Compact the storage of rooms that are not served.
+
+    Args:
+        update_dir: The path to the directory where the room updates are saved
+        store: Where the room updates are stored: one file per room, or an SQLite database in the update directory
+        room: The ID of the room to compact (all rooms if not provided)
+        history: Whether to also drop the deleted content and the history of the rooms, which starts a new epoch
+    """
+    run(_compact, update_dir, store, room, history)
+
+
+@app.command
+def inspect(
+    path: str,
+    *,
+    top: int = 10,
+):
+    """
+    Report what the database stored in an update file is made of.
+
+    Args:
+        path: The path to the update file of a room (its snapshot file is also read if it exists)
+        top: The number of largest attribute values to report
+    """
+    print(json.dumps(run(_inspect, path, top), indent=2))
 
 
 @app.command
@@ -56,17 +187,196 @@ def create_user(
     run(_create_user, email, password, is_superuser, db_path)
 
 
-async def _serve(host: str, port: int, update_dir: str, db_path: str):
+@app.command
+def bench_server(
+    *,
+    url: str | None = None,
+    db_path: str | None = None,
+    update_dir: str | None = None,
+    server_pid: int | None = None,
+    store: StoreType = "file",
+    clients: int = 10,
+    rooms: int = 1,
+    users: int = 1,
+    duration: float = 10,
+    rate: float = 10,
+    create_weight: float = 4,
+    edit_weight: float = 4,
+    membership_weight: float = 1.5,
+    reconnect_weight: float = 0.5,
+    output: str | None = None,
+):
+    """
+    Measure how many concurrent clients a server can handle.
+
+    Args:
+        url: The URL of the server to target (a local server is started if not provided)
+        db_path: The path to the user database of the targeted server, where the users are created
+        update_dir: The path to the directory where the targeted server saves the room updates, to measure its growth
+        server_pid: The process ID of the targeted server, to measure its memory usage
+        store: Where the started server stores the room updates
+        clients: The number of simulated clients, distributed between the rooms
+        rooms: The number of rooms
+        users: The number of users created, distributed between the clients
+        duration: The time (in seconds) during which the clients change the rooms
+        rate: The mean number of operations per second of each client
+        create_weight: The relative frequency of event creations
+        edit_weight: The relative frequency of event edits
+        membership_weight: The relative frequency of catalogue membership changes
+        reconnect_weight: The relative frequency of reconnections
+        output: The file to write the JSON report to (printed if not provided)
+    """
+    weights = (create_weight, edit_weight, membership_weight, reconnect_weight)
+    with tempfile.TemporaryDirectory() as directory:
+        process = None
+        if url is None:
+            db_path = str(Path(directory) / "users.db")
+            update_dir = str(Path(directory) / "updates")
+            Path(update_dir).mkdir()
+            server_args = ["--update-dir", update_dir, "--db-path", db_path, "--store", store]
+        elif db_path is None:
+            raise ValueError("The user database of the targeted server must be provided")
+        credentials = [(f"bench_{uuid4().hex}@cocat.dev", uuid4().hex) for _ in range(users)]
+        # the report is printed to stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            for email, password in credentials:
+                run(_create_user, email, password, False, db_path)
+        if url is None:
+            port = _get_free_port()
+            url = f"http://127.0.0.1:{port}"
+            process = subprocess.Popen([
+                sys.executable, "-m", "cocat", "serve",
+                "--host", "127.0.0.1",
+                "--port", str(port),
+                *server_args,
+            ])
+            server_pid = process.pid
+        try:
+            report = run(partial(
+                _bench_server,
+                url,
+                credentials,
+                clients=clients,
+                rooms=rooms,
+                duration=duration,
+                rate=rate,
+                weights=weights,
+                server_pid=server_pid,
+                update_dir=update_dir,
+            ))
+        finally:
+            if process is not None:
+                process.send_signal(signal.SIGINT)
+                process.wait()
+    data = json.dumps(report, indent=2)
+    if output is None:
+        print(data)
+    else:
+        Path(output).write_text(data)
+
+
+async def _bench_server(url: str, credentials: list[tuple[str, str]], **kwargs: Any) -> dict[str, Any]:
+    await _wait_for_server(url)
+    return await run_load(url, credentials, **kwargs)
+
+
+async def _wait_for_server(url: str, timeout: float = 60):
+    with fail_after(timeout):
+        async with httpx.AsyncClient() as client:
+            while True:
+                try:
+                    await client.get(url)
+                except httpx.TransportError:
+                    await sleep(0.1)
+                else:
+                    return
+
+
+async def _serve(host: str, port: int, update_dir: str, db_path: str, **kwargs: Any):
     config = Config()
     config.bind = [f"{host}:{port}"]
     shutdown_event = Event()
     try:
-        cocat_app = CocatApp(update_dir, db_path)
+        cocat_app = CocatApp(update_dir, db_path, **kwargs)
         await anycorn_serve(cocat_app.app, config, shutdown_trigger=shutdown_event.wait, mode="asgi")  # type: ignore[arg-type]
     except Exception:
         shutdown_event.set()
 
 
+def _serve_workers(host: str, port: int, update_dir: str, db_path: str, workers: int, kwargs: dict[str, Any]):
+    # the tables must be created before the workers try to create them concurrently
+    run(create_db_and_tables, db_path)
+    # the workers must accept the authentication tokens created by any of them
+    os.environ.setdefault("COCAT_SECRET", str(uuid4()))
+    worker_ports = [_get_free_port() for _ in range(workers)]
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=_run_worker, args=("127.0.0.1", worker_port, update_dir, db_path, kwargs))
+        for worker_port in worker_ports
+    ]
+    for process in processes:
+        process.start()
+    try:
+        proxy_app = ProxyApp([f"http://127.0.0.1:{worker_port}" for worker_port in worker_ports])
+        run(_serve_app, proxy_app.app, host, port)
+    finally:
+        for process in processes:
+            if process.pid is not None:
+                os.kill(process.pid, signal.SIGINT)
+        for process in processes:
+            process.join()
+
+
+def _run_worker(host: str, port: int, update_dir: str, db_path: str, kwargs: dict[str, Any]):
+    with contextlib.suppress(KeyboardInterrupt):
+        run(partial(_serve, host, port, update_dir, db_path, **kwargs))
+
+
+def _get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _serve_app(app: Any, host: str, port: int):
+    config = Config()
+    config.bind = [f"{host}:{port}"]
+    await anycorn_serve(app, config, mode="asgi")
+
+
+async def _compact(update_dir: str, store: StoreType, room: str | None, history: bool):
+    async with create_store(store, update_dir).start() as room_store:
+        room_ids = await room_store.room_ids()
+        if room is not None:
+            if room not in room_ids:
+                # opening the storage of a room creates it
+                sys.exit(f"Room not found: {room}")
+            room_ids = [room]
+        for room_id in room_ids:
+            size_before, size_after = await compact_room(room_store, room_id, history)
+            print(f"Compacted {room_id} ({size_before} -> {size_after} bytes)")
+
+
+async def _inspect(path: str, top: int) -> dict[str, Any]:
+    update_path = anyio.Path(path)
+    snapshot_path = update_path.with_suffix(".snapshot")
+    snapshot = None
+    snapshot_size = 0
+    if await snapshot_path.exists():
+        _, snapshot = await read_snapshot(snapshot_path)
+        snapshot_size = (await snapshot_path.stat()).st_size
+    updates = await read_updates(update_path)
+    doc: Doc = Doc()
+    apply_updates(doc, snapshot, updates)
+    report = DB(doc).memory_report(top)
+    report["storage"] = {
+        "update_bytes": (await update_path.stat()).st_size,
+        "snapshot_bytes": snapshot_size,
+        "updates": len(updates),
+    }
+    return report
+
+
 async def _create_user(email: str, password: str, is_superuser: bool = False, db_path = "./test.db"):
     await create_db_and_tables(db_path)
 
@@ -0,0 +1,243 @@
+from __future__ import annotations
+
+import zlib
+
+import sys
+from collections.abc import AsyncGenerator, Callable
+from contextlib import asynccontextmanager
+
+from anyio import (
+    TASK_STATUS_IGNORED,
+    AsyncContextManagerMixin,
+    CancelScope,
+    Lock,
+    create_task_group,
+    get_cancelled_exc_class,
+    sleep_forever,
+)
+from anyio.abc import TaskStatus
+from httpx import Cookies
+from httpx_ws import AsyncWebSocketSession, WebSocketDisconnect, aconnect_ws
+from pycrdt import Channel, Doc
+from wiredb import ClientWire as _ClientWire, Provider
+
+if sys.version_info >= (3, 11):
+    from typing import Self
+else:  # pragma: nocover
+    from typing_extensions import Self
+
+# the websocket subprotocol with which the client and the server agree to compress messages
+SUBPROTOCOL = "cocat-zlib"
+RAW = 0
+ZLIB = 1
+# the websocket close code of a client whose document holds history dropped by a compaction of the room
+WS_STALE_CLIENT = 4409
+
+
+class StaleClientError(RuntimeError):
+    """
+    A client synchronizes a document which holds the history dropped by a compaction of the room.
+    """
+
+
+class Compression:
+    """
+    The compression of the messages exchanged between a client and a server.
+    Every message is prefixed with a byte telling if it is compressed.
+    """
+    def __init__(self, threshold: int = 1024, level: int = 6, max_size: int = 64 * 1024 * 1024) -> None:
+        """
+        Args:
+            threshold: The size (in bytes) above which a message is compressed.
+            level: The zlib compression level, from 1 (fastest) to 9 (smallest).
+            max_size: The size (in bytes) above which a decompressed message is rejected.
+        """
+        self.threshold = threshold
+        self.level = level
+        self.max_size = max_size
+
+    def encode(self, message: bytes) -> bytes:
+        """
+        Args:
+            message: The message to encode.
+
+        Returns:
+            The encoded message.
+        """
+        if len(message) < self.threshold:
+            return bytes([RAW]) + message
+        return bytes([ZLIB]) + zlib.compress(message, self.level)
+
+    def decode(self, frame: bytes) -> bytes:
+        """
+        Args:
+            frame: The encoded message.
+
+        Returns:
+            The decoded message.
+
+        Raises:
+            RuntimeError: The message is larger than the maximum size once decompressed, or it is invalid.
+        """
+        if frame[0] == RAW:
+            return frame[1:]
+        if frame[0] == ZLIB:
+            # don't decompress more than allowed, the message could be a zip bomb
+            decompressor = zlib.decompressobj()
+            message = decompressor.decompress(frame[1:], self.max_size + 1)
+            if len(message) > self.max_size:
+                raise RuntimeError(f"Decompressed message larger than {self.max_size} bytes")
+            if not decompressor.eof:
+                raise RuntimeError("Truncated compressed message")
+            return message
+        raise RuntimeError(f"Unknown message encoding: {frame[0]}")
+
+
+class CompressedChannel(Channel):
+    """
+    A channel which compresses the messages of another channel.
+    """
+    def __init__(self, channel: Channel, compression: Compression) -> None:
+        """
+        Args:
+            channel: The channel to compress the messages of.
+            compression: The compression of the messages.
+        """
+        self._channel = channel
+        self._compression = compression
+
+    @property
+    def path(self) -> str:
+        return self._channel.path
+
+    async def __anext__(self) -> bytes:
+        return self._compression.decode(await self._channel.__anext__())
+
+    async def send(self, message: bytes) -> None:
+        await self._channel.send(self._compression.encode(message))
+
+    async def recv(self) -> bytes:
+        return self._compression.decode(await self._channel.recv())
+
+
+class ClientChannel(Channel):
+    """
+    A websocket channel which tells when the server refuses the client document.
+    """
+    def __init__(self, websocket: AsyncWebSocketSession, path: str, on_stale: Callable[[], None]) -> None:
+        """
+        Args:
+            websocket: The websocket session.
+            path: The path of the room.
+            on_stale: The callable called when the server refuses the client document,
+                since it holds history dropped by a compaction of the room.
+        """
+        self._websocket = websocket
+        self._path = path
+        self._send_lock = Lock()
+        self._on_stale = on_stale
+        self.stale_reason: str | None = None
+
+    @property
+    def path(self) -> str:
+        return self._path
+
+    async def __anext__(self) -> bytes:
+        try:
+            return await self.recv()
+        except WebSocketDisconnect as exc:
+            if exc.code == WS_STALE_CLIENT:
+                self.stale_reason = exc.reason
+                self._on_stale()
+            raise StopAsyncIteration()
+        except Exception:
+            raise StopAsyncIteration()
+
+    async def send(self, message: bytes) -> None:
+        async with self._send_lock:
+            await self._websocket.send_bytes(message)
+
+    async def recv(self) -> bytes:
+        return bytes(await self._websocket.receive_bytes())
+
+
+class ClientWire(AsyncContextManagerMixin, _ClientWire):
+    """
+    A websocket client wire which asks the server to compress the messages.
+
+    Raises:
+        StaleClientError: The server refuses the document, since it holds history
+            dropped by a compaction of the room. If the document is refused while the wire
+            is used, the code using it is cancelled.
+    """
+    def __init__(
+        self,
+        id: str,
+        doc: Doc | None = None,
+        auto_update: bool = True,
+        *,
+        host: str,
+        port: int,
+        cookies: Cookies | None = None,
+        compression: Compression | None = None,
+    ) -> None:
+        """
+        Args:
+            id: The path of the room on the server.
+            doc: The document to synchronize with the room (a new one if not provided).
+            auto_update: Whether to apply and send the updates automatically.
+            host: The host name of the server.
+            port: The port number of the server.
+            cookies: The cookies sent when connecting, e.g. to authenticate.
+            compression: The compression of the messages.
+        """
+        super().__init__(doc, auto_update)
+        self._id = id
+        self._host = host
+        self._port = port
+        self._cookies = cookies
+        self._compression = Compression() if compression is None else compression
+        self._stale_reason: str | None = None
+
+    @asynccontextmanager
+    async def __asynccontextmanager__(self) -> AsyncGenerator[Self]:
+        async with create_task_group() as self._task_group:
+            await self._task_group.start(self._connect_ws)
+            if self._stale_reason is None:
+                yield self
+            self._task_group.cancel_scope.cancel()
+        # raised out of the task group, which would wrap it in an exception group
+        if self._stale_reason is not None:
+            raise StaleClientError(self._stale_reason)
+
+    async def _connect_ws(self, *, task_status: TaskStatus[None] = TASK_STATUS_IGNORED) -> None:
+        started = False
+        try:
+            ws: AsyncWebSocketSession
+            async with aconnect_ws(
+                f"{self._host}:{self._port}/{self._id}",
+                keepalive_ping_interval_seconds=None,
+                cookies=self._cookies,
+                subprotocols=[SUBPROTOCOL],
+            ) as ws:
+                with CancelScope() as scope:
+                    channel = ClientChannel(ws, self._id, scope.cancel)
+                    self.channel = channel
+                    if ws.subprotocol == SUBPROTOCOL:
+                        self.channel = CompressedChannel(self.channel, self._compression)
+                    async with Provider(self):
+                        task_status.started()
+                        started = True
+                        await sleep_forever()
+                if channel.stale_reason is not None:
+                    self._refuse(channel.stale_reason, started, task_status)
+        except get_cancelled_exc_class():
+            pass
+
+    def _refuse(self, reason: str, started: bool, task_status: TaskStatus[None]) -> None:
+        self._stale_reason = reason
+        if started:
+            # the document is refused while it is used
+            self._task_group.cancel_scope.cancel()
+        else:
+            task_status.started()
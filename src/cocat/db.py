@@ -1,12 +1,15 @@
 from __future__ import annotations
 
+import heapq
 import json
 from collections import defaultdict
 from collections.abc import Callable, Iterable
 from datetime import datetime
 from functools import partial
-from typing import Any
-from uuid import UUID
+from operator import itemgetter
+from types import TracebackType
+from typing import Any, cast
+from uuid import UUID, uuid4
 
 from pycrdt import (
     ArrayEvent,
@@ -21,25 +24,33 @@ from pycrdt import (
     handle_sync_message,
 )
 
+from .base import same_value, update_items
 from .catalogue import Catalogue
-from .event import Event
+from .event import EVENT_FIELDS, Event, read_fields
+from .instrumentation import Instrumentation, Tracer
 from .models import CatalogueModel, EventModel
+from .query import EventIndexes, Query
+from .report import attribute_sizes, read_state, read_update
 
 
 class DB:
     """
     A database which holds events and catalogues.
     """
-    def __init__(self, doc: Doc | None = None) -> None:
+    def __init__(self, doc: Doc | None = None, *, instrument: bool = False, tracer: Tracer | None = None) -> None:
         """
         Creates a database.
 
         Args:
             doc: An optional [Doc](https://y-crdt.github.io/pycrdt/api_reference/#pycrdt.Doc).
+            instrument: Whether to enable the instrumentation, see [instrument()][cocat.DB.instrument].
+            tracer: An optional [Tracer][cocat.Tracer], which enables the instrumentation.
         """
         self._doc: Doc = Doc() if doc is None else doc
+        self._instrumentation: Instrumentation | None = None
         self._catalogue_maps = self._doc.get("catalogues", type=Map)
         self._event_maps = self._doc.get("events", type=Map)
+        self._meta = self._doc.get("meta", type=Map)
         self._synced: list[DB] = []
         self._catalogue_maps.observe_deep(self._catalogues_changed)
         self._catalogue_delete_callbacks: dict[str, list[Callable[[Any], None]]] = defaultdict(list)
@@ -50,14 +61,136 @@ class DB:
         self._event_delete_callbacks: dict[str, list[Callable[[Any], None]]] = defaultdict(list)
         self._event_create_callbacks: list[Callable[[Any, Any], None]] = []
         self._event_change_callbacks: dict[str, dict[str, list[Callable[[Any, Any], None]]]] = defaultdict(lambda: defaultdict(list))
+        self._events_change_callbacks: list[Callable[[Any, Any], None]] = []
         self._events: dict[str, Event] = {}
+        self._indexes: EventIndexes | None = None
+        # the number of nested transactions opened with transaction()
+        self._transaction_depth = 0
+        if instrument or tracer is not None:
+            self.instrument(tracer)
 
     def _callback(self, callback: Callable[..., None], origin: "DB" | None, *args: Any) -> None:
         if origin is not self:
-            callback(*args)
+            if self._instrumentation is None:
+                callback(*args)
+            else:
+                self._instrumentation.call(callback, *args)
+
+    def instrument(self, tracer: Tracer | None = None) -> None:
+        """
+        Enables the instrumentation of the database: the transactions, the update bytes,
+        the validations and the dynamic filter evaluations are counted, and the processing
+        of the changes and the user callbacks are timed. The instrumentation has almost
+        no cost when it is not enabled.
+
+        Args:
+            tracer: An optional [Tracer][cocat.Tracer] to notify of the operations.
+        """
+        if self._instrumentation is None:
+            self._instrumentation = Instrumentation(tracer)
+            self._doc.observe(self._instrumentation.on_transaction)
+        else:
+            self._instrumentation.tracer = tracer
+
+    def stats(self) -> dict[str, Any]:
+        """
+        Returns:
+            The counters and timers of the database, since its instrumentation was enabled.
+
+        Raises:
+            RuntimeError: The instrumentation is not enabled.
+        """
+        if self._instrumentation is None:
+            raise RuntimeError("The database instrumentation is not enabled")
+        return self._instrumentation.stats()
+
+    def memory_report(self, top: int = 10) -> dict[str, Any]:
+        """
+        Reports what the database is made of, to decide when to compact or archive it:
+        the size of its encoded state, its live and deleted events and catalogues,
+        the items deleted but still kept in the document (tombstones), the largest
+        attribute values (by encoded size) and the number of events in each catalogue.
+        The encoded state is read in a single pass, without being applied to a document
+        or converted to Python values.
+
+        Args:
+            top: The number of largest attribute values to report.
+
+        Returns:
+            The memory report of the database.
+        """
+        with self.transaction():
+            update = self._doc.get_update()
+            state = self._doc.get_state()
+            live_event_uuids = set(self._event_maps.keys())
+            live_catalogue_uuids = set(self._catalogue_maps.keys())
+            catalogue_events = [
+                {"uuid": uuid, "name": catalogue["name"], "events": len(catalogue["events"])}
+                for uuid, catalogue in self._catalogue_maps.items()
+            ]
+        summary = read_update(update)
+        return {
+            "state_bytes": len(update),
+            "state_vector_bytes": len(state),
+            "events": {
+                "live": len(live_event_uuids),
+                "deleted": len(summary.root_keys["events"] - live_event_uuids),
+            },
+            "catalogues": {
+                "live": len(live_catalogue_uuids),
+                "deleted": len(summary.root_keys["catalogues"] - live_catalogue_uuids),
+            },
+            "tombstones": {
+                "items": summary.items,
+                "deleted_items": summary.deleted_items,
+                "deleted_ranges": summary.deleted_ranges,
+                "gc_items": summary.gc_items,
+            },
+            "largest_attributes": heapq.nlargest(top, attribute_sizes(summary), key=itemgetter("bytes")),
+            "catalogue_events": sorted(catalogue_events, key=itemgetter("events"), reverse=True),
+        }
+
+    @property
+    def epoch(self) -> str | None:
+        """
+        Returns:
+            The ID of the compaction the database was created by, see [compact()][cocat.DB.compact],
+            or `None` if it was never compacted.
+        """
+        return self._meta.get("epoch")
+
+    @property
+    def retired_clients(self) -> set[int]:
+        """
+        Returns:
+            The IDs of the clients whose changes were dropped by the compactions of the database.
+        """
+        return {int(client) for client in self._meta.get("retired_clients", [])}
+
+    def compact(self) -> DB:
+        """
+        Creates a database which only holds the live state of this one: the events and catalogues
+        keep their UUIDs and values, but the deleted content and the history of the changes
+        are dropped. The created database starts a new epoch: its document cannot be merged
+        with the documents of the previous epochs, whose clients are listed in
+        [retired_clients][cocat.DB.retired_clients].
 
-    def transaction(self) -> Transaction:
-        return self._doc.transaction(self)
+        Returns:
+            The compacted database.
+        """
+        db = DB()
+        with self.transaction(), db.transaction():
+            for uuid, event_map in self._event_maps.items():
+                db._event_maps[uuid] = copy_map(event_map)
+            for uuid, catalogue_map in self._catalogue_maps.items():
+                db._catalogue_maps[uuid] = copy_map(catalogue_map)
+            retired_clients = self.retired_clients | read_state(self._doc.get_state()).keys()
+            db._meta["retired_clients"] = sorted(retired_clients)
+            db._meta["epoch"] = str(uuid4())
+        return db
+
+    def transaction(self) -> DBTransaction:
+        return DBTransaction(self)
 
     @classmethod
     def from_json(cls, data: str, doc: Doc | None = None) -> "DB":
@@ -90,6 +223,13 @@ class DB:
         return self._doc
 
     def _catalogues_changed(self, events: list[ArrayEvent | MapEvent], transaction: Transaction) -> None:
+        if self._instrumentation is None:
+            self._process_catalogue_changes(events, transaction)
+        else:
+            with self._instrumentation.span("observer.catalogues"):
+                self._process_catalogue_changes(events, transaction)
+
+    def _process_catalogue_changes(self, events: list[ArrayEvent | MapEvent], transaction: Transaction) -> None:
         for event in events:
             path = event.path  # type: ignore[union-attr]
             if len(path) == 0:
@@ -104,8 +244,7 @@ class DB:
                         if uuid in self._catalogues:
                             del self._catalogues[uuid]
                         del self._catalogue_delete_callbacks[uuid]
-                        self._catalogue_change_callbacks
-                        del self._catalogue_change_callbacks[uuid]
+                        self._catalogue_change_callbacks.pop(uuid, None)
                     elif action == "add":
                         for create_callback in self._catalogue_create_callbacks:
                             create_callback(transaction.origin, self.get_catalogue(uuid))
@@ -170,8 +309,18 @@ class DB:
                             callback(transaction.origin, added)
 
     def _events_changed(self, events: list[MapEvent], transaction: Transaction) -> None:
+        if self._instrumentation is None:
+            self._process_event_changes(events, transaction)
+        else:
+            with self._instrumentation.span("observer.events"):
+                self._process_event_changes(events, transaction)
+
+    def _process_event_changes(self, events: list[MapEvent], transaction: Transaction) -> None:
+        changed_uuids = set()
         for event in events:
             path = event.path  # type: ignore[attr-defined]
+            if len(path) > 0:
+                changed_uuids.add(path[0])
             if len(path) == 0:
                 assert isinstance(event, MapEvent)
                 keys = event.keys  # type: ignore[attr-defined]
@@ -183,8 +332,7 @@ class DB:
                         if uuid in self._events:
                             del self._events[uuid]
                         del self._event_delete_callbacks[uuid]
-                        self._event_change_callbacks[uuid]
-                        del self._event_change_callbacks[uuid]
+                        self._event_change_callbacks.pop(uuid, None)
                     elif action == "add":
                         for create_callback in self._event_create_callbacks:
                             create_callback(transaction.origin, self.get_event(uuid))
@@ -220,6 +368,12 @@ class DB:
                     callbacks = self._event_change_callbacks[uuid][f"add_{name}"]
                     for callback in callbacks:
                         callback(transaction.origin, added)
+        if changed_uuids and self._events_change_callbacks:
+            changed_events = {
+                Event.from_uuid(uuid, self) for uuid in changed_uuids if uuid in self._event_maps
+            }
+            for events_callback in self._events_change_callbacks:
+                events_callback(transaction.origin, changed_events)
 
     @property
     def catalogues(self) -> set[Catalogue]:
@@ -349,6 +503,133 @@ class DB:
         """
         self._event_create_callbacks.append(partial(self._callback, callback))
 
+    def on_change_events(self, callback: Callable[[set[Event]], None]) -> None:
+        """
+        Registers a callback to be called once per transaction in which events are changed,
+        for instance by [update_events()][cocat.DB.update_events].
+
+        Args:
+            callback: The callback to call with the set of changed events.
+        """
+        self._events_change_callbacks.append(partial(self._callback, callback))
+
+    def update_events(self, events: Iterable[Event], **fields: Any) -> None:
+        """
+        Sets the same values to the fields of events. The values are validated once,
+        and set in a single transaction.
+
+        Args:
+            events: The events to update.
+            fields: The values of the fields to set (`start`, `stop`, `author`, `rating`,
+                `tags`, `products` or `attributes`).
+        """
+        if "uuid" in fields:
+            raise ValueError("The UUID of an event cannot be changed")
+        values: dict[str, Any] = {}
+        model = EventModel.model_construct()
+        for name, value in fields.items():
+            if self._instrumentation is not None:
+                self._instrumentation.validations += 1
+            value = getattr(EventModel.__pydantic_validator__.validate_assignment(model, name, value), name)
+            if name in ("start", "stop"):
+                value = str(value)
+            elif name in ("tags", "products"):
+                value = {val: True for val in value}
+            values[name] = value
+        with self.transaction():
+            for map in self._get_event_maps(events):
+                for name, value in values.items():
+                    if isinstance(value, dict):
+                        update_items(cast(Map, map[name]), value)
+                    elif not same_value(map[name], value):
+                        map[name] = value
+
+    def add_tags(self, events: Iterable[Event], tags: Iterable[str] | str) -> None:
+        """
+        Adds tags to events, in a single transaction.
+
+        Args:
+            events: The events to add the tags to.
+            tags: The tags to add.
+        """
+        self._add_to_events(events, "tags", dict.fromkeys([tags] if isinstance(tags, str) else tags, True))
+
+    def remove_tags(self, events: Iterable[Event], tags: Iterable[str] | str) -> None:
+        """
+        Removes tags from events, in a single transaction. The events which don't have a tag are left unchanged.
+
+        Args:
+            events: The events to remove the tags from.
+            tags: The tags to remove.
+        """
+        self._remove_from_events(events, "tags", tags)
+
+    def add_products(self, events: Iterable[Event], products: Iterable[str] | str) -> None:
+        """
+        Adds products to events, in a single transaction.
+
+        Args:
+            events: The events to add the products to.
+            products: The products to add.
+        """
+        self._add_to_events(events, "products", dict.fromkeys([products] if isinstance(products, str) else products, True))
+
+    def remove_products(self, events: Iterable[Event], products: Iterable[str] | str) -> None:
+        """
+        Removes products from events, in a single transaction. The events which don't have a product are left unchanged.
+
+        Args:
+            events: The events to remove the products from.
+            products: The products to remove.
+        """
+        self._remove_from_events(events, "products", products)
+
+    def set_attributes(self, events: Iterable[Event], **attributes: Any) -> None:
+        """
+        Sets attributes of events, in a single transaction.
+
+        Args:
+            events: The events to set the attributes of.
+            attributes: The attributes to set.
+        """
+        if self._instrumentation is not None:
+            self._instrumentation.validations += 1
+        EventModel.__pydantic_validator__.validate_assignment(EventModel.model_construct(), "attributes", attributes)
+        self._add_to_events(events, "attributes", attributes)
+
+    def remove_attributes(self, events: Iterable[Event], keys: Iterable[str] | str) -> None:
+        """
+        Removes attributes from events, in a single transaction. The events which don't have an attribute are left unchanged.
+
+        Args:
+            events: The events to remove the attributes from.
+            keys: The attribute keys to remove.
+        """
+        self._remove_from_events(events, "attributes", keys)
+
+    def _get_event_maps(self, events: Iterable[Event]) -> list[Map]:
+        try:
+            return [self._event_maps[event._uuid] for event in events]
+        except KeyError:
+            raise RuntimeError("Event has been deleted") from None
+
+    def _add_to_events(self, events: Iterable[Event], field: str, items: dict[str, Any]) -> None:
+        with self.transaction():
+            for map in self._get_event_maps(events):
+                field_map = cast(Map, map[field])
+                for key, value in items.items():
+                    if key not in field_map or not same_value(field_map[key], value):
+                        field_map[key] = value
+
+    def _remove_from_events(self, events: Iterable[Event], field: str, keys: Iterable[str] | str) -> None:
+        key_list = [keys] if isinstance(keys, str) else list(keys)
+        with self.transaction():
+            for map in self._get_event_maps(events):
+                field_map = cast(Map, map[field])
+                for key in key_list:
+                    if key in field_map:
+                        del field_map[key]
+
     def get_catalogue(self, uuid_or_name: str) -> Catalogue:
         """
         Args:
@@ -381,6 +662,54 @@ class DB:
         except KeyError:
             raise RuntimeError(f"No event found with UUID: {uuid}")
 
+    def query(self) -> Query:
+        """
+        Creates a query of the events, for instance:
+        ```py
+        db.query().where(start__gte="2025-01-01", tags__contains="storm").in_catalogue("my_catalogue").order_by("start").limit(100)
+        ```
+        The events are selected with the index which selects the fewest of them (on the dates,
+        the author, the tags, the products or the events of a catalogue), and the other conditions
+        are checked on these events only. The indexes are built when the database is first queried.
+
+        Returns:
+            A [Query][cocat.Query] which selects all the events.
+        """
+        return Query(self)
+
+    def _get_indexes(self) -> EventIndexes:
+        if self._indexes is None:
+            self._indexes = EventIndexes(self)
+        self._indexes.refresh()
+        return self._indexes
+
+    def read_events(
+        self, uuids: Iterable[UUID | str] | None = None, fields: Iterable[str] | None = None
+    ) -> list[dict[str, Any]]:
+        """
+        Reads fields of many events in a single transaction, with a single validation,
+        for instance to render them in a table.
+
+        Args:
+            uuids: The UUIDs of the events to read (all the events if not provided).
+            fields: The names of the fields to read (all the fields if not provided).
+
+        Returns:
+            The values of the fields of each event, by name, in the order of the UUIDs.
+        """
+        field_names = EVENT_FIELDS if fields is None else tuple(fields)
+        with self.transaction():
+            if uuids is None:
+                maps = list(self._event_maps.values())
+            else:
+                maps = []
+                for uuid in uuids:
+                    try:
+                        maps.append(self._event_maps[str(uuid)])
+                    except KeyError:
+                        raise RuntimeError(f"No event found with UUID: {uuid}") from None
+            return read_fields(self, maps, field_names)
+
     def _handle_sync_message(self, message: bytes, db: "DB", init: bool = False) -> None:
         if init:
             _message = create_sync_message(self._doc)
@@ -431,6 +760,85 @@ class DB:
         return json.dumps(self.to_dict())
 
 
+class DBTransaction:
+    """
+    A transaction on the document of a database, which can be used as a context manager
+    or as an async context manager, and which counts the transactions open on the database.
+    """
+
+    def __init__(self, db: DB) -> None:
+        self._db = db
+        self._transaction = db._doc.transaction(db)
+
+    def __enter__(self) -> Transaction:
+        transaction = self._transaction.__enter__()
+        self._db._transaction_depth += 1
+        return transaction
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> None:
+        self._db._transaction_depth -= 1
+        self._transaction.__exit__(exc_type, exc_value, exc_tb)
+
+    async def __aenter__(self) -> Transaction:
+        transaction = await self._transaction.__aenter__()
+        self._db._transaction_depth += 1
+        return transaction
+
+    async def __aexit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc_value: BaseException | None,
+        exc_tb: TracebackType | None,
+    ) -> bool | None:
+        self._db._transaction_depth -= 1
+        return await self._transaction.__aexit__(exc_type, exc_value, exc_tb)
+
+
+def copy_map(map: Map) -> Map:
+    """
+    Args:
+        map: The map of an event or a catalogue.
+
+    Returns:
+        A new map with the same values, and a copy of the nested maps.
+    """
+    return Map({
+        key: Map(value.to_py()) if isinstance(value, Map) else value
+        for key, value in map.items()
+    })
+
+
+def rebase_map(map: Map, source: Map, base: dict[str, Any]) -> None:
+    """
+    Gives the map of an event or a catalogue the changes made to another map, in another document,
+    since it had the values of a base. The values which were not changed are left as they are,
+    also in the nested maps, so that the changes made to the map in the meantime are kept.
+
+    Args:
+        map: The map to update.
+        source: The map whose changes to give.
+        base: The values of the source map before it was changed.
+    """
+    for key in base:
+        if key not in source and key in map:
+            del map[key]
+    for key, value in source.items():
+        target = map.get(key)
+        if not isinstance(value, Map):
+            if key not in base or not same_value(base[key], value):
+                map[key] = value
+        elif not isinstance(target, Map):
+            map[key] = Map(value.to_py())
+        else:
+            nested_base = base.get(key)
+            rebase_map(target, value, nested_base if isinstance(nested_base, dict) else {})
+
+
 def send_update(destination: DB, source: DB, event: TransactionEvent) -> None:
     message = create_update_message(event.update)
     destination._handle_sync_message(message, source)
@@ -1,5 +1,5 @@
 import sys
-from collections.abc import Callable, Iterable
+from collections.abc import Callable, Iterable, Sequence
 from dataclasses import dataclass
 from datetime import datetime
 from functools import partial
@@ -7,9 +7,10 @@ from json import dumps
 from typing import Any, TYPE_CHECKING
 
 from pycrdt import Map
+from pydantic import TypeAdapter
 
 from .base import Mixin
-from .models import EventModel
+from .models import EventFieldsModel, EventModel
 
 if sys.version_info >= (3, 11):
     from typing import Self
@@ -19,6 +20,10 @@ else:  # pragma: nocover
 if TYPE_CHECKING:
     from .db import DB
 
+EVENT_FIELDS = tuple(EventModel.model_fields)
+# validates the fields of many events at once
+EVENTS_FIELDS_ADAPTER = TypeAdapter(list[EventFieldsModel])
+
 
 @dataclass(eq=False)
 class Event(Mixin):
@@ -47,12 +52,16 @@ class Event(Mixin):
         with self._db.transaction():
             self._check_deleted()
             value = self._map[name]
+            if self._db._instrumentation is not None:
+                self._db._instrumentation.validations += 1
             model = EventModel.__pydantic_validator__.validate_assignment(EventModel.model_construct(), name, value)
             return getattr(model, name)
 
     def _set(self, name: str, value: Any, func: Callable[[Any], Any] | None = None) -> None:
         with self._db.transaction():
             self._check_deleted()
+            if self._db._instrumentation is not None:
+                self._db._instrumentation.validations += 1
             model = EventModel.__pydantic_validator__.validate_assignment(EventModel.model_construct(), name, value)
             val = getattr(model, name)
             if func is not None:
@@ -116,6 +125,35 @@ class Event(Mixin):
             dct["attributes"] = dict(sorted(dct["attributes"].items()))
             return dict(sorted(dct.items()))
 
+    def get(self, *fields: str) -> dict[str, Any]:
+        """
+        Reads fields of the event in a single transaction, with a single validation.
+
+        Args:
+            fields: The names of the fields to read (all the fields if not provided).
+
+        Returns:
+            The values of the fields, by name.
+        """
+        with self._db.transaction():
+            self._check_deleted()
+            return read_fields(self._db, [self._map], fields or EVENT_FIELDS)[0]
+
+    def to_model(self) -> EventModel:
+        """
+        Returns:
+            The event as an [EventModel][cocat.EventModel].
+        """
+        with self._db.transaction():
+            self._check_deleted()
+            dct = self._map.to_py()
+            assert dct is not None
+            dct["tags"] = list(dct["tags"])
+            dct["products"] = list(dct["products"])
+            if self._db._instrumentation is not None:
+                self._db._instrumentation.validations += 1
+            return EventModel.model_validate(dct)
+
     def on_change_author(self, callback: Callable[[Any], None]) -> None:
         """
         Registers a callback to be called when the event author changes.
@@ -279,3 +317,40 @@ class Event(Mixin):
             keys: The products to remove from the event.
         """
         self._remove_keys("products", keys)
+
+
+def read_fields(db: "DB", maps: Iterable[Map], fields: Sequence[str]) -> list[dict[str, Any]]:
+    """
+    Reads fields of events, which must be done in a transaction.
+
+    Args:
+        db: The database the events belong to.
+        maps: The maps of the events.
+        fields: The names of the fields to read.
+
+    Returns:
+        The values of the fields of each event, by name.
+    """
+    for name in fields:
+        if name not in EVENT_FIELDS:
+            raise ValueError(f"Unknown event field: {name}")
+    values = []
+    for map in maps:
+        event_values = {}
+        for name in fields:
+            value = map[name]
+            if isinstance(value, Map):
+                value = value.to_py() if name == "attributes" else list(value.keys())
+            event_values[name] = value
+        values.append(event_values)
+    if db._instrumentation is not None:
+        db._instrumentation.validations += 1
+    models = EVENTS_FIELDS_ADAPTER.validate_python(values)
+    result = []
+    for model in models:
+        event_values = {name: getattr(model, name) for name in fields}
+        for name in ("tags", "products"):
+            if name in event_values:
+                event_values[name] = set(event_values[name])
+        result.append(event_values)
+    return result
@@ -0,0 +1,122 @@
+from __future__ import annotations
+
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Any
+
+from pycrdt import TransactionEvent
+
+
+class Tracer:
+    """
+    A tracer which is notified when the operations of a database start and end,
+    for instance to forward them to a profiler. Subclass it and override its hooks.
+    The operations are:
+
+    - `"observer.events"` and `"observer.catalogues"`: the processing of the changes to the events or catalogues.
+    - `"callback"`: a user callback, with a `callback` attribute holding its name.
+    - `"dynamic_filter"`: the evaluation of the dynamic filter of a catalogue, with a `catalogue` attribute holding its UUID.
+    """
+    def start(self, name: str, attributes: dict[str, Any]) -> Any:
+        """
+        Called when an operation starts.
+
+        Args:
+            name: The name of the operation.
+            attributes: The attributes of the operation.
+
+        Returns:
+            A token passed to [end()][cocat.Tracer.end].
+        """
+
+    def end(self, name: str, token: Any) -> None:
+        """
+        Called when an operation ends.
+
+        Args:
+            name: The name of the operation.
+            token: The token returned by [start()][cocat.Tracer.start].
+        """
+
+
+@dataclass
+class Timer:
+    calls: int = 0
+    seconds: float = 0
+
+    def to_dict(self) -> dict[str, int | float]:
+        return {"calls": self.calls, "seconds": self.seconds}
+
+
+class Instrumentation:
+    """
+    The counters and timers of a database.
+    """
+    def __init__(self, tracer: Tracer | None = None) -> None:
+        """
+        Args:
+            tracer: The tracer to notify of the operations, if any.
+        """
+        self.tracer = tracer
+        self.transactions = 0
+        self.update_bytes = 0
+        self.validations = 0
+        self.dynamic_filter_evaluations = 0
+        self.timers: defaultdict[str, Timer] = defaultdict(Timer)
+        self.callbacks: defaultdict[str, Timer] = defaultdict(Timer)
+
+    def on_transaction(self, event: TransactionEvent) -> None:
+        self.transactions += 1
+        self.update_bytes += len(event.update)
+
+    @contextmanager
+    def span(self, name: str, timer: Timer | None = None, **attributes: Any) -> Iterator[None]:
+        """
+        Times an operation and notifies the tracer.
+
+        Args:
+            name: The name of the operation.
+            timer: The timer in which to record the operation, by default the timer with its name.
+            attributes: The attributes of the operation, passed to the tracer.
+        """
+        token = None if self.tracer is None else self.tracer.start(name, attributes)
+        t0 = perf_counter()
+        try:
+            yield
+        finally:
+            if timer is None:
+                timer = self.timers[name]
+            timer.calls += 1
+            timer.seconds += perf_counter() - t0
+            if self.tracer is not None:
+                self.tracer.end(name, token)
+
+    def call(self, callback: Callable[..., None], *args: Any) -> None:
+        """
+        Calls a user callback and times it.
+
+        Args:
+            callback: The callback to call.
+            args: The arguments to pass to the callback.
+        """
+        name = get_name(callback)
+        with self.span("callback", self.callbacks[name], callback=name):
+            callback(*args)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "transactions": self.transactions,
+            "update_bytes": self.update_bytes,
+            "validations": self.validations,
+            "dynamic_filter_evaluations": self.dynamic_filter_evaluations,
+            "timers": {name: timer.to_dict() for name, timer in self.timers.items()},
+            "callbacks": {name: timer.to_dict() for name, timer in self.callbacks.items()},
+        }
+
+
+def get_name(callback: Callable[..., Any]) -> str:
+    name = getattr(callback, "__qualname__", None) or type(callback).__qualname__
+    return f"{callback.__module__}.{name}" if hasattr(callback, "__module__") else name
@@ -0,0 +1,380 @@
+from __future__ import annotations
+
+import random
+from collections import Counter
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from functools import partial
+from pathlib import Path
+from time import perf_counter
+from typing import Any, Literal
+
+import httpx
+from anyio import TASK_STATUS_IGNORED, Event as AnyioEvent, create_task_group, current_time, fail_after, sleep
+from anyio.abc import TaskStatus
+from pycrdt import Map, MapEvent
+
+from .catalogue import Catalogue
+from .compression import ClientWire
+from .db import DB
+from .event import Event
+
+Operation = Literal["create", "edit", "membership", "reconnect"]
+OPERATIONS: tuple[Operation, ...] = ("create", "edit", "membership", "reconnect")
+# the map where the clients write the time of their operations,
+# so that the latency can be measured when they are received
+PROBES = "bench"
+CATALOGUE_NAME = "bench"
+
+
+@dataclass(eq=False)
+class LoadStats:
+    """
+    The statistics of a load test.
+    """
+    operations: Counter[str] = field(default_factory=Counter)
+    latencies: list[float] = field(default_factory=list)
+    reconnection_times: list[float] = field(default_factory=list)
+    errors: int = 0
+    rss: list[int] = field(default_factory=list)
+
+
+class SimulatedClient:
+    """
+    A client which connects to a room and keeps changing it.
+    """
+    def __init__(
+        self,
+        name: str,
+        url: httpx.URL,
+        room_id: str,
+        cookies: httpx.Cookies,
+        stats: LoadStats,
+        *,
+        rate: float,
+        weights: Sequence[float],
+    ) -> None:
+        """
+        Args:
+            name: The name of the client, used as the author of its events.
+            url: The URL of the server.
+            room_id: The ID of the room to connect to.
+            cookies: The authentication cookies.
+            stats: The statistics in which to record the client activity.
+            rate: The mean number of operations per second.
+            weights: The relative frequency of each operation in `OPERATIONS`.
+        """
+        self._name = name
+        self._url = url
+        self._room_id = room_id
+        self._cookies = cookies
+        self._stats = stats
+        self._rate = rate
+        self._weights = weights
+        self._db = DB()
+        self._probes = self._db.doc.get(PROBES, type=Map)
+        self._events: list[Event] = []
+        self._operation_nb = 0
+
+    async def run(self, stop: float) -> None:
+        """
+        Runs operations until a deadline, reconnecting when asked to or after an error.
+
+        Args:
+            stop: The time (as given by `anyio.current_time()`) at which to stop.
+        """
+        while current_time() < stop:
+            t0 = perf_counter()
+            try:
+                async with self._connect():
+                    if self._operation_nb:
+                        self._stats.reconnection_times.append(perf_counter() - t0)
+                    catalogue = await self._get_catalogue()
+                    while current_time() < stop:
+                        await sleep(random.expovariate(self._rate))
+                        operation = random.choices(OPERATIONS, self._weights)[0]
+                        if operation in ("edit", "membership") and not self._events:
+                            operation = "create"
+                        self._operation_nb += 1
+                        self._stats.operations[operation] += 1
+                        if operation == "reconnect":
+                            break
+                        self._apply(operation, catalogue)
+            except Exception:
+                self._stats.errors += 1
+                await sleep(0.1)
+
+    def _connect(self) -> ClientWire:
+        host, port = get_address(self._url)
+        return ClientWire(f"room/{self._room_id}", self._db.doc, host=host, port=port, cookies=self._cookies)
+
+    async def _get_catalogue(self) -> Catalogue:
+        # the catalogue is created by the observer of the room
+        with fail_after(10):
+            while True:
+                try:
+                    return self._db.get_catalogue(CATALOGUE_NAME)
+                except RuntimeError:
+                    await sleep(0.01)
+
+    def _apply(self, operation: Operation, catalogue: Catalogue) -> None:
+        with self._db.transaction():
+            if operation == "create":
+                start = datetime(2025, 1, 1) + timedelta(seconds=random.randrange(365 * 86400))
+                event = self._db.create_event(
+                    start=start,
+                    stop=start + timedelta(seconds=random.randrange(1, 86400)),
+                    author=self._name,
+                    tags=[f"tag{random.randrange(10)}"],
+                )
+                self._events.append(event)
+            elif operation == "edit":
+                random.choice(self._events).rating = random.randrange(10)
+            elif operation == "membership":
+                event = random.choice(self._events)
+                if event in catalogue:
+                    catalogue.remove_events(event)
+                else:
+                    catalogue.add_events(event)
+            self._probes[f"{self._name}-{self._operation_nb}"] = perf_counter()
+
+
+class RoomObserver:
+    """
+    A client which creates the catalogue of a room, and measures the time it takes
+    for the operations of the other clients to be received.
+    """
+    def __init__(self, url: httpx.URL, room_id: str, cookies: httpx.Cookies, stats: LoadStats) -> None:
+        """
+        Args:
+            url: The URL of the server.
+            room_id: The ID of the room to connect to.
+            cookies: The authentication cookies.
+            stats: The statistics in which to record the latencies.
+        """
+        self._url = url
+        self._room_id = room_id
+        self._cookies = cookies
+        self._stats = stats
+        self._db = DB()
+        # the map must be kept for its subscription to be kept
+        self._probes = self._db.doc.get(PROBES, type=Map)
+        self._probes.observe(self._on_probe)
+        self._recording = False
+
+    def _on_probe(self, event: MapEvent) -> None:
+        if not self._recording:
+            return
+        now = perf_counter()
+        for value in event.keys.values():  # type: ignore[attr-defined]
+            if value["action"] == "add":
+                self._stats.latencies.append(now - value["newValue"])
+
+    async def run(self, stop: AnyioEvent, *, task_status: TaskStatus[None] = TASK_STATUS_IGNORED) -> None:
+        """
+        Connects to the room and records the latencies until stopped.
+
+        Args:
+            stop: The event which stops the observer when set.
+            task_status: The task status, set when the catalogue of the room exists.
+        """
+        host, port = get_address(self._url)
+        async with ClientWire(f"room/{self._room_id}", self._db.doc, host=host, port=port, cookies=self._cookies):
+            try:
+                self._db.get_catalogue(CATALOGUE_NAME)
+            except RuntimeError:
+                self._db.create_catalogue(name=CATALOGUE_NAME, author="observer")
+            self._recording = True
+            task_status.started()
+            await stop.wait()
+
+
+def get_address(url: httpx.URL) -> tuple[str, int]:
+    """
+    Args:
+        url: The URL of the server.
+
+    Returns:
+        The host (with the scheme) and the port of the server, which is the default port
+        of the scheme if the URL doesn't have one.
+    """
+    port = url.port or (443 if url.scheme == "https" else 80)
+    return f"{url.scheme}://{url.host}", port
+
+
+async def log_in(url: httpx.URL, email: str, password: str) -> httpx.Cookies:
+    """
+    Args:
+        url: The URL of the server.
+        email: The user e-mail.
+        password: The user password.
+
+    Returns:
+        The authentication cookies.
+    """
+    async with httpx.AsyncClient() as client:
+        response = await client.post(url.join("/auth/jwt/login"), data={"username": email, "password": password})
+    response.raise_for_status()
+    cookie = response.cookies.get("fastapiusersauth")
+    assert cookie is not None
+    cookies = httpx.Cookies()
+    cookies.set("fastapiusersauth", cookie)
+    return cookies
+
+
+async def run_load(
+    url: str,
+    credentials: Sequence[tuple[str, str]],
+    *,
+    clients: int = 10,
+    rooms: int = 1,
+    duration: float = 10,
+    rate: float = 10,
+    weights: Sequence[float] = (4, 4, 1.5, 0.5),
+    server_pid: int | None = None,
+    update_dir: str | None = None,
+) -> dict[str, Any]:
+    """
+    Connects simulated clients to the rooms of a server, and measures how the server copes.
+
+    Args:
+        url: The URL of the server.
+        credentials: The e-mails and passwords of the users, which are distributed between the clients.
+        clients: The number of simulated clients, which are distributed between the rooms.
+        rooms: The number of rooms.
+        duration: The time (in seconds) during which the clients change the rooms.
+        rate: The mean number of operations per second of each client.
+        weights: The relative frequency of each operation: event creation, event edit,
+            catalogue membership change, and reconnection.
+        server_pid: The process ID of the server, to measure its memory usage.
+        update_dir: The directory where the server stores the rooms, to measure its growth.
+
+    Returns:
+        The report of the load test.
+    """
+    server_url = httpx.URL(url)
+    stats = LoadStats()
+    room_ids = [f"bench{i}" for i in range(rooms)]
+    storage_size_before = None if update_dir is None else get_storage_size(update_dir)
+    cookies = [await log_in(server_url, email, password) for email, password in credentials]
+    stopped = AnyioEvent()
+    async with create_task_group() as tg:
+        for i, room_id in enumerate(room_ids):
+            observer = RoomObserver(server_url, room_id, cookies[i % len(cookies)], stats)
+            await tg.start(partial(observer.run, stop=stopped))
+        if server_pid is not None:
+            tg.start_soon(sample_rss, server_pid, stats, stopped)
+        t0 = perf_counter()
+        stop = current_time() + duration
+        async with create_task_group() as client_tg:
+            for i in range(clients):
+                client = SimulatedClient(
+                    f"client{i}",
+                    server_url,
+                    room_ids[i % rooms],
+                    cookies[i % len(cookies)],
+                    stats,
+                    rate=rate,
+                    weights=weights,
+                )
+                client_tg.start_soon(client.run, stop)
+        elapsed = perf_counter() - t0
+        # let the last operations reach the observers
+        await sleep(1)
+        stopped.set()
+
+    operation_nb = sum(stats.operations.values())
+    report: dict[str, Any] = {
+        "clients": clients,
+        "rooms": rooms,
+        "seconds": elapsed,
+        "operations": dict(stats.operations),
+        "operations_per_second": operation_nb / elapsed,
+        "sync_latency": summarize(stats.latencies),
+        "reconnection_time": summarize(stats.reconnection_times),
+        "errors": stats.errors,
+        "server_rss": None,
+        "storage_size": None,
+    }
+    if stats.rss:
+        report["server_rss"] = {"start": stats.rss[0], "end": stats.rss[-1], "max": max(stats.rss)}
+    if update_dir is not None and storage_size_before is not None:
+        storage_size_after = get_storage_size(update_dir)
+        report["storage_size"] = {
+            "start": storage_size_before,
+            "end": storage_size_after,
+            "growth": storage_size_after - storage_size_before,
+        }
+    return report
+
+
+async def sample_rss(pid: int, stats: LoadStats, stop: AnyioEvent, interval: float = 0.5) -> None:
+    while not stop.is_set():
+        rss = get_rss(pid)
+        if rss is not None:
+            stats.rss.append(rss)
+        await sleep(interval)
+
+
+def get_rss(pid: int) -> int | None:
+    """
+    Args:
+        pid: The process ID.
+
+    Returns:
+        The resident set size (in bytes) of the process, or `None` if it is not available.
+    """
+    try:
+        status = Path(f"/proc/{pid}/status").read_text()
+    except OSError:
+        return None
+    for line in status.splitlines():
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+def get_storage_size(update_dir: str) -> int:
+    """
+    Args:
+        update_dir: The directory where the server stores the rooms.
+
+    Returns:
+        The total size (in bytes) of the files in the directory.
+    """
+    return sum(path.stat().st_size for path in Path(update_dir).iterdir() if path.is_file())
+
+
+def summarize(values: list[float]) -> dict[str, float | int | None]:
+    """
+    Args:
+        values: The measured values.
+
+    Returns:
+        The number of values, their mean, percentiles and maximum.
+    """
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p90": None, "p99": None, "max": None}
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": values[-1],
+    }
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """
+    Args:
+        sorted_values: The sorted values.
+        q: The percentile, between 0 and 100.
+
+    Returns:
+        The value below which `q` percent of the values fall (nearest rank).
+    """
+    index = max(0, min(len(sorted_values) - 1, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
@@ -29,3 +29,18 @@ class CatalogueModel(BaseModel):
     tags: list[str] = Field(default_factory=list)
     events: list[str] = Field(default_factory=list)
     attributes: dict[str, Any] = Field(default_factory=dict)
+
+
+class EventFieldsModel(BaseModel):
+    """
+    The [pydantic](https://docs.pydantic.dev) model for reading some of the fields of events,
+    see [Event.get()][cocat.Event.get].
+    """
+    uuid: UUID | None = None
+    start: datetime | None = None
+    stop: datetime | None = None
+    author: str | None = None
+    tags: list[str] | None = None
+    products: list[str] | None = None
+    rating: int | None = None
+    attributes: dict[str, Any] | None = None
@@ -0,0 +1,528 @@
+from __future__ import annotations
+
+import operator
+from bisect import bisect_left, bisect_right, insort
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass, replace
+from datetime import datetime, timezone
+from itertools import islice
+from typing import TYPE_CHECKING, Any, cast
+from uuid import UUID
+
+from pycrdt import Map, MapEvent, Transaction
+from pydantic import TypeAdapter
+
+from .event import Event, read_fields
+
+if TYPE_CHECKING:
+    from .db import DB
+
+OPERATORS: dict[str, Callable[[Any, Any], bool]] = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "lt": operator.lt,
+    "lte": operator.le,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "in": lambda value, values: value in values,
+    "contains": operator.contains,
+}
+ORDERING_OPERATORS = {"lt", "lte", "gt", "gte"}
+# the operators supported by each field, and the type of the values they are compared with
+LOOKUPS: dict[str, tuple[set[str], TypeAdapter[Any]]] = {
+    "uuid": ({"eq", "ne", "in"}, TypeAdapter(UUID)),
+    "start": ({"eq", "ne", "lt", "lte", "gt", "gte"}, TypeAdapter(datetime)),
+    "stop": ({"eq", "ne", "lt", "lte", "gt", "gte"}, TypeAdapter(datetime)),
+    "author": ({"eq", "ne", "in"}, TypeAdapter(str)),
+    "rating": ({"eq", "ne", "lt", "lte", "gt", "gte", "in"}, TypeAdapter(int | None)),
+    "tags": ({"contains"}, TypeAdapter(str)),
+    "products": ({"contains"}, TypeAdapter(str)),
+}
+ORDER_FIELDS = {"uuid", "start", "stop", "author", "rating"}
+# the orders in which the events can be read from the index on their start date
+INDEX_ORDERS = {
+    (("start", False),),
+    (("start", True),),
+    (("start", False), ("uuid", False)),
+    (("start", True), ("uuid", True)),
+}
+# the number of candidate events which are read at once, when they are read in the order of an index
+BATCH_SIZE = 1000
+
+
+def to_utc(date: datetime) -> datetime:
+    # naive dates are considered to be in UTC, so that they can be compared with aware dates
+    if date.tzinfo is None:
+        return date.replace(tzinfo=timezone.utc)
+    return date
+
+
+@dataclass(frozen=True)
+class Condition:
+    """
+    A condition on a field of the events, or on one of their attributes.
+    """
+    lookup: str
+    field: str
+    operator: str
+    value: Any
+    attribute: str | None = None
+
+    @classmethod
+    def parse(cls, lookup: str, value: Any) -> Condition:
+        """
+        Args:
+            lookup: The field, the attribute (`attributes__<name>`) and/or the operator
+                (`<field>__<operator>`, `eq` by default).
+            value: The value to compare the field with.
+
+        Returns:
+            The condition, with a validated value.
+        """
+        name, _, op = lookup.partition("__")
+        attribute = None
+        if name == "attributes":
+            attribute, _, op = op.partition("__")
+            if not attribute:
+                raise ValueError(f"Unsupported lookup: {lookup}")
+        op = op or "eq"
+        if op not in OPERATORS:
+            raise ValueError(f"Unsupported lookup: {lookup}")
+        if attribute is None:
+            if name not in LOOKUPS or op not in LOOKUPS[name][0]:
+                raise ValueError(f"Unsupported lookup: {lookup}")
+            adapter = LOOKUPS[name][1]
+            if op == "in":
+                value = [adapter.validate_python(val) for val in value]
+            else:
+                value = adapter.validate_python(value)
+            if name in ("start", "stop"):
+                value = to_utc(value)
+        return cls(lookup, name, op, value, attribute)
+
+    def matches(self, values: dict[str, Any]) -> bool:
+        """
+        Args:
+            values: The values of the fields of an event.
+
+        Returns:
+            Whether the event matches the condition.
+        """
+        value = values[self.field]
+        if self.attribute is not None:
+            if self.attribute not in value:
+                return False
+            value = value[self.attribute]
+        elif self.field in ("start", "stop"):
+            value = to_utc(value)
+        if value is None and self.operator in ORDERING_OPERATORS:
+            return False
+        try:
+            return OPERATORS[self.operator](value, self.value)
+        except TypeError:
+            return False
+
+
+@dataclass(frozen=True)
+class Plan:
+    """
+    How a query is executed.
+    """
+    index: str | None
+    estimate: int
+    condition: Condition | None = None
+    catalogue: str | None = None
+    ordered: bool = False
+
+    def to_dict(self, query: Query) -> dict[str, Any]:
+        filters = [condition.lookup for condition in query._conditions if condition is not self.condition]
+        filters += [f"in_catalogue({catalogue!r})" for catalogue in query._catalogues if catalogue != self.catalogue]
+        return {
+            "index": self.index,
+            "lookup": self.condition.lookup if self.condition else self.catalogue,
+            "estimated_events": self.estimate,
+            "filters": filters,
+            "order": None if not query._order else "index" if self.ordered else "sort",
+            "limit": query._limit,
+            "offset": query._offset,
+        }
+
+
+class EventIndexes:
+    """
+    The indexes of the events of a database on their dates, author, tags and products.
+    They are built when they are first used, and then updated with the events which have changed.
+    """
+    def __init__(self, db: DB) -> None:
+        """
+        Args:
+            db: The database to index.
+        """
+        self._db = db
+        self._entries: dict[str, tuple[datetime, datetime, str, list[str], list[str]]] = {}
+        self._starts: list[tuple[datetime, str]] = []
+        self._stops: list[tuple[datetime, str]] = []
+        self._authors: dict[str, set[str]] = {}
+        self._tags: dict[str, set[str]] = {}
+        self._products: dict[str, set[str]] = {}
+        # the UUIDs of the events which have changed, or None if the indexes must be rebuilt
+        self._changed: set[str] | None = None
+        db._event_maps.observe_deep(self._on_change)
+
+    def _on_change(self, events: list[MapEvent], transaction: Transaction) -> None:
+        if self._changed is None:
+            return
+        for event in events:
+            path = event.path  # type: ignore[attr-defined]
+            if path:
+                self._changed.add(path[0])
+            else:
+                self._changed.update(event.keys)  # type: ignore[attr-defined]
+        if len(self._changed) > len(self._entries) // 4:
+            # rebuilding is faster than updating many events
+            self._changed = None
+
+    def refresh(self) -> None:
+        """
+        Updates the indexes with the events which have changed since they were last used.
+        """
+        with self._db.transaction():
+            if self._changed is None:
+                self._entries = {}
+                self._authors = {}
+                self._tags = {}
+                self._products = {}
+                for uuid, event_map in self._db._event_maps.items():
+                    self._add(uuid, event_map, sort=False)
+                self._starts = sorted((entry[0], uuid) for uuid, entry in self._entries.items())
+                self._stops = sorted((entry[1], uuid) for uuid, entry in self._entries.items())
+            else:
+                for uuid in self._changed:
+                    self._remove(uuid)
+                    if uuid in self._db._event_maps:
+                        self._add(uuid, self._db._event_maps[uuid], sort=True)
+        self._changed = set()
+
+    def _add(self, uuid: str, event_map: Map, sort: bool) -> None:
+        start = to_utc(datetime.fromisoformat(event_map["start"]))
+        stop = to_utc(datetime.fromisoformat(event_map["stop"]))
+        author = event_map["author"]
+        tags = list(cast(Map, event_map["tags"]).keys())
+        products = list(cast(Map, event_map["products"]).keys())
+        self._entries[uuid] = (start, stop, author, tags, products)
+        self._authors.setdefault(author, set()).add(uuid)
+        for tag in tags:
+            self._tags.setdefault(tag, set()).add(uuid)
+        for product in products:
+            self._products.setdefault(product, set()).add(uuid)
+        if sort:
+            insort(self._starts, (start, uuid))
+            insort(self._stops, (stop, uuid))
+
+    def _remove(self, uuid: str) -> None:
+        if uuid not in self._entries:
+            return
+        start, stop, author, tags, products = self._entries.pop(uuid)
+        del self._starts[bisect_left(self._starts, (start, uuid))]
+        del self._stops[bisect_left(self._stops, (stop, uuid))]
+        self._authors[author].discard(uuid)
+        for tag in tags:
+            self._tags[tag].discard(uuid)
+        for product in products:
+            self._products[product].discard(uuid)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def uuids(self) -> list[str]:
+        """
+        Returns:
+            The UUIDs of all the events, sorted by start date.
+        """
+        return [uuid for _, uuid in self._starts]
+
+    def can_use(self, condition: Condition) -> bool:
+        """
+        Args:
+            condition: The condition to select events with.
+
+        Returns:
+            Whether an index can select the events matching the condition.
+        """
+        if condition.attribute is not None:
+            return False
+        if condition.field in ("start", "stop"):
+            return condition.operator != "ne"
+        if condition.field in ("uuid", "author"):
+            return condition.operator in ("eq", "in")
+        return condition.field in ("tags", "products")
+
+    def estimate(self, condition: Condition) -> int:
+        """
+        Args:
+            condition: A condition for which `can_use()` is true.
+
+        Returns:
+            The number of events the index selects for the condition.
+        """
+        if condition.field in ("start", "stop"):
+            begin, end = self._range(condition)
+            return end - begin
+        return len(self.select(condition))
+
+    def select(self, condition: Condition) -> list[str]:
+        """
+        Args:
+            condition: A condition for which `can_use()` is true.
+
+        Returns:
+            The UUIDs of the events matching the condition, sorted by date if the condition is on a date.
+        """
+        if condition.field in ("start", "stop"):
+            begin, end = self._range(condition)
+            entries = self._starts if condition.field == "start" else self._stops
+            return [uuid for _, uuid in entries[begin:end]]
+        values = condition.value if condition.operator == "in" else [condition.value]
+        if condition.field == "uuid":
+            return [str(uuid) for uuid in values if str(uuid) in self._entries]
+        index = {"author": self._authors, "tags": self._tags, "products": self._products}[condition.field]
+        uuids: set[str] = set()
+        for value in values:
+            uuids |= index.get(value, set())
+        return list(uuids)
+
+    def _range(self, condition: Condition) -> tuple[int, int]:
+        entries = self._starts if condition.field == "start" else self._stops
+        date = condition.value
+        begin, end = 0, len(entries)
+        op = condition.operator
+        if op in ("gt", "gte", "eq"):
+            begin = (bisect_right if op == "gt" else bisect_left)(entries, date, key=_get_date)
+        if op in ("lt", "lte", "eq"):
+            end = (bisect_left if op == "lt" else bisect_right)(entries, date, key=_get_date)
+        return begin, end
+
+
+def _get_date(entry: tuple[datetime, str]) -> datetime:
+    return entry[0]
+
+
+@dataclass(frozen=True)
+class Query:
+    """
+    A query of the events of a database, created with [DB.query()][cocat.DB.query].
+    Each method returns a new query, which can be executed with [all()][cocat.Query.all].
+    """
+    _db: DB
+    _conditions: tuple[Condition, ...] = ()
+    _catalogues: tuple[str, ...] = ()
+    _order: tuple[tuple[str, bool], ...] = ()
+    _limit: int | None = None
+    _offset: int = 0
+
+    def where(self, **lookups: Any) -> Query:
+        """
+        Selects the events which match conditions, for instance:
+        ```py
+        db.query().where(start__gte="2025-01-01", tags__contains="storm", attributes__region="north")
+        ```
+
+        Args:
+            lookups: The conditions, as `<field>__<operator>=<value>`, where the field is `uuid`,
+                `start`, `stop`, `author`, `rating`, `tags`, `products` or `attributes__<name>`,
+                and the operator is `eq` (the default), `ne`, `lt`, `lte`, `gt`, `gte`,
+                `in` or `contains`.
+
+        Returns:
+            The query with the conditions.
+        """
+        conditions = tuple(Condition.parse(lookup, value) for lookup, value in lookups.items())
+        return replace(self, _conditions=self._conditions + conditions)
+
+    def in_catalogue(self, uuid_or_name: str) -> Query:
+        """
+        Selects the (static) events of a catalogue.
+
+        Args:
+            uuid_or_name: The UUID of the catalogue, or its name.
+
+        Returns:
+            The query with the condition.
+        """
+        return replace(self, _catalogues=self._catalogues + (uuid_or_name,))
+
+    def order_by(self, *fields: str) -> Query:
+        """
+        Sorts the events.
+
+        Args:
+            fields: The fields to sort the events by (`uuid`, `start`, `stop`, `author` or `rating`),
+                prefixed with `-` for a descending order.
+
+        Returns:
+            The query with the order.
+        """
+        order = []
+        for name in fields:
+            descending = name.startswith("-")
+            name = name.removeprefix("-")
+            if name not in ORDER_FIELDS:
+                raise ValueError(f"Cannot order by: {name}")
+            order.append((name, descending))
+        return replace(self, _order=tuple(order))
+
+    def limit(self, count: int) -> Query:
+        """
+        Args:
+            count: The maximum number of events to select.
+
+        Returns:
+            The query with the limit.
+        """
+        return replace(self, _limit=count)
+
+    def offset(self, count: int) -> Query:
+        """
+        Args:
+            count: The number of events to skip.
+
+        Returns:
+            The query with the offset.
+        """
+        return replace(self, _offset=count)
+
+    def all(self) -> list[Event]:
+        """
+        Returns:
+            The selected events.
+        """
+        uuids = self.uuids()
+        with self._db.transaction():
+            return [Event.from_uuid(uuid, self._db) for uuid in uuids]
+
+    def __iter__(self) -> Iterator[Event]:
+        return iter(self.all())
+
+    def count(self) -> int:
+        """
+        Returns:
+            The number of selected events.
+        """
+        return len(self.uuids())
+
+    def uuids(self) -> list[str]:
+        """
+        Returns:
+            The UUIDs of the selected events.
+        """
+        return self._run()[0]
+
+    def explain(self) -> dict[str, Any]:
+        """
+        Returns:
+            How the query is executed: the index used to select the candidate events (`None`
+            if all the events are scanned) and the number of candidates it selects, the conditions
+            which are checked on the candidates, and whether the events are sorted by the index.
+        """
+        return self._plan(self._get_indexes()).to_dict(self)
+
+    def _get_indexes(self) -> EventIndexes | None:
+        # the changes of an ongoing transaction are only indexed once it is committed,
+        # so the indexes are not used inside a transaction
+        if self._db._transaction_depth:
+            return None
+        return self._db._get_indexes()
+
+    def _plan(self, indexes: EventIndexes | None) -> Plan:
+        plans = []
+        if indexes is not None:
+            plans = [
+                Plan(condition.field, indexes.estimate(condition), condition=condition)
+                for condition in self._conditions
+                if indexes.can_use(condition)
+            ]
+        for uuid_or_name in self._catalogues:
+            catalogue = self._db.get_catalogue(uuid_or_name)
+            plans.append(Plan("catalogue", len(cast(Map, catalogue._map["events"])), catalogue=uuid_or_name))
+        default = Plan(None, len(self._db._event_maps) if indexes is None else len(indexes))
+        plan = min(plans, key=lambda plan: plan.estimate, default=default)
+        if indexes is not None and plan.index in (None, "start") and self._order in INDEX_ORDERS:
+            plan = replace(plan, ordered=True)
+        return plan
+
+    def _run(self) -> tuple[list[str], int]:
+        """
+        Returns:
+            The UUIDs of the selected events, and the number of events the conditions were checked on.
+        """
+        indexes = self._get_indexes()
+        with self._db.transaction():
+            plan = self._plan(indexes)
+            if plan.condition is not None:
+                assert indexes is not None
+                candidates = indexes.select(plan.condition)
+            elif plan.catalogue is not None:
+                catalogue = self._db.get_catalogue(plan.catalogue)
+                candidates = [uuid for uuid in cast(Map, catalogue._map["events"]).keys() if uuid in self._db._event_maps]
+            elif indexes is not None:
+                candidates = indexes.uuids()
+            else:
+                candidates = list(self._db._event_maps.keys())
+            conditions = [condition for condition in self._conditions if condition is not plan.condition]
+            catalogue_events = [
+                cast(Map, self._db.get_catalogue(uuid_or_name)._map["events"])
+                for uuid_or_name in self._catalogues
+                if uuid_or_name != plan.catalogue
+            ]
+            fields = tuple({"uuid"} | {condition.field for condition in conditions} | {name for name, _ in self._order})
+
+            if plan.ordered:
+                if self._order[0][1]:
+                    candidates.reverse()
+                # the candidates are already sorted: stop as soon as enough events are selected
+                needed = None if self._limit is None else self._offset + self._limit
+                selected: list[str] = []
+                examined = 0
+                uuids = iter(candidates)
+                while needed is None or len(selected) < needed:
+                    batch = list(islice(uuids, BATCH_SIZE))
+                    if not batch:
+                        break
+                    examined += len(batch)
+                    selected += self._filter(batch, fields, conditions, catalogue_events)
+                result = selected[self._offset:needed]
+            else:
+                examined = len(candidates)
+                values = self._filter_values(candidates, fields, conditions, catalogue_events)
+                for name, descending in reversed(self._order):
+                    values.sort(key=lambda value: _sort_key(value[name]), reverse=descending)
+                    # the missing values (e.g. no rating) are sorted last, also in a descending order
+                    values.sort(key=lambda value: value[name] is None)
+                end = None if self._limit is None else self._offset + self._limit
+                result = [str(value["uuid"]) for value in values[self._offset:end]]
+        return result, examined
+
+    def _filter(
+        self, uuids: list[str], fields: tuple[str, ...], conditions: list[Condition], catalogue_events: list[Map]
+    ) -> list[str]:
+        return [str(value["uuid"]) for value in self._filter_values(uuids, fields, conditions, catalogue_events)]
+
+    def _filter_values(
+        self, uuids: list[str], fields: tuple[str, ...], conditions: list[Condition], catalogue_events: list[Map]
+    ) -> list[dict[str, Any]]:
+        if catalogue_events:
+            uuids = [uuid for uuid in uuids if all(uuid in events for events in catalogue_events)]
+        if not conditions and not self._order:
+            return [{"uuid": uuid} for uuid in uuids]
+        event_maps = self._db._event_maps
+        values = read_fields(self._db, [event_maps[uuid] for uuid in uuids], fields)
+        return [value for value in values if all(condition.matches(value) for condition in conditions)]
+
+
+def _sort_key(value: Any) -> tuple[bool, Any]:
+    # the missing values are grouped, and the dates are compared in UTC
+    if isinstance(value, datetime):
+        value = to_utc(value)
+    elif isinstance(value, UUID):
+        value = str(value)
+    return value is None, value
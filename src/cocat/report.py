@@ -0,0 +1,333 @@
+from __future__ import annotations
+
+from bisect import bisect_right
+from collections import defaultdict
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from typing import Any
+
+# the content types of the items, in the Yjs update format (v1)
+GC = 0
+DELETED = 1
+JSON = 2
+BINARY = 3
+STRING = 4
+EMBED = 5
+FORMAT = 6
+TYPE = 7
+ANY = 8
+DOC = 9
+SKIP = 10
+
+# the shared types whose name is encoded with their type reference
+XML_ELEMENT = 3
+XML_HOOK = 5
+
+# the ID of an item: its client and its clock
+ID = tuple[int, int]
+# the parent of an item: the name of a root type, or the ID of the item holding the type
+Parent = str | ID
+
+
+@dataclass(eq=False)
+class Entry:
+    """
+    A live entry of a map.
+    """
+    id: ID
+    content_type: int
+    bytes: int
+
+
+@dataclass(eq=False)
+class UpdateSummary:
+    """
+    What an update is made of, without applying it to a document.
+    """
+    structs: int = 0
+    items: int = 0
+    gc_items: int = 0
+    deleted_items: int = 0
+    deleted_ranges: int = 0
+    root_keys: dict[str, set[str]] = field(default_factory=lambda: defaultdict(set))
+    entries: dict[Parent, dict[str, Entry]] = field(default_factory=lambda: defaultdict(dict))
+
+
+@dataclass(eq=False)
+class Item:
+    """
+    An item of an update, as much as it is needed to find the live entries of the maps.
+    """
+    clock: int
+    length: int
+    parent: Parent | None
+    key: str | None
+    # the neighbour from which the parent and the key are taken, if they are not encoded
+    origin: ID | None
+    content_type: int
+    bytes: int
+
+
+class UpdateReader:
+    """
+    Reads an update (or a state vector) in a single pass, without building the structures it describes.
+    """
+    def __init__(self, update: bytes) -> None:
+        """
+        Args:
+            update: The update (or the state vector) to read.
+        """
+        self._data = memoryview(update)
+        self._pos = 0
+
+    def read_state(self) -> dict[int, int]:
+        """
+        Returns:
+            The clock of each client of the state vector.
+        """
+        state = {}
+        for _ in range(self._read_uint()):
+            client = self._read_uint()
+            state[client] = self._read_uint()
+        return state
+
+    def read(self) -> UpdateSummary:
+        """
+        Returns:
+            The summary of the update: its number of structs and items, the number of items
+            which are garbage-collected or deleted, the keys ever set in the root maps,
+            and the live entries of the maps.
+        """
+        summary = UpdateSummary()
+        items: dict[int, list[Item]] = {}
+        for _ in range(self._read_uint()):
+            struct_nb = self._read_uint()
+            client = self._read_uint()
+            clock = self._read_uint()
+            summary.structs += struct_nb
+            client_items = items.setdefault(client, [])
+            for _ in range(struct_nb):
+                item = self._read_struct(summary, clock)
+                client_items.append(item)
+                clock += item.length
+        deleted: dict[int, list[tuple[int, int]]] = {}
+        for _ in range(self._read_uint()):
+            client = self._read_uint()
+            range_nb = self._read_uint()
+            summary.deleted_ranges += range_nb
+            ranges = deleted.setdefault(client, [])
+            for _ in range(range_nb):
+                clock = self._read_uint()
+                length = self._read_uint()
+                ranges.append((clock, length))
+                summary.deleted_items += length
+        add_entries(summary, items, deleted)
+        return summary
+
+    def _read_struct(self, summary: UpdateSummary, clock: int) -> Item:
+        info = self._read_byte()
+        content_type = info & 0x1F
+        if content_type in (GC, SKIP):
+            length = self._read_uint()
+            summary.items += length
+            if content_type == GC:
+                summary.gc_items += length
+            return Item(clock, length, None, None, None, content_type, 0)
+
+        has_origin = info & 0x80
+        has_right_origin = info & 0x40
+        origin = self._read_id() if has_origin else None
+        right_origin = self._read_id() if has_right_origin else None
+        parent: Parent | None = None
+        key = None
+        if origin is None and right_origin is None:
+            # the parent is only encoded when it can't be taken from the neighbours
+            if self._read_uint() == 1:
+                parent = self._read_string()
+            else:
+                parent = self._read_id()
+            if info & 0x20:
+                key = self._read_string()
+                if isinstance(parent, str):
+                    summary.root_keys[parent].add(key)
+        start = self._pos
+        length = self._read_content(content_type)
+        summary.items += length
+        return Item(clock, length, parent, key, right_origin if origin is None else origin, content_type, self._pos - start)
+
+    def _read_content(self, content_type: int) -> int:
+        if content_type == DELETED:
+            return self._read_uint()
+        if content_type == JSON:
+            length = self._read_uint()
+            for _ in range(length):
+                self._read_string()
+            return length
+        if content_type in (BINARY, EMBED):
+            self._read_bytes()
+            return 1
+        if content_type == STRING:
+            # the length of a string item is its number of UTF-16 code units
+            return len(self._read_string().encode("utf-16-le")) // 2
+        if content_type == FORMAT:
+            self._read_string()
+            self._read_string()
+            return 1
+        if content_type == TYPE:
+            if self._read_uint() in (XML_ELEMENT, XML_HOOK):
+                self._read_string()
+            return 1
+        if content_type == ANY:
+            length = self._read_uint()
+            for _ in range(length):
+                self._skip_any()
+            return length
+        if content_type == DOC:
+            self._read_string()
+            self._skip_any()
+            return 1
+        raise ValueError(f"Unknown content type: {content_type}")
+
+    def _skip_any(self) -> None:
+        any_type = self._read_byte()
+        if any_type == 125:  # integer
+            while self._read_byte() & 0x80:
+                pass
+        elif any_type == 124:  # float32
+            self._pos += 4
+        elif any_type in (123, 122):  # float64, bigint
+            self._pos += 8
+        elif any_type == 119:  # string
+            self._read_bytes()
+        elif any_type == 118:  # object
+            for _ in range(self._read_uint()):
+                self._read_bytes()
+                self._skip_any()
+        elif any_type == 117:  # array
+            for _ in range(self._read_uint()):
+                self._skip_any()
+        elif any_type == 116:  # binary
+            self._read_bytes()
+        elif any_type not in (127, 126, 121, 120):  # undefined, null, false, true
+            raise ValueError(f"Unknown value type: {any_type}")
+
+    def _read_byte(self) -> int:
+        try:
+            byte = self._data[self._pos]
+        except IndexError:
+            raise ValueError("Unexpected end of update") from None
+        self._pos += 1
+        return byte
+
+    def _read_uint(self) -> int:
+        value = 0
+        shift = 0
+        while True:
+            byte = self._read_byte()
+            value |= (byte & 0x7F) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def _read_id(self) -> ID:
+        return self._read_uint(), self._read_uint()
+
+    def _read_bytes(self) -> memoryview:
+        length = self._read_uint()
+        start = self._pos
+        self._pos += length
+        if self._pos > len(self._data):
+            raise ValueError("Unexpected end of update")
+        return self._data[start:self._pos]
+
+    def _read_string(self) -> str:
+        return bytes(self._read_bytes()).decode()
+
+
+def read_update(update: bytes) -> UpdateSummary:
+    """
+    Args:
+        update: The update to read.
+
+    Returns:
+        The summary of the update.
+    """
+    return UpdateReader(update).read()
+
+
+def read_state(state: bytes) -> dict[int, int]:
+    """
+    Args:
+        state: The state vector to read.
+
+    Returns:
+        The clock of each client of the state vector.
+    """
+    return UpdateReader(state).read_state()
+
+
+def add_entries(summary: UpdateSummary, items: dict[int, list[Item]], deleted: dict[int, list[tuple[int, int]]]) -> None:
+    """
+    Adds the live entries of the maps to the summary of an update.
+
+    Args:
+        summary: The summary of the update.
+        items: The items of each client, sorted by clock.
+        deleted: The deleted ranges of each client, sorted by clock.
+    """
+    clocks = {client: [item.clock for item in client_items] for client, client_items in items.items()}
+
+    def find(id: ID) -> Item | None:
+        client, clock = id
+        if client not in items:
+            return None
+        index = bisect_right(clocks[client], clock) - 1
+        if index < 0:
+            return None
+        item = items[client][index]
+        return item if clock < item.clock + item.length else None
+
+    def resolve(item: Item) -> None:
+        # the items whose parent is taken from their neighbours, up to one whose parent is known
+        chain = []
+        while item.parent is None and item.origin is not None:
+            chain.append(item)
+            origin = find(item.origin)
+            # an item can't be its own origin, but the update could be corrupted
+            item.origin = None
+            if origin is None:
+                return
+            item = origin
+        for neighbour in chain:
+            neighbour.parent = item.parent
+            neighbour.key = item.key
+
+    for client, client_items in items.items():
+        ranges = deleted.get(client, [])
+        starts = [start for start, _ in ranges]
+        for item in client_items:
+            resolve(item)
+            if item.parent is None or item.key is None or item.content_type in (DELETED, GC, SKIP):
+                continue
+            index = bisect_right(starts, item.clock) - 1
+            if index >= 0 and item.clock < starts[index] + ranges[index][1]:
+                continue
+            summary.entries[item.parent][item.key] = Entry((client, item.clock), item.content_type, item.bytes)
+
+
+def attribute_sizes(summary: UpdateSummary) -> Iterator[dict[str, Any]]:
+    """
+    Args:
+        summary: The summary of the update of a database.
+
+    Yields:
+        The kind (`"event"` or `"catalogue"`), the UUID, the name and the encoded size (in bytes)
+            of each attribute value of the live events and catalogues.
+    """
+    for kind, root in (("event", "events"), ("catalogue", "catalogues")):
+        for uuid, entry in summary.entries.get(root, {}).items():
+            attributes = summary.entries.get(entry.id, {}).get("attributes")
+            if attributes is None:
+                continue
+            for name, value in summary.entries.get(attributes.id, {}).items():
+                yield {"kind": kind, "uuid": uuid, "name": name, "bytes": value.bytes}
@@ -0,0 +1,64 @@
+from __future__ import annotations
+
+# same format as the files written by the "file" wire
+FILE_VERSION = "0.0.1"
+HEADER = FILE_VERSION.encode() + bytes([0])
+
+
+class TruncatedUpdatesError(RuntimeError):
+    """
+    The last update of a file is truncated, for instance because its write was interrupted.
+    """
+    def __init__(self, updates: list[bytes]) -> None:
+        """
+        Args:
+            updates: The updates before the truncated one.
+        """
+        super().__init__("The last update of the file is truncated")
+        self.updates = updates
+
+
+def decode_updates(data: bytes) -> list[bytes] | None:
+    """
+    Decodes the content of an update file.
+
+    Args:
+        data: The content of the file.
+
+    Returns:
+        The updates in the file, or `None` if the file has no header (e.g. it is empty).
+
+    Raises:
+        RuntimeError: The file version is not supported.
+        TruncatedUpdatesError: The last update of the file is truncated.
+    """
+    version, separator, messages = data.partition(bytes([0]))
+    if not separator:
+        return None
+    if version.decode() != FILE_VERSION:
+        raise RuntimeError(f'File version mismatch (got "{version.decode()}", expected "{FILE_VERSION}")')
+    updates: list[bytes] = []
+    position = 0
+    while position < len(messages):
+        length, start = _read_uint(messages, position)
+        position = start + length
+        if position > len(messages):
+            raise TruncatedUpdatesError(updates)
+        if length:
+            updates.append(messages[start:position])
+    return updates
+
+
+def _read_uint(data: bytes, position: int) -> tuple[int, int]:
+    # returns the integer and the position following it, which is past the end of the data
+    # if the integer is truncated
+    value = 0
+    shift = 0
+    while position < len(data):
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+    return value, position + 1
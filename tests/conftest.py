@@ -22,6 +22,15 @@ def db_path(tmp_path):
 
 @pytest.fixture()
 def user(db_path: str):
+    yield create_user(db_path)
+
+
+@pytest.fixture()
+def superuser(db_path: str):
+    yield create_user(db_path, "--is_superuser")
+
+
+def create_user(db_path: str, *options: str) -> tuple[str, str]:
     email = f"user_{uuid4().hex}@foo.com"
     password = f"pwd_{uuid4().hex}"
     command = [
@@ -30,9 +39,10 @@ def user(db_path: str):
         "--email", email,
         "--password", password,
         "--db_path", db_path,
+        *options,
     ]
     subprocess.check_call(command)
-    yield email, password
+    return email, password
 
 @pytest.fixture()
 def server(free_tcp_port: int, update_dir: str, db_path: str):
@@ -1,8 +1,11 @@
+import httpx
 import pytest
 
 from httpx_ws import WebSocketUpgradeError
+from wiredb import connect
 
 from cocat import (
+    DB,
     create_catalogue,
     create_event,
     load_catalogue,
@@ -13,6 +16,9 @@ from cocat import (
     save_event,
     set_config,
 )
+from cocat.api import SESSION, Session, load_updates, save_updates
+from cocat.updates import HEADER, TruncatedUpdatesError, decode_updates
+from pycrdt import Doc
 
 
 pytestmark = pytest.mark.anyio
@@ -85,3 +91,214 @@ async def test_login(tmp_path, server, anyio_backend):
 
     with pytest.RaisesGroup(WebSocketUpgradeError):
         await load_catalogue("cat0")
+
+
+async def test_local_cache(tmp_path, server, user, anyio_backend):
+    if anyio_backend == "trio":
+        pytest.skip("Doesn't work on Trio")
+
+    host, port = server
+    file_path = tmp_path / "updates.y"
+    set_config(
+        host=f"http://{host}",
+        port=port,
+        file_path=file_path,
+        room_id="room2",
+    )
+    log_in(*user)
+
+    catalogue0 = create_catalogue(name="cat0", author="Paul")
+    await save_catalogue(catalogue0)
+
+    db = DB()
+    async with connect("file", doc=db.doc, path=file_path):
+        pass
+    assert db.catalogues == {catalogue0}
+
+    size = file_path.stat().st_size
+    assert catalogue0 == await load_catalogue("cat0")
+    # nothing new was received from the server
+    assert file_path.stat().st_size == size
+
+    catalogue1 = create_catalogue(name="cat1", author="Mike")
+    await save_catalogue(catalogue1)
+    assert file_path.stat().st_size > size
+
+    db = DB()
+    async with connect("file", doc=db.doc, path=file_path):
+        pass
+    assert db.catalogues == {catalogue0, catalogue1}
+    log_out()
+
+
+async def test_snapshot(tmp_path, server, user, anyio_backend):
+    if anyio_backend == "trio":
+        pytest.skip("Doesn't work on Trio")
+
+    host, port = server
+    set_config(
+        host=f"http://{host}",
+        port=port,
+        file_path=tmp_path / "updates.y",
+        room_id="room3",
+    )
+    log_in(*user)
+    catalogue0 = create_catalogue(name="cat0", author="Paul")
+    await save_catalogue(catalogue0)
+
+    url = f"http://{host}:{port}/room/room3/snapshot"
+    assert httpx.get(url).status_code == 401
+
+    cookies = {"fastapiusersauth": SESSION.cookies["fastapiusersauth"]}
+    async with httpx.AsyncClient(cookies=cookies) as client:
+        response = await client.get(url)
+        assert response.status_code == 200
+        etag = response.headers["etag"]
+        db = DB()
+        db.doc.apply_update(response.content)
+        assert db.catalogues == {catalogue0}
+
+        response = await client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 304
+        assert response.content == b""
+
+        catalogue1 = create_catalogue(name="cat1", author="Mike")
+        await save_catalogue(catalogue1)
+        response = await client.get(url, headers={"If-None-Match": etag})
+        assert response.status_code == 200
+        assert response.headers["etag"] != etag
+
+    # a client with no local cache starts from the snapshot
+    set_config(file_path=tmp_path / "updates2.y")
+    assert catalogue1 == await load_catalogue("cat1")
+    log_out()
+
+
+async def test_compact_history(tmp_path, server, user, superuser, anyio_backend):
+    if anyio_backend == "trio":
+        pytest.skip("Doesn't work on Trio")
+
+    host, port = server
+    file_path = tmp_path / "updates.y"
+    set_config(host=f"http://{host}", port=port, file_path=file_path, room_id="room4")
+    url = f"http://{host}:{port}/room/room4"
+    log_in(*user)
+    event0 = create_event(start="2025-01-31", stop="2026-01-31", author="John")
+    for i in range(10):
+        event0.author = f"Paul{i}"
+        await save_event(event0)
+    catalogue0 = create_catalogue(name="cat0", author="Paul", events=event0)
+    await save_catalogue(catalogue0)
+    cookies = {"fastapiusersauth": SESSION.cookies["fastapiusersauth"]}
+    assert httpx.get(f"{url}/epoch", cookies=cookies).json() == {"epoch": None}
+    assert httpx.post(f"{url}/compact", cookies=cookies).status_code == 403
+
+    log_in(*superuser)
+    cookies = {"fastapiusersauth": SESSION.cookies["fastapiusersauth"]}
+    response = httpx.post(f"{url}/compact", cookies=cookies)
+    assert response.status_code == 200
+    epoch = response.json()["epoch"]
+    assert httpx.get(f"{url}/epoch", cookies=cookies).json() == {"epoch": epoch}
+
+    # another client changes an event in the new epoch
+    other = Session(host=f"http://{host}", port=port, file_path=str(tmp_path / "other.y"), room_id="room4")
+    other.cookies = SESSION.cookies
+    other_event = await other.get_remote_event(str(event0.uuid))
+    other_event.rating = 5
+    await other.save(other_event)
+
+    # only the changes made to the items of the previous epoch are saved in the new one
+    event0.tags = {"storm"}
+    await save_event(event0)
+    assert event0.db.epoch == epoch
+    assert event0.rating == 5
+    # an item created since the compaction is also saved in the new epoch
+    event1 = create_event(start="2025-01-31", stop="2026-01-31", author="Paul")
+    await save_event(event1)
+    assert event1.db.epoch == epoch
+    # the events which are not saved yet stay in a catalogue of the previous epoch
+    event2 = create_event(start="2025-01-31", stop="2026-01-31", author="Mike")
+    catalogue0.add_events([event1, event2])
+    await save_catalogue(catalogue0)
+    assert catalogue0.db.epoch == epoch
+    await save_event(event2)
+
+    # the local cache of the previous epoch is dropped
+    loaded = await load_event(str(event0.uuid))
+    assert (loaded.author, loaded.rating, loaded.tags) == ("Paul9", 5, {"storm"})
+    assert loaded.db.epoch == epoch
+    assert {event.uuid for event in (await load_catalogue("cat0")).events} == {event0.uuid, event1.uuid, event2.uuid}
+
+    set_config(file_path=tmp_path / "updates2.y")
+    assert (await load_event(str(event0.uuid))).tags == {"storm"}
+    log_out()
+
+
+async def test_epoch_error(tmp_path, server, user, anyio_backend, monkeypatch):
+    if anyio_backend == "trio":
+        pytest.skip("Doesn't work on Trio")
+
+    host, port = server
+    file_path = tmp_path / "updates.y"
+    set_config(host=f"http://{host}", port=port, file_path=file_path, room_id="room5")
+    log_in(*user)
+    catalogue0 = create_catalogue(name="cat0", author="Paul")
+    await save_catalogue(catalogue0)
+
+    async def get_epoch(self):
+        request = httpx.Request("GET", f"http://{host}:{port}/room/room5/epoch")
+        raise httpx.HTTPStatusError("Server error", request=request, response=httpx.Response(500, request=request))
+
+    # the local cache is not loaded, it is rewritten from the room
+    monkeypatch.setattr(Session, "get_epoch", get_epoch)
+    assert catalogue0 == await load_catalogue("cat0")
+    updates = decode_updates(file_path.read_bytes())
+    assert updates is not None
+    assert len(updates) == 1
+    monkeypatch.undo()
+    assert catalogue0 == await load_catalogue("cat0")
+    log_out()
+
+
+async def test_load_updates(tmp_path):
+    file_path = tmp_path / "updates.y"
+    doc: Doc = Doc()
+    assert await load_updates(str(file_path), doc) is None
+
+    # an empty or truncated file is not a cache
+    for data in (b"", b"0.0"):
+        file_path.write_bytes(data)
+        assert await load_updates(str(file_path), doc) is None
+        assert not file_path.exists()
+
+    db = DB()
+    db.create_catalogue(name="cat0", author="Paul")
+    await save_updates(str(file_path), db.doc, None)
+    assert await load_updates(str(file_path), doc) == db.doc.get_state()
+    assert DB(doc).catalogues == db.catalogues
+
+    # the updates before an interrupted append are kept, and the file is rewritten
+    state = db.doc.get_state()
+    db.create_catalogue(name="cat1", author="Paul")
+    await save_updates(str(file_path), db.doc, state)
+    data = file_path.read_bytes()
+    file_path.write_bytes(data[:-1])
+    doc = Doc()
+    assert await load_updates(str(file_path), doc) == state
+    assert [catalogue.name for catalogue in DB(doc).catalogues] == ["cat0"]
+    updates = decode_updates(file_path.read_bytes())
+    assert updates is not None
+    assert len(updates) == 1
+    await save_updates(str(file_path), db.doc, state)
+    doc = Doc()
+    assert await load_updates(str(file_path), doc) == db.doc.get_state()
+    assert DB(doc).catalogues == db.catalogues
+    assert not (tmp_path / "updates.y.tmp").exists()
+    # also if the length of the update is truncated
+    with pytest.raises(TruncatedUpdatesError) as excinfo:
+        decode_updates(HEADER + bytes([0x80]))
+    assert excinfo.value.updates == []
+
+    file_path.write_bytes(b"0.0.0\x00")
+    with pytest.raises(RuntimeError, match="File version mismatch"):
+        await load_updates(str(file_path), Doc())
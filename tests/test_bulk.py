@@ -0,0 +1,133 @@
+import json
+
+import httpx
+import pytest
+
+from cocat import DB
+from cocat.app.bulk import BulkCreator, ItemParser, iter_items
+
+
+pytestmark = pytest.mark.anyio
+
+async def chunks(data: bytes, size: int):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+async def chunks_of(items):
+    for item in items:
+        yield item
+
+
+@pytest.mark.parametrize("size", [1, 7, 1000])
+@pytest.mark.parametrize("array", [False, True])
+async def test_iter_items(size, array):
+    items = [{"name": f"cat{i}", "author": "Paul", "attributes": {"é": [1, 2]}} for i in range(5)]
+    if array:
+        data = json.dumps(items, indent=2).encode()
+    else:
+        data = "\n".join(json.dumps(item) for item in items).encode()
+    assert [item async for item in iter_items(chunks(data, size))] == items
+
+
+async def test_iter_numbers():
+    # a number is only parsed once it cannot continue in the next chunk
+    assert [item async for item in iter_items(chunks(b"1\n23\n456", 1))] == [1, 23, 456]
+
+
+@pytest.mark.parametrize("data,error", [
+    (b'[{"a": 1} {"b": 2}]', "Expected ','"),
+    (b'[{"a": 1}', "Unterminated JSON array"),
+    (b'[{"a": 1}] {}', "Unexpected data after the JSON array"),
+    (b'{"a": 1}\n{"b": ', "Invalid JSON"),
+])
+def test_item_parser_errors(data, error):
+    parser = ItemParser()
+    with pytest.raises(ValueError, match=error):
+        parser.feed(data, final=True)
+
+
+async def test_bulk_creator():
+    db = DB()
+    items = [
+        {"start": "2025-01-01", "stop": "2025-01-02", "author": "Paul", "uuid": f"00000000-0000-0000-0000-00000000000{i}"}
+        for i in range(5)
+    ]
+    items.append({"name": "cat", "author": "John", "events": [item["uuid"] for item in items[:3]]})
+    items.append({"start": "foo", "stop": "2025-01-02", "author": "Paul"})
+    creator = BulkCreator(db)
+    with pytest.raises(ValueError, match="Item 6: 1 validation error for EventModel"):
+        await creator.create(chunks_of(items), chunk_size=3)
+
+    # the chunks before the invalid item have been applied
+    assert creator.events == [item["uuid"] for item in items[:5]]
+    assert len(creator.catalogues) == 1
+    catalogue = db.get_catalogue("cat")
+    assert catalogue.events == {db.get_event(uuid) for uuid in creator.events[:3]}
+    assert len(db.events) == 5
+
+    creator = BulkCreator(db)
+    with pytest.raises(ValueError, match="Item 0: no event found with UUID: foo"):
+        await creator.create(chunks_of([{"name": "cat2", "author": "John", "events": ["foo"]}]))
+    uuid = "00000000-0000-0000-0000-000000000009"
+    creator = BulkCreator(db)
+    with pytest.raises(ValueError, match=f"Item 0: no event found with UUID: {uuid}"):
+        await creator.create(chunks_of([{"name": "cat2", "author": "John", "events": [uuid]}]))
+    assert len(db.catalogues) == 1
+
+
+@pytest.mark.parametrize("items,error", [
+    ([1], "Item 0: not a JSON object"),
+    ([{"name": "cat", "author": "John", "uuid": "00000000-0000-0000-0000-000000000000"}], "Item 0: a catalogue already exists"),
+    ([{"start": "2025-01-01", "stop": "2025-01-02", "author": "Paul", "uuid": "00000000-0000-0000-0000-000000000000"}], "Item 0: an event already exists"),
+    ([{"start": "2025-01-01", "stop": "2025-01-02", "author": "Paul", "uuid": "00000000-0000-0000-0000-000000000001"}] * 2, "Item 1: an event already exists"),
+    ([{"name": "cat2", "author": "John", "uuid": "00000000-0000-0000-0000-000000000001"}] * 2, "Item 1: a catalogue already exists"),
+])
+async def test_bulk_creator_errors(items, error):
+    db = DB()
+    uuid = "00000000-0000-0000-0000-000000000000"
+    db.create_event(start="2025-01-01", stop="2025-01-02", author="Paul", uuid=uuid)
+    db.create_catalogue(name="cat", author="John", uuid=uuid)
+    with pytest.raises(ValueError, match=error):
+        await BulkCreator(db).create(chunks_of(items))
+    assert len(db.events) == len(db.catalogues) == 1
+
+
+async def test_bulk_creator_event_uuids():
+    db = DB()
+    uuid = "0000000000000000000000000000000A"
+    items = [
+        {"start": "2025-01-01", "stop": "2025-01-02", "author": "Paul", "uuid": uuid},
+        {"name": "cat", "author": "John", "events": [uuid]},
+    ]
+    await BulkCreator(db).create(chunks_of(items))
+    # the UUIDs of the catalogue events are stored like the UUIDs of the events
+    assert db.get_catalogue("cat").events == {db.get_event("00000000-0000-0000-0000-00000000000a")}
+
+
+def test_bulk_endpoint(server, user):
+    host, port = server
+    url = f"http://{host}:{port}"
+    data = {"username": user[0], "password": user[1]}
+    cookie = httpx.post(f"{url}/auth/jwt/login", data=data).cookies["fastapiusersauth"]
+    cookies = {"fastapiusersauth": cookie}
+    events = [{"start": f"2025-01-{i + 1:02}", "stop": f"2025-01-{i + 2:02}", "author": "Paul"} for i in range(10)]
+    content = "\n".join(json.dumps(event) for event in events)
+
+    response = httpx.post(f"{url}/room/room0/events:bulk", content=content)
+    assert response.status_code == 401
+
+    response = httpx.post(f"{url}/room/room0/events:bulk", content=content, cookies=cookies, params={"chunk_size": 3})
+    assert response.status_code == 200
+    uuids = response.json()["events"]
+    assert len(uuids) == 10
+
+    catalogue = {"name": "cat", "author": "John", "events": uuids[:2]}
+    response = httpx.post(f"{url}/room/room0/events:bulk", json=[catalogue, {"start": "foo"}], cookies=cookies)
+    assert response.status_code == 422
+    assert response.json()["detail"]["error"].startswith("Item 1:")
+
+    response = httpx.get(f"{url}/room/room0/events", cookies=cookies)
+    assert [event["uuid"] for event in response.json()] == uuids
+    response = httpx.get(f"{url}/room/room0/catalogues/cat/events", cookies=cookies)
+    assert response.status_code == 404
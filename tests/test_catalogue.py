@@ -192,3 +192,24 @@ def test_dynamic_catalogue():
 
     catalogue2.set_dynamic_filter()
     assert not catalogue2.dynamic_events
+
+
+def test_set_events_delta():
+    db = DB()
+    events = [db.create_event(start="2025-01-31", stop="2026-01-31", author="John") for _ in range(1000)]
+    catalogue = db.create_catalogue(name="cat0", author="John", events=events)
+    updates = []
+    db.doc.observe(lambda event: updates.append(event.update))
+    added_events = []
+    removed_events = []
+    catalogue.on_add_events(lambda x: added_events.append(x))
+    catalogue.on_remove_events(lambda x: removed_events.append(x))
+
+    event = db.create_event(start="2025-01-31", stop="2026-01-31", author="John")
+    updates.clear()
+    catalogue.events = {*events[1:], event}
+    assert len(updates) == 1
+    assert len(updates[0]) < 100
+    assert added_events == [{event}]
+    assert removed_events == [{str(events[0].uuid)}]
+    assert catalogue.events == {*events[1:], event}
@@ -0,0 +1,122 @@
+import pytest
+from anyio import Event, create_task_group, wait_all_tasks_blocked
+from pycrdt import Decoder, Doc, Map, create_sync_message, create_update_message
+
+from cocat.app.channel import QueueMetrics, QueuedChannel
+
+
+pytestmark = pytest.mark.anyio
+
+
+class SlowChannel:
+    def __init__(self):
+        self.messages = []
+        self.unblocked = Event()
+
+    @property
+    def path(self):
+        return "room0"
+
+    async def send(self, message):
+        await self.unblocked.wait()
+        self.messages.append(message)
+
+    async def __anext__(self):
+        return b"message0"
+
+    async def recv(self):
+        return b"message1"
+
+
+class FailingChannel(SlowChannel):
+    async def send(self, message):
+        raise RuntimeError("Connection closed")
+
+
+def make_updates(n):
+    doc = Doc()
+    map = doc.get("map", type=Map)
+    updates = []
+    doc.observe(lambda event: updates.append(event.update))
+    for i in range(n):
+        map[str(i)] = i
+    return updates
+
+
+async def test_merge():
+    channel = SlowChannel()
+    closed = []
+    metrics = QueueMetrics()
+    queued_channel = QueuedChannel(channel, lambda: closed.append(True), max_size=3, metrics=metrics)
+    async with create_task_group() as tg:
+        tg.start_soon(queued_channel.run)
+        await wait_all_tasks_blocked()
+        sync_message = create_sync_message(Doc())
+        await queued_channel.send(sync_message)
+        for update in make_updates(10):
+            await queued_channel.send(create_update_message(update))
+        assert queued_channel.size <= 3
+        assert metrics.queued == queued_channel.size
+        assert metrics.overflows > 0
+        channel.unblocked.set()
+        await wait_all_tasks_blocked()
+        assert queued_channel.size == 0
+        tg.cancel_scope.cancel()
+
+    assert not closed
+    assert channel.messages[0] == sync_message
+    doc = Doc()
+    for message in channel.messages[1:]:
+        doc.apply_update(Decoder(message[2:]).read_message())
+    assert doc.get("map", type=Map).to_py() == {str(i): i for i in range(10)}
+
+
+async def test_disconnect():
+    channel = SlowChannel()
+    closed = Event()
+
+    async def close():
+        closed.set()
+
+    metrics = QueueMetrics()
+    queued_channel = QueuedChannel(channel, close, max_size=3, overflow="disconnect", metrics=metrics)
+    async with create_task_group() as tg:
+        tg.start_soon(queued_channel.run)
+        await wait_all_tasks_blocked()
+        updates = make_updates(10)
+        for update in updates[:3]:
+            await queued_channel.send(create_update_message(update))
+        with pytest.raises(RuntimeError, match="its send queue overflowed"):
+            await queued_channel.send(create_update_message(updates[3]))
+        with pytest.raises(RuntimeError, match="Client disconnected"):
+            await queued_channel.send(create_update_message(updates[4]))
+        channel.unblocked.set()
+        await closed.wait()
+
+    assert metrics.disconnections == 1
+    assert metrics.queues == set()
+
+
+async def test_receive():
+    queued_channel = QueuedChannel(SlowChannel(), lambda: None)
+    assert queued_channel.path == "room0"
+    assert await queued_channel.__anext__() == b"message0"
+    assert await queued_channel.recv() == b"message1"
+
+
+async def test_send_error(caplog):
+    metrics = QueueMetrics()
+    queued_channel = QueuedChannel(FailingChannel(), lambda: None, metrics=metrics)
+    async with create_task_group() as tg:
+        tg.start_soon(queued_channel.run)
+        await wait_all_tasks_blocked()
+        await queued_channel.send(b"message")
+        await wait_all_tasks_blocked()
+        # the run task is done
+        assert metrics.queues == set()
+        with pytest.raises(RuntimeError, match="Client disconnected"):
+            await queued_channel.send(b"message")
+
+    assert queued_channel.size == 0
+    assert "Could not send a message to a client of room room0" in caplog.text
+    assert "Connection closed" in caplog.text
@@ -0,0 +1,184 @@
+import httpx
+import pytest
+from anycorn import Config, serve
+from anyio import Event, create_task_group, fail_after, sleep, sleep_forever
+from fastapi import FastAPI, WebSocket
+from httpx_ws import WebSocketDisconnect
+from pycrdt import Doc, Map, handle_sync_message
+from wiredb import connect
+
+from cocat.compression import WS_STALE_CLIENT, ClientChannel, ClientWire, CompressedChannel, Compression, StaleClientError
+
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeChannel:
+    def __init__(self, messages):
+        self.path = "room0"
+        self.messages = messages
+        self.sent = []
+
+    async def __anext__(self):
+        return self.messages.pop(0)
+
+    async def send(self, message):
+        self.sent.append(message)
+
+    async def recv(self):
+        return self.messages.pop(0)
+
+
+def test_compression():
+    compression = Compression(threshold=100, level=9)
+    message = b"\x00\x01" + b"x" * 10
+    frame = compression.encode(message)
+    assert frame == b"\x00" + message
+    assert compression.decode(frame) == message
+
+    message = b"\x00\x01" + b"x" * 1000
+    frame = compression.encode(message)
+    assert frame[0] == 1
+    assert len(frame) < len(message)
+    assert compression.decode(frame) == message
+
+    with pytest.raises(RuntimeError, match="Unknown message encoding: 2"):
+        compression.decode(b"\x02")
+
+
+def test_decompression_limit():
+    compression = Compression(threshold=100, max_size=1000)
+    message = b"x" * 1000
+    frame = compression.encode(message)
+    assert compression.decode(frame) == message
+
+    # a message which would be too large once decompressed is rejected
+    frame = compression.encode(b"x" * 1001)
+    with pytest.raises(RuntimeError, match="Decompressed message larger than 1000 bytes"):
+        compression.decode(frame)
+    frame = Compression(threshold=100).encode(b"x" * 10_000_000)
+    with pytest.raises(RuntimeError, match="Decompressed message larger than 1000 bytes"):
+        compression.decode(frame)
+
+    frame = compression.encode(message)
+    with pytest.raises(RuntimeError, match="Truncated compressed message"):
+        compression.decode(frame[:-4])
+
+
+async def test_compressed_channel():
+    compression = Compression(threshold=100)
+    message0 = b"x" * 10
+    message1 = b"y" * 1000
+    channel = FakeChannel([compression.encode(message0), compression.encode(message1)])
+    compressed_channel = CompressedChannel(channel, compression)
+    assert compressed_channel.path == "room0"
+    assert await compressed_channel.__anext__() == message0
+    assert await compressed_channel.recv() == message1
+    await compressed_channel.send(message1)
+    assert channel.sent == [compression.encode(message1)]
+
+
+class FakeWebSocket:
+    def __init__(self, exception):
+        self.exception = exception
+
+    async def receive_bytes(self):
+        raise self.exception
+
+
+async def test_client_channel():
+    stale = []
+    channel = ClientChannel(FakeWebSocket(WebSocketDisconnect(WS_STALE_CLIENT, "stale")), "room0", lambda: stale.append(True))
+    assert channel.path == "room0"
+    with pytest.raises(StopAsyncIteration):
+        await channel.__anext__()
+    assert stale == [True]
+    assert channel.stale_reason == "stale"
+
+    # the other errors close the channel
+    for exception in (WebSocketDisconnect(1000), RuntimeError()):
+        channel = ClientChannel(FakeWebSocket(exception), "room0", lambda: stale.append(True))
+        with pytest.raises(StopAsyncIteration):
+            await channel.__anext__()
+        assert channel.stale_reason is None
+    assert stale == [True]
+
+
+def create_room_app(refused: Event) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/")
+    async def get_root():
+        return {}
+
+    @app.websocket("/{id}")
+    async def connect_room(id: str, websocket: WebSocket):
+        await websocket.accept()
+        message = await websocket.receive_bytes()
+        if id == "used":
+            # the document is accepted, then refused while the client uses it
+            reply = handle_sync_message(message[1:], Doc())
+            assert reply is not None
+            await websocket.send_bytes(reply)
+            await refused.wait()
+        await websocket.close(code=WS_STALE_CLIENT, reason=f"stale {id}")
+
+    return app
+
+
+async def test_stale_client(free_tcp_port, anyio_backend):
+    if anyio_backend == "trio":
+        pytest.skip("Doesn't work on Trio")
+
+    refused = Event()
+    shutdown = Event()
+    config = Config()
+    config.bind = [f"127.0.0.1:{free_tcp_port}"]
+    async with create_task_group() as tg, httpx.AsyncClient() as client:
+        tg.start_soon(lambda: serve(create_room_app(refused), config, shutdown_trigger=shutdown.wait, mode="asgi"))
+        with fail_after(10):
+            while True:
+                try:
+                    await client.get(f"http://127.0.0.1:{free_tcp_port}")
+                except httpx.TransportError:
+                    await sleep(0.1)
+                else:
+                    break
+
+        with pytest.raises(StaleClientError, match="stale new"):
+            async with ClientWire("new", Doc(), host="http://127.0.0.1", port=free_tcp_port):
+                pass  # pragma: nocover
+
+        used = []
+        with pytest.raises(StaleClientError, match="stale used"):
+            async with ClientWire("used", Doc(), host="http://127.0.0.1", port=free_tcp_port):
+                used.append(True)
+                refused.set()
+                await sleep_forever()
+        assert used == [True]
+        shutdown.set()
+
+
+async def test_compressed_sync(server, user, anyio_backend):
+    if anyio_backend == "trio":
+        pytest.skip("Doesn't work on Trio")
+
+    host, port = server
+    data = {"username": user[0], "password": user[1]}
+    cookie = httpx.post(f"http://{host}:{port}/auth/jwt/login", data=data).cookies["fastapiusersauth"]
+    cookies = httpx.Cookies({"fastapiusersauth": cookie})
+    doc0: Doc = Doc()
+    doc0.get("map", type=Map).update({str(i): "x" * 100 for i in range(1000)})
+    async with ClientWire("room/room0", doc0, host=f"http://{host}", port=port, cookies=cookies) as client:
+        assert isinstance(client.channel, CompressedChannel)
+
+    # a client not supporting compression can still connect
+    doc1: Doc = Doc()
+    async with connect("websocket", id="room/room0", doc=doc1, host=f"http://{host}", port=port, cookies=cookies):
+        pass
+    assert doc1.get("map", type=Map).to_py() == doc0.get("map", type=Map).to_py()
+
+    doc2: Doc = Doc()
+    async with ClientWire("room/room0", doc2, host=f"http://{host}", port=port, cookies=cookies):
+        pass
+    assert doc2.get("map", type=Map).to_py() == doc0.get("map", type=Map).to_py()
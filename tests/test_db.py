@@ -1,6 +1,11 @@
-from pycrdt import Doc
+from datetime import datetime
 
-from cocat import DB
+import pytest
+from pycrdt import Doc, Map
+from pydantic import ValidationError
+
+from cocat import DB, Tracer
+from cocat.db import rebase_map
 
 
 def test_create_catalogue():
@@ -115,3 +120,247 @@ def test_dump_load(tmp_path):
     path1 = tmp_path / "db1.json"
     path1.write_text(db1.to_json())
     assert path0.read_text() == path1.read_text()
+
+
+class RecordingTracer(Tracer):
+    def __init__(self):
+        self.operations = []
+
+    def start(self, name, attributes):
+        return (name, attributes)
+
+    def end(self, name, token):
+        self.operations.append(token)
+
+
+def test_stats():
+    db0 = DB()
+    with pytest.raises(RuntimeError):
+        db0.stats()
+
+    tracer = RecordingTracer()
+    db1 = DB(tracer=tracer)
+    db1.sync(db0)
+    changes = []
+
+    def on_change_rating(value):
+        changes.append(value)
+
+    event = db0.create_event(start="2025-01-31", stop="2026-01-31", author="John")
+    db1.get_event(str(event.uuid)).on_change_rating(on_change_rating)
+    event.rating = 3
+    assert changes == [3]
+    catalogue = db1.create_catalogue(name="cat0", author="John")
+    catalogue.set_dynamic_filter("event.rating > 2")
+    assert catalogue.dynamic_events == {db1.get_event(str(event.uuid))}
+    assert db1.get_event(str(event.uuid)).rating == 3
+
+    stats = db1.stats()
+    assert stats["transactions"] >= 3
+    assert stats["update_bytes"] > 0
+    assert stats["validations"] >= 2
+    assert stats["dynamic_filter_evaluations"] == 1
+    assert stats["timers"]["observer.events"]["calls"] >= 2
+    assert stats["timers"]["observer.catalogues"]["calls"] >= 1
+    assert stats["timers"]["dynamic_filter"]["calls"] == 1
+    callback_stats = stats["callbacks"][f"{__name__}.test_stats.<locals>.on_change_rating"]
+    assert callback_stats["calls"] == 1
+    assert callback_stats["seconds"] > 0
+    assert ("callback", {"callback": f"{__name__}.test_stats.<locals>.on_change_rating"}) in tracer.operations
+    assert ("dynamic_filter", {"catalogue": str(catalogue.uuid)}) in tracer.operations
+
+    # the instrumentation can be enabled after the database is created
+    db0.instrument()
+    event.rating = 4
+    assert db0.stats()["transactions"] == 1
+
+    # enabling the instrumentation again only replaces the tracer
+    tracer2 = RecordingTracer()
+    db1.instrument(tracer2)
+    created = []
+
+    def on_create_event(event):
+        created.append(event)
+
+    db1.on_create_event(on_create_event)
+    db0.create_event(start="2025-01-31", stop="2026-01-31", author="Paul")
+    assert len(created) == 1
+    assert db1.stats()["callbacks"][f"{__name__}.test_stats.<locals>.on_create_event"]["calls"] == 1
+    assert ("callback", {"callback": f"{__name__}.test_stats.<locals>.on_create_event"}) in tracer2.operations
+    assert ("callback", {"callback": f"{__name__}.test_stats.<locals>.on_create_event"}) not in tracer.operations
+
+    # reading and writing the fields of a catalogue are validated
+    validations = db1.stats()["validations"]
+    catalogue.name = "cat1"
+    assert catalogue.name == "cat1"
+    assert db1.stats()["validations"] == validations + 2
+
+
+def test_memory_report():
+    db = DB()
+    events = [
+        db.create_event(start="2025-01-31", stop="2026-01-31", author="John", attributes={"data": "x" * i})
+        for i in range(5)
+    ]
+    catalogue0 = db.create_catalogue(name="cat0", author="John", events=events[:3])
+    catalogue1 = db.create_catalogue(name="cat1", author="John", events=events[3:])
+    db.create_catalogue(name="cat2", author="John").delete()
+    events[0].delete()
+    events[4].delete()
+
+    report = db.memory_report(top=2)
+    assert report["state_bytes"] == len(db.doc.get_update())
+    assert report["events"] == {"live": 3, "deleted": 2}
+    assert report["catalogues"] == {"live": 2, "deleted": 1}
+    assert report["tombstones"]["deleted_items"] > 0
+    assert report["tombstones"]["items"] > report["tombstones"]["deleted_items"]
+    # the encoded content of a string value: its number of values, its type, its length and its bytes
+    assert report["largest_attributes"] == [
+        {"kind": "event", "uuid": str(events[3].uuid), "name": "data", "bytes": 6},
+        {"kind": "event", "uuid": str(events[2].uuid), "name": "data", "bytes": 5},
+    ]
+    assert report["catalogue_events"] == [
+        {"uuid": str(catalogue0.uuid), "name": "cat0", "events": 2},
+        {"uuid": str(catalogue1.uuid), "name": "cat1", "events": 1},
+    ]
+
+
+def test_compact():
+    db = DB()
+    events = [
+        db.create_event(start="2025-01-31", stop="2026-01-31", author="John", attributes={"i": i})
+        for i in range(5)
+    ]
+    catalogue = db.create_catalogue(name="cat0", author="John", events=events, attributes={"x": 0})
+    for i in range(20):
+        events[0].author = f"Paul{i}"
+        catalogue.attributes = {"x": i}
+    events[1].delete()
+    db.create_catalogue(name="cat1", author="John").delete()
+    assert db.epoch is None
+
+    compacted = db.compact()
+    assert compacted.epoch is not None
+    assert compacted.retired_clients == {db.doc.client_id}
+    assert compacted.doc.client_id not in compacted.retired_clients
+    assert normalize(compacted.to_dict()) == normalize(db.to_dict())
+    assert compacted.get_event(str(events[0].uuid)).author == "Paul19"
+    assert compacted.get_catalogue("cat0").attributes == {"x": 19}
+    report = compacted.memory_report()
+    assert report["tombstones"]["deleted_items"] == 0
+    assert report["events"] == {"live": 4, "deleted": 0}
+    assert report["catalogues"] == {"live": 1, "deleted": 0}
+    assert report["state_bytes"] < db.memory_report()["state_bytes"]
+
+    # the retired clients accumulate over the epochs
+    compacted2 = compacted.compact()
+    assert compacted2.epoch != compacted.epoch
+    assert compacted2.retired_clients == {db.doc.client_id, compacted.doc.client_id}
+
+
+def test_rebase_map():
+    map0 = Doc().get("map", type=Map)
+    map1 = Doc().get("map", type=Map)
+    base = {"a": 1, "b": {"x": 1, "y": 1}, "c": 0, "d": 0}
+    map0.update({"a": 2, "b": Map({"x": 1, "z": 1}), "c": 0, "e": Map({"w": 1})})
+    map1.update({"a": 1, "b": Map({"x": 2, "y": 1}), "c": 3, "d": 0, "f": 0})
+    rebase_map(map1, map0, base)
+    # only the changes since the base are given, the other changes to the map are kept
+    assert map1.to_py() == {"a": 2, "b": {"x": 2, "z": 1}, "c": 3, "e": {"w": 1}, "f": 0}
+
+
+def test_update_events():
+    db0 = DB(instrument=True)
+    db1 = DB()
+    db1.sync(db0)
+    events = [
+        db0.create_event(start="2025-01-31", stop="2026-01-31", author="John", tags=["a"], attributes={"x": 0})
+        for _ in range(5)
+    ]
+    changes = []
+    db1.on_change_events(lambda events: changes.append(events))
+    transactions = []
+    db0.doc.observe(lambda event: transactions.append(event))
+
+    validations = db0.stats()["validations"]
+    db0.update_events(events[:3], rating=3, stop="2027-01-31", products={"p0", "p1"})
+    assert len(transactions) == 1
+    # the values are validated once for all the events
+    assert db0.stats()["validations"] == validations + 3
+    events1 = {db1.get_event(str(event.uuid)) for event in events}
+    assert changes == [{db1.get_event(str(event.uuid)) for event in events[:3]}]
+    for event in events:
+        changed = event in events[:3]
+        assert event.rating == (3 if changed else None)
+        assert event.stop == datetime(2027 if changed else 2026, 1, 31)
+        assert event.products == ({"p0", "p1"} if changed else set())
+
+    changes.clear()
+    db0.add_tags(events, ["b", "c"])
+    db0.remove_tags(events, "a")
+    db0.add_products(events, "p2")
+    db0.remove_products(events, ["p0", "p3"])
+    validations = db0.stats()["validations"]
+    db0.set_attributes(events, y=1)
+    assert db0.stats()["validations"] == validations + 1
+    db0.remove_attributes(events, "x")
+    # the events which don't have the products to remove are not changed
+    changed1 = {db1.get_event(str(event.uuid)) for event in events[:3]}
+    assert changes == [events1, events1, events1, changed1, events1, events1]
+    for event in events:
+        assert event.tags == {"b", "c"}
+        assert event.products == ({"p1", "p2"} if event in events[:3] else {"p2"})
+        assert event.attributes == {"y": 1}
+
+    # setting the same values doesn't change anything
+    transactions.clear()
+    db0.update_events(events, author="John", attributes={"y": 1})
+    assert transactions == []
+
+    # a nested boolean is not the same as a nested number
+    db0.set_attributes(events, z={"n": [1]})
+    transactions.clear()
+    db0.set_attributes(events, z={"n": [1]})
+    assert transactions == []
+    db0.set_attributes(events, z={"n": [True]})
+    assert len(transactions) == 1
+    for event in events:
+        assert db1.get_event(str(event.uuid)).attributes["z"] == {"n": [True]}
+
+    with pytest.raises(ValidationError):
+        db0.update_events(events, rating="foo")
+    with pytest.raises(ValueError, match="The UUID of an event cannot be changed"):
+        db0.update_events(events, uuid="foo")
+    events[0].delete()
+    with pytest.raises(RuntimeError, match="Event has been deleted"):
+        db0.add_tags(events, "d")
+    assert "d" not in events[1].tags
+
+
+def test_read_events():
+    db = DB(instrument=True)
+    events = [
+        db.create_event(start=f"2025-01-{i + 1:02}", stop="2026-01-31", author=f"John{i}", rating=i)
+        for i in range(5)
+    ]
+    validations = db.stats()["validations"]
+    uuids = [events[3].uuid, str(events[1].uuid)]
+    assert db.read_events(uuids, ["author", "rating", "start"]) == [
+        {"author": "John3", "rating": 3, "start": datetime(2025, 1, 4)},
+        {"author": "John1", "rating": 1, "start": datetime(2025, 1, 2)},
+    ]
+    assert db.stats()["validations"] == validations + 1
+    assert sorted(db.read_events(fields=["uuid"]), key=lambda values: values["uuid"]) == sorted(
+        ({"uuid": event.uuid} for event in events), key=lambda values: values["uuid"]
+    )
+    assert len(db.read_events()[0]) == 8
+
+    with pytest.raises(RuntimeError, match="No event found with UUID: foo"):
+        db.read_events(["foo"])
+
+
+def normalize(data):
+    return {
+        key: sorted(({**item, "events": sorted(item.get("events", []))} for item in items), key=lambda item: item["uuid"])
+        for key, items in data.items()
+    }
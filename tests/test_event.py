@@ -148,3 +148,81 @@ def test_event():
     with pytest.raises(RuntimeError) as excinfo:
         event0.author = "Paul"
     assert str(excinfo.value) == "Event has been deleted"
+
+
+def test_set_delta():
+    db = DB()
+    event = db.create_event(
+        start="2025-01-31",
+        stop="2026-01-31",
+        author="John",
+        tags=[f"tag{i}" for i in range(1000)],
+        attributes={f"attr{i}": i for i in range(1000)},
+    )
+    updates = []
+    db.doc.observe(lambda event: updates.append(event.update))
+    added_tags = []
+    removed_tags = []
+    event.on_add_tags(lambda x: added_tags.append(x))
+    event.on_remove_tags(lambda x: removed_tags.append(x))
+
+    # only the changes are in the update
+    event.tags = {f"tag{i}" for i in range(1, 1001)}
+    assert len(updates[-1]) < 100
+    assert added_tags == [{"tag1000"}]
+    assert removed_tags == [{"tag0"}]
+    event.attributes = {**{f"attr{i}": i for i in range(1000)}, "attr0": True}
+    assert len(updates[-1]) < 100
+    assert event.attributes["attr0"] is True
+    assert db.memory_report()["tombstones"]["deleted_items"] == 2
+    # also in the nested values
+    event.attributes = {**event.attributes, "attr1": {"x": [1]}}
+    event.attributes = {**event.attributes, "attr1": {"x": [True]}}
+    assert event.attributes["attr1"]["x"][0] is True
+
+    # setting the same values doesn't change anything
+    updates.clear()
+    event.tags = event.tags
+    event.attributes = event.attributes
+    assert updates == []
+
+
+def test_get():
+    db = DB(instrument=True)
+    event = db.create_event(
+        start="2025-01-31",
+        stop="2026-01-31",
+        author="John",
+        tags=["a", "b"],
+        rating=3,
+        attributes={"x": "y"},
+    )
+    assert event.get("start", "rating", "tags") == {
+        "start": datetime(2025, 1, 31),
+        "rating": 3,
+        "tags": {"a", "b"},
+    }
+    assert event.get() == {
+        "uuid": event.uuid,
+        "start": event.start,
+        "stop": event.stop,
+        "author": event.author,
+        "tags": event.tags,
+        "products": event.products,
+        "rating": event.rating,
+        "attributes": event.attributes,
+    }
+    validations = db.stats()["validations"]
+    model = event.to_model()
+    assert db.stats()["validations"] == validations + 1
+    assert model.uuid == event.uuid
+    assert model.start == datetime(2025, 1, 31)
+    assert set(model.tags) == {"a", "b"}
+    assert model.rating == 3
+    assert model.attributes == {"x": "y"}
+
+    with pytest.raises(ValueError, match="Unknown event field: foo"):
+        event.get("foo")
+    event.delete()
+    with pytest.raises(RuntimeError, match="Event has been deleted"):
+        event.get("start")
@@ -0,0 +1,109 @@
+import os
+from pathlib import Path
+
+import httpx
+import pytest
+from anyio import create_task_group, current_time, wait_all_tasks_blocked
+from pycrdt import Map
+
+from cocat.loadgen import (
+    CATALOGUE_NAME,
+    PROBES,
+    LoadStats,
+    RoomObserver,
+    SimulatedClient,
+    get_address,
+    get_rss,
+    percentile,
+    run_load,
+    summarize,
+)
+
+pytestmark = pytest.mark.anyio
+
+
+def test_summarize():
+    values = [float(i) for i in range(1, 101)]
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([1.0], 90) == 1
+    assert summarize(values) == {"count": 100, "mean": 50.5, "p50": 50, "p90": 90, "p99": 99, "max": 100}
+    assert summarize([])["count"] == 0
+
+
+def test_get_address():
+    assert get_address(httpx.URL("http://127.0.0.1:8000/")) == ("http://127.0.0.1", 8000)
+    assert get_address(httpx.URL("http://example.com")) == ("http://example.com", 80)
+    assert get_address(httpx.URL("https://example.com")) == ("https://example.com", 443)
+
+
+def test_get_rss(monkeypatch):
+    assert get_rss(os.getpid()) > 0
+    # the PID is above the maximum PID
+    assert get_rss(2 ** 22 + 1) is None
+    monkeypatch.setattr(Path, "read_text", lambda self: "Name:\tkthreadd\n")
+    assert get_rss(os.getpid()) is None
+
+
+async def test_client_errors(free_tcp_port):
+    stats = LoadStats()
+    url = httpx.URL(f"http://127.0.0.1:{free_tcp_port}")
+    client = SimulatedClient("client0", url, "room0", httpx.Cookies(), stats, rate=10, weights=(1, 1, 1, 1))
+    # nothing listens on the port
+    await client.run(current_time() + 0.05)
+    assert stats.errors == 1
+    assert sum(stats.operations.values()) == 0
+
+
+async def test_get_catalogue():
+    stats = LoadStats()
+    url = httpx.URL("http://127.0.0.1")
+    client = SimulatedClient("client0", url, "room0", httpx.Cookies(), stats, rate=10, weights=(1, 1, 1, 1))
+    catalogues = []
+
+    async def get_catalogue():
+        catalogues.append(await client._get_catalogue())
+
+    async with create_task_group() as tg:
+        tg.start_soon(get_catalogue)
+        await wait_all_tasks_blocked()
+        # the catalogue is created by the observer, once the client is connected
+        catalogue = client._db.create_catalogue(name=CATALOGUE_NAME, author="observer")
+
+    assert catalogues == [catalogue]
+
+
+def test_observer():
+    stats = LoadStats()
+    observer = RoomObserver(httpx.URL("http://127.0.0.1"), "room0", httpx.Cookies(), stats)
+    probes = observer._db.doc.get(PROBES, type=Map)
+    # the probes are not recorded before the observer is started
+    probes["client0-1"] = 0.0
+    assert stats.latencies == []
+    observer._recording = True
+    probes["client0-2"] = 0.0
+    assert len(stats.latencies) == 1
+
+
+async def test_run_load(server, user, update_dir, anyio_backend):
+    if anyio_backend == "trio":
+        pytest.skip("Doesn't work on Trio")
+
+    host, port = server
+    report = await run_load(
+        f"http://{host}:{port}",
+        [user],
+        clients=4,
+        rooms=2,
+        duration=1,
+        rate=20,
+        weights=(1, 1, 1, 0.2),
+        # the memory of the test process is measured, the server runs in another process
+        server_pid=os.getpid(),
+        update_dir=update_dir,
+    )
+    assert report["errors"] == 0
+    assert sum(report["operations"].values()) > 0
+    assert report["sync_latency"]["count"] > 0
+    assert report["storage_size"]["growth"] > 0
+    assert 0 < report["server_rss"]["start"] <= report["server_rss"]["max"]
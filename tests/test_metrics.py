@@ -0,0 +1,160 @@
+import json
+import os
+import signal
+import subprocess
+import time
+
+import httpx
+import pytest
+from anyio import create_task_group, sleep
+
+from cocat import DB, log_in, set_config
+from cocat.api import SESSION
+from cocat.app.metrics import Histogram, MetricsWriter, ServerMetrics, add_labels, merge_metrics, monitor_loop_lag
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture()
+def token_server(free_tcp_port: int, update_dir: str, db_path: str):
+    host = "127.0.0.1"
+    command = [
+        "cocat",
+        "serve",
+        "--host", host,
+        "--port", str(free_tcp_port),
+        "--update_dir", update_dir,
+        "--db_path", db_path,
+        "--metrics_token", "secret",
+        "--metrics_rooms", "1",
+    ]
+    p = subprocess.Popen(command)
+    url = f"http://{host}:{free_tcp_port}"
+    while True:
+        try:
+            httpx.get(url)
+        except httpx.TransportError:
+            time.sleep(0.1)
+        else:
+            break
+    yield host, free_tcp_port
+    os.kill(p.pid, signal.SIGINT)
+    p.wait()
+
+
+def get_samples(text):
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if not line.startswith("#"))
+
+
+def test_metrics_writer():
+    histogram = Histogram(buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value)
+    writer = MetricsWriter()
+    writer.add("rooms", "gauge", "The rooms.", 2)
+    writer.add("clients", "gauge", "The clients.", [({"room": 'my "room"'}, 3)])
+    writer.add_histogram("latency_seconds", "The latency.", histogram)
+    assert writer.render() == "\n".join([
+        "# HELP rooms The rooms.",
+        "# TYPE rooms gauge",
+        "rooms 2",
+        "# HELP clients The clients.",
+        "# TYPE clients gauge",
+        'clients{room="my \\"room\\""} 3',
+        "# HELP latency_seconds The latency.",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 6.05",
+        "latency_seconds_count 4",
+    ]) + "\n"
+
+
+def test_merge_metrics():
+    metrics = []
+    for i in range(2):
+        writer = MetricsWriter()
+        writer.add("rooms", "gauge", "The rooms.", i)
+        writer.add("clients", "gauge", "The clients.", [({"room": "room0"}, i)])
+        metrics.append(({"worker": str(i)}, writer.render()))
+    assert merge_metrics(metrics) == "\n".join([
+        "# HELP rooms The rooms.",
+        "# TYPE rooms gauge",
+        'rooms{worker="0"} 0',
+        'rooms{worker="1"} 1',
+        "# HELP clients The clients.",
+        "# TYPE clients gauge",
+        'clients{worker="0",room="room0"} 0',
+        'clients{worker="1",room="room0"} 1',
+    ]) + "\n"
+    assert add_labels("rooms 2", {}) == "rooms 2"
+
+
+async def test_monitor_loop_lag():
+    metrics = ServerMetrics()
+    async with create_task_group() as tg:
+        tg.start_soon(monitor_loop_lag, metrics, 0.01)
+        while metrics.loop_lag.count < 2:
+            await sleep(0.01)
+        tg.cancel_scope.cancel()
+    assert metrics.last_loop_lag >= 0
+    assert metrics.loop_lag.sum >= metrics.last_loop_lag
+
+
+async def test_metrics_endpoint(tmp_path, server, user, superuser, anyio_backend):
+    if anyio_backend == "trio":
+        pytest.skip("Doesn't work on Trio")
+
+    host, port = server
+    set_config(host=f"http://{host}", port=port, file_path=str(tmp_path / "updates.y"), room_id="room0")
+    log_in(*user)
+    db = DB()
+    db.create_event(start="2025-01-01", stop="2025-01-02", author="John")
+    await SESSION.connect(db.doc)
+
+    # the metrics are only served to a superuser
+    url = f"http://{host}:{port}"
+    assert httpx.get(f"{url}/metrics").status_code == 401
+    for email, password in (user, superuser):
+        response = httpx.post(f"{url}/auth/jwt/login", data={"username": email, "password": password})
+        cookies = {"fastapiusersauth": response.cookies["fastapiusersauth"]}
+        response = httpx.get(f"{url}/metrics", cookies=cookies)
+    assert response.status_code == 200
+    lines = response.text.splitlines()
+    assert "cocat_rooms_loaded 1" in lines
+    assert 'cocat_room_clients{room="room0"} 0' in lines
+    samples = get_samples(response.text)
+    assert float(samples["cocat_messages_received_total"]) >= 2
+    assert float(samples["cocat_received_bytes_total"]) > 0
+    assert float(samples["cocat_update_apply_seconds_count"]) >= 2
+    assert float(samples["cocat_storage_flush_seconds_count"]) >= 1
+    assert float(samples['cocat_room_storage_bytes{room="room0"}']) > 0
+    assert float(samples["cocat_auth_seconds_count"]) >= 1
+    assert "cocat_event_loop_lag_seconds_count" in samples
+
+
+async def test_metrics_token(token_server, user):
+    host, port = token_server
+    data = {"username": user[0], "password": user[1]}
+    async with httpx.AsyncClient(base_url=f"http://{host}:{port}") as client:
+        response = await client.get("/metrics", headers={"Authorization": "Bearer foo"})
+        assert response.status_code == 401
+        response = await client.post("/auth/jwt/login", data=data)
+        client.cookies = {"fastapiusersauth": response.cookies["fastapiusersauth"]}
+        # a user who is not a superuser cannot get the metrics
+        response = await client.get("/metrics")
+        assert response.status_code == 401
+        event = {"start": "2025-01-01", "stop": "2025-01-02", "author": "Paul"}
+        for i in range(3):
+            response = await client.post(f"/room/room{i}/events:bulk", content=json.dumps([event] * (i + 1)))
+            assert response.status_code == 200
+
+        response = await client.get("/metrics", headers={"Authorization": "Bearer secret"})
+        assert response.status_code == 200
+    samples = get_samples(response.text)
+    assert samples["cocat_rooms_loaded"] == "3"
+    # only the largest room has its own label, the others are aggregated
+    room_samples = [name for name in samples if name.startswith("cocat_room_storage_bytes")]
+    assert room_samples == ['cocat_room_storage_bytes{room="room2"}', 'cocat_room_storage_bytes{room="_other"}']
+    assert samples['cocat_room_clients{room="_other"}'] == "0"
@@ -0,0 +1,227 @@
+from datetime import datetime, timedelta, timezone
+from uuid import uuid4
+
+import httpx
+import pytest
+
+from cocat import DB, create_catalogue, create_event, log_in, save_catalogue, save_event, set_config
+from cocat.app.query import get_event_dicts, query_events
+
+
+def test_query_events():
+    db = DB()
+    event0 = db.create_event(start="2025-01-01", stop="2025-01-10", author="Paul", tags=["a", "b"])
+    event1 = db.create_event(start="2025-01-05", stop="2025-01-20", author="John", tags=["a"])
+    event2 = db.create_event(start="2025-02-01", stop="2025-02-10", author="Mike")
+    uuids = [str(event.uuid) for event in (event0, event1, event2)]
+
+    assert query_events(db).uuids() == uuids
+    assert query_events(db).explain()["order"] == "index"
+    assert query_events(db, start=datetime(2025, 1, 15)).uuids() == uuids[1:]
+    assert query_events(db, stop=datetime(2025, 1, 3)).uuids() == uuids[:1]
+    assert query_events(db, tags=["a"]).uuids() == uuids[:2]
+    assert query_events(db, tags=["a", "b"]).uuids() == uuids[:1]
+
+    # the events with the same start date are sorted by UUID
+    event3 = db.create_event(start="2025-01-05", stop="2025-01-06", author="John", tags=["a"])
+    assert query_events(db, tags=["a"]).uuids()[1:] == sorted([uuids[1], str(event3.uuid)])
+    assert query_events(db).uuids()[1:3] == sorted([uuids[1], str(event3.uuid)])
+    event3.delete()
+
+    # the index follows the changes to the events
+    event2.start = "2024-12-01"
+    assert query_events(db).uuids() == [uuids[2], *uuids[:2]]
+    assert get_event_dicts(db, uuids[:1]) == [event0.to_dict()]
+
+    catalogue = db.create_catalogue(name="cat", author="Paul", events=[event0, event2])
+    assert query_events(db, catalogue="cat").uuids() == uuids[2::-2]
+    assert query_events(db, catalogue=str(catalogue.uuid), tags=["a"]).uuids() == uuids[:1]
+    with pytest.raises(RuntimeError, match="No catalogue found"):
+        query_events(db, catalogue="foo").uuids()
+
+
+def make_events(db):
+    return [
+        db.create_event(
+            start=f"2025-01-{i + 1:02}",
+            stop=f"2025-01-{i + 3:02}",
+            author="Paul" if i < 5 else "John",
+            tags=["even"] if i % 2 == 0 else ["odd"],
+            rating=i % 3,
+            attributes={"index": i},
+        )
+        for i in range(20)
+    ]
+
+
+def test_query():
+    db = DB()
+    events = make_events(db)
+    db.create_catalogue(name="cat", author="John", events=events[:8])
+
+    query = db.query().where(start__gte="2025-01-05", tags__contains="even").order_by("-start").limit(3)
+    assert query.all() == [events[18], events[16], events[14]]
+    assert query.explain() == {
+        "index": "tags",
+        "lookup": "tags__contains",
+        "estimated_events": 10,
+        "filters": ["start__gte"],
+        "order": "sort",
+        "limit": 3,
+        "offset": 0,
+    }
+
+    # the most selective index is used
+    query = db.query().where(author="Paul", start__lt="2025-01-03").in_catalogue("cat")
+    assert query.explain()["index"] == "start"
+    assert query.explain()["filters"] == ["author", "in_catalogue('cat')"]
+    assert set(query) == set(events[:2])
+    query = db.query().where(author="John", rating__in=[0, 1]).in_catalogue("cat")
+    assert query.explain()["index"] == "catalogue"
+    assert set(query) == {events[6], events[7]}
+
+    # the events can be read in the order of an index, until the limit is reached
+    query = db.query().where(attributes__index__ne=0).order_by("start").offset(1).limit(2)
+    assert query.explain()["index"] is None
+    assert query.explain()["order"] == "index"
+    assert query.all() == events[2:4]
+    assert db.query().order_by("-start").limit(2).all() == [events[19], events[18]]
+    assert db.query().order_by("rating", "-start").limit(3).all() == [events[18], events[15], events[12]]
+    assert db.query().where(stop__eq="2025-01-03").all() == [events[0]]
+    assert db.query().where(uuid__in=[events[3].uuid, uuid4()]).all() == [events[3]]
+    assert db.query().where(attributes__missing=1).count() == 0
+    # the values which cannot be compared don't match
+    assert db.query().where(attributes__index__lt="a").count() == 0
+    assert db.query().where(start__lt=datetime(2025, 1, 2, 1, tzinfo=timezone(timedelta(hours=1)))).all() == [events[0]]
+    assert db.query().count() == 20
+
+    # the events without a rating are sorted last, and never match an ordering condition
+    event = db.create_event(start="2025-01-01", stop="2025-01-02", author="Mike")
+    assert db.query().order_by("rating").all()[-1] == event
+    assert db.query().order_by("-rating").all()[-1] == event
+    assert db.query().order_by("-rating", "-start").all()[0] == events[17]
+    assert event not in db.query().where(rating__lte=2).all()
+    assert db.query().order_by("uuid").all() == sorted([*events, event], key=lambda event: str(event.uuid))
+
+    with pytest.raises(ValueError, match="Unsupported lookup: start__contains"):
+        db.query().where(start__contains=1)
+    with pytest.raises(ValueError, match="Unsupported lookup: start__foo"):
+        db.query().where(start__foo=1)
+    with pytest.raises(ValueError, match="Unsupported lookup: attributes"):
+        db.query().where(attributes=1)
+    with pytest.raises(ValueError, match="Unsupported lookup: foo"):
+        db.query().where(foo=1)
+    with pytest.raises(ValueError, match="Cannot order by: tags"):
+        db.query().order_by("tags")
+
+
+def test_query_index_update():
+    db = DB()
+    events = make_events(db)
+    query = db.query().where(tags__contains="even", start__lt="2025-01-04").order_by("start")
+    assert query.all() == [events[0], events[2]]
+
+    # the indexes follow the changes to the events
+    events[0].remove_tags("even")
+    events[5].add_tags("even")
+    events[5].start = "2025-01-01"
+    events[2].delete()
+    assert query.all() == [events[5]]
+    new_event = db.create_event(start="2024-12-01", stop="2025-01-01", author="Mike", tags=["even"])
+    assert query.all() == [new_event, events[5]]
+    assert db.query().where(author="Mike").all() == [new_event]
+    assert db.query().where(author="Paul").count() == 4
+    new_event.products = {"p0"}
+    assert db.query().where(products__contains="p0").all() == [new_event]
+    new_event.products = {"p1"}
+    assert db.query().where(products__contains="p0").count() == 0
+
+    # the indexes are rebuilt after many events have changed
+    db.update_events(events[10:], author="Mike")
+    events[0].author = "Lisa"
+    assert db.query().where(author="Mike").count() == 11
+    assert db.query().where(author="Lisa").all() == [events[0]]
+
+    # a remote change too
+    remote_db = DB()
+    remote_db.sync(db)
+    remote_db.get_event(str(new_event.uuid)).author = "Anna"
+    assert db.query().where(author="Anna").all() == [new_event]
+
+
+def test_query_transaction():
+    db = DB()
+    events = make_events(db)
+    query = db.query().where(author="Mike").order_by("-start")
+    assert query.all() == []
+    # the events changed in an ongoing transaction are not indexed yet, they are scanned
+    with db.transaction():
+        event = db.create_event(start="2025-02-01", stop="2025-02-02", author="Mike")
+        events[0].author = "Mike"
+        assert query.explain()["index"] is None
+        assert query.all() == [event, events[0]]
+        assert db.query().order_by("start").all()[-1] == event
+    assert query.explain()["index"] == "author"
+    assert query.all() == [event, events[0]]
+
+
+def test_query_dynamic_filter():
+    db = DB(instrument=True)
+    events = make_events(db)
+    db.create_catalogue(name="cat", author="John", events=events[:8])
+    catalogue = db.create_catalogue(name="dynamic", author="John")
+    catalogue.set_dynamic_filter(db.query().where(rating=0).in_catalogue("cat"))
+    assert catalogue.dynamic_events == {events[0], events[3], events[6]}
+    # only the events of "cat" were evaluated
+    assert db.stats()["dynamic_filter_evaluations"] == 8
+    catalogue.set_dynamic_filter("event.rating == 0 and event in catalogue('cat')")
+    assert catalogue.dynamic_events == {events[0], events[3], events[6]}
+    assert db.stats()["dynamic_filter_evaluations"] == 28
+
+
+@pytest.mark.anyio
+async def test_query_endpoints(server, user, tmp_path, anyio_backend):
+    if anyio_backend == "trio":
+        pytest.skip("Doesn't work on Trio")
+
+    host, port = server
+    set_config(
+        host=f"http://{host}",
+        port=port,
+        file_path=tmp_path / "updates.y",
+        room_id="room0",
+    )
+    log_in(*user)
+    events = [
+        create_event(start=f"2025-01-{i + 1:02}", stop=f"2025-01-{i + 2:02}", author="Paul", tags=["even"] if i % 2 == 0 else [])
+        for i in range(10)
+    ]
+    for event in events:
+        await save_event(event)
+    catalogue = create_catalogue(name="cat", author="John", events=events[:5])
+    await save_catalogue(catalogue)
+
+    url = f"http://{host}:{port}/room/room0"
+    response = httpx.get(f"{url}/events")
+    assert response.status_code == 401
+
+    data = {"username": user[0], "password": user[1]}
+    cookie = httpx.post(f"http://{host}:{port}/auth/jwt/login", data=data).cookies["fastapiusersauth"]
+    cookies = {"fastapiusersauth": cookie}
+    async with httpx.AsyncClient(cookies=cookies) as client:
+        response = await client.get(f"{url}/events", params={"start": "2025-01-03T12:00:00", "stop": "2025-01-05T12:00:00"})
+        assert response.json() == [event.to_dict() for event in events[2:5]]
+
+        response = await client.get(f"{url}/events", params={"tag": "even", "limit": 3})
+        assert response.json() == [event.to_dict() for event in events[0:6:2]]
+        assert response.headers["x-total-count"] == "5"
+        offset = response.headers["x-next-offset"]
+        response = await client.get(f"{url}/events", params={"tag": "even", "offset": offset})
+        assert response.json() == [event.to_dict() for event in events[6::2]]
+        assert "x-next-offset" not in response.headers
+
+        response = await client.get(f"{url}/catalogues/cat/events", params={"start": "2025-01-04"})
+        assert response.json() == [event.to_dict() for event in events[2:5]]
+
+        response = await client.get(f"{url}/catalogues/foo/events")
+        assert response.status_code == 404
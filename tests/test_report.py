@@ -0,0 +1,145 @@
+import pytest
+from pycrdt import Doc, Map, Text, XmlElement, XmlFragment, merge_updates
+
+from cocat.report import ANY, BINARY, JSON, TYPE, XML_HOOK, attribute_sizes, read_state, read_update
+
+
+def encode_uint(value):
+    data = bytearray()
+    while value >= 0x80:
+        data.append(value & 0x7F | 0x80)
+        value >>= 7
+    data.append(value)
+    return bytes(data)
+
+
+def encode_string(value):
+    data = value.encode()
+    return encode_uint(len(data)) + data
+
+
+def encode_item(content_type, content, *, key="key", origin=None):
+    # an update with a single item of client 1 at clock 0, set in the root map "map"
+    if origin is None:
+        item = bytes([content_type | 0x20]) + encode_uint(1) + encode_string("map") + encode_string(key)
+    else:
+        item = bytes([content_type | 0x80]) + encode_uint(origin[0]) + encode_uint(origin[1])
+    return encode_uint(1) + encode_uint(1) + encode_uint(1) + encode_uint(0) + item + content + encode_uint(0)
+
+
+def test_read_update():
+    doc = Doc()
+    map = doc.get("map", type=Map)
+    map.update({
+        "int": 1,
+        "large_int": 1000,
+        "float32": 1.5,
+        "float64": 0.1,
+        "string": "x",
+        "object": {"array": [None, True, False]},
+        "bytes": b"abc",
+        "doc": Doc(),
+        "map": Map({"foo": "bar"}),
+        "deleted": 0,
+    })
+    # the content of the deleted map is garbage-collected
+    map["nested"] = Map({"map": Map({"foo": "bar"})})
+    del map["nested"]
+    del map["deleted"]
+    text = doc.get("text", type=Text)
+    text += "hello"
+    text.format(0, 2, {"bold": True})
+    text.insert_embed(1, {"image": "foo.png"})
+    doc.get("xml", type=XmlFragment).children.append(XmlElement("p"))
+
+    summary = read_update(doc.get_update())
+    assert summary.root_keys["map"] == {"int", "large_int", "float32", "float64", "string", "object", "bytes", "doc", "map", "nested", "deleted"}
+    assert summary.gc_items > 0
+    assert summary.deleted_items > 0
+    entries = summary.entries["map"]
+    assert set(entries) == {"int", "large_int", "float32", "float64", "string", "object", "bytes", "doc", "map"}
+    # the encoded content: the number of values, the value type and the value
+    assert entries["int"].bytes == 3
+    assert entries["large_int"].bytes == 4
+    assert entries["float32"].bytes == 6
+    assert entries["float64"].bytes == 10
+    assert entries["map"].content_type == TYPE
+    assert summary.entries[entries["map"].id]["foo"].content_type == ANY
+
+    # the parent and the key of an overwritten value are taken from the previous value
+    map["int"] = 2
+    entry = read_update(doc.get_update()).entries["map"]["int"]
+    assert entry.id != entries["int"].id
+
+
+def test_read_update_skip():
+    doc = Doc()
+    map = doc.get("map", type=Map)
+    updates = []
+    for i in range(3):
+        state = doc.get_state()
+        map["foo"] = i
+        updates.append(doc.get_update(state))
+    # the second change is missing, the parent of the last value can't be found
+    summary = read_update(merge_updates(updates[0], updates[2]))
+    assert summary.structs == 3
+    assert summary.items == 3
+    assert summary.entries == {}
+    summary = read_update(updates[2])
+    assert summary.entries == {}
+
+
+def test_read_update_no_gc():
+    doc = Doc(skip_gc=True)
+    map = doc.get("map", type=Map)
+    map["foo"] = "bar"
+    map["baz"] = 0
+    del map["foo"]
+    # the deleted value is kept, but it is not live
+    summary = read_update(doc.get_update())
+    assert summary.deleted_items == 1
+    assert set(summary.entries["map"]) == {"baz"}
+
+
+def test_attribute_sizes():
+    doc = Doc()
+    doc.get("events", type=Map).update({
+        "event0": Map({"attributes": Map({"foo": "bar"})}),
+        # not a valid event, but the report doesn't fail
+        "event1": Map({"author": "John"}),
+    })
+    doc.get("catalogues", type=Map)["catalogue0"] = Map({"attributes": Map({"baz": 1})})
+    assert list(attribute_sizes(read_update(doc.get_update()))) == [
+        {"kind": "event", "uuid": "event0", "name": "foo", "bytes": 6},
+        {"kind": "catalogue", "uuid": "catalogue0", "name": "baz", "bytes": 3},
+    ]
+
+
+def test_read_crafted_update():
+    summary = read_update(encode_item(JSON, encode_uint(1) + encode_string(f'"{"x" * 200}"')))
+    assert summary.entries["map"]["key"].content_type == JSON
+    assert summary.entries["map"]["key"].bytes == 205
+    assert summary.items == 1
+    summary = read_update(encode_item(BINARY, encode_string("abc")))
+    assert summary.entries["map"]["key"].bytes == 4
+    summary = read_update(encode_item(TYPE, encode_uint(XML_HOOK) + encode_string("hook")))
+    assert summary.entries["map"]["key"].content_type == TYPE
+    # the origin of the item is unknown
+    summary = read_update(encode_item(ANY, encode_uint(1) + bytes([120]), origin=(2, 0)))
+    assert summary.items == 1
+    assert summary.entries == {}
+
+    with pytest.raises(ValueError, match="Unknown content type: 11"):
+        read_update(encode_item(11, b""))
+    with pytest.raises(ValueError, match="Unknown value type: 1"):
+        read_update(encode_item(ANY, encode_uint(1) + bytes([1])))
+    with pytest.raises(ValueError, match="Unexpected end of update"):
+        read_update(encode_item(BINARY, encode_uint(10) + b"abc")[:-1])
+    with pytest.raises(ValueError, match="Unexpected end of update"):
+        read_update(b"\x01")
+
+
+def test_read_state():
+    doc = Doc()
+    doc.get("map", type=Map)["foo"] = "bar"
+    assert read_state(doc.get_state()) == {doc.client_id: 1}
@@ -0,0 +1,334 @@
+import os
+from functools import partial
+from threading import get_ident
+
+import pytest
+from anyio import Event, Path, create_task_group, fail_after, sleep, sleep_forever, wait_all_tasks_blocked
+from pycrdt import Decoder, Doc, Map, YMessageType, YSyncMessageType, create_sync_message, create_update_message
+
+from cocat import DB
+from cocat.app.metrics import ServerMetrics
+from cocat.app.room import Clock, StoredRoom, StoredRoomManager
+from cocat.app.store import FileStore, create_store, read_snapshot, read_updates
+from cocat.compression import StaleClientError
+
+
+pytestmark = pytest.mark.anyio
+
+
+class FakeClock(Clock):
+    """
+    A clock which only advances when told to, once all the tasks are blocked.
+    """
+    def __init__(self):
+        self.now = 0.0
+        self._sleepers = []
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, delay):
+        sleeper = (self.now + delay, Event())
+        self._sleepers.append(sleeper)
+        try:
+            await sleeper[1].wait()
+        finally:
+            self._sleepers.remove(sleeper)
+
+    async def advance(self, delay):
+        await wait_all_tasks_blocked()
+        self.now += delay
+        for deadline, event in self._sleepers:
+            if deadline <= self.now:
+                event.set()
+        await wait_all_tasks_blocked()
+
+
+async def wait_until(predicate):
+    # what is waited for happens in other tasks, or in worker threads
+    with fail_after(5):
+        while not predicate():
+            await sleep(0.01)
+
+
+async def test_clock():
+    clock = Clock()
+    time = clock.time()
+    await clock.sleep(0.01)
+    assert clock.time() > time
+
+
+async def test_idle_timeout(update_dir):
+    clock = FakeClock()
+    room_factory = partial(StoredRoom, FileStore(update_dir))
+    async with StoredRoomManager(room_factory, idle_timeout=10, clock=clock) as room_manager:
+        async with room_manager.use_room("room0") as room0:
+            room0.doc.get("map", type=Map)["foo"] = "bar"
+            assert room_manager.rooms == {"room0": room0}
+            await clock.advance(20)
+            # a room is not unloaded while it is used
+            assert room_manager.rooms == {"room0": room0}
+
+        async with room_manager.use_room("room0") as room:
+            assert room is room0
+        await clock.advance(5)
+        # using the room again restarts the idle timeout
+        async with room_manager.use_room("room0") as room:
+            assert room is room0
+        await clock.advance(5)
+        assert room_manager.rooms == {"room0": room0}
+        await clock.advance(5)
+        assert room_manager.rooms == {}
+        # wait for the room to be closed
+        async with room_manager._lock:
+            pass
+
+        assert await read_updates(Path(update_dir) / "room0.y") == []
+        assert await Path(update_dir, "room0.snapshot").exists()
+
+        async with room_manager.use_room("room0") as room:
+            assert room is not room0
+            assert room.doc.get("map", type=Map).to_py() == {"foo": "bar"}
+
+
+@pytest.mark.parametrize("store", ["file", "sqlite"])
+async def test_memory_budget(update_dir, store):
+    room_store = create_store(store, update_dir)
+    room_factory = partial(StoredRoom, room_store)
+    async with room_store.start(), StoredRoomManager(room_factory, memory_budget=1) as room_manager:
+        async with room_manager.use_room("room0") as room0:
+            size0 = room0.size
+            room0.doc.get("map", type=Map)["foo"] = "bar"
+            async with room_manager.use_room("room1") as room1:
+                size1 = room1.size
+                room1.doc.get("map", type=Map)["baz"] = 3
+                await wait_until(lambda: room0.size > size0 and room1.size > size1)
+                assert room_manager.rooms == {"room0": room0, "room1": room1}
+            assert room_manager.rooms == {"room0": room0}
+        assert room_manager.rooms == {}
+
+        async with room_manager.use_room("room1") as room:
+            assert room.doc.get("map", type=Map).to_py() == {"baz": 3}
+
+
+async def test_compaction(update_dir):
+    room_factory = partial(StoredRoom, FileStore(update_dir, compaction_updates=1))
+    async with StoredRoomManager(room_factory) as room_manager:
+        async with room_manager.use_room("room0") as room:
+            map = room.doc.get("map", type=Map)
+            map["foo"] = "bar"
+            map["baz"] = 3
+            # the room storage is compacted in the background
+            snapshot_path = Path(update_dir) / "room0.snapshot"
+            await wait_until(lambda: os.path.exists(snapshot_path) and not room._compacting)
+            _, snapshot = await read_snapshot(snapshot_path)
+            doc = Doc()
+            doc.apply_update(snapshot)
+            assert doc.get("map", type=Map).to_py() == {"foo": "bar", "baz": 3}
+
+
+async def test_snapshot(update_dir):
+    room_factory = partial(StoredRoom, FileStore(update_dir))
+    async with StoredRoomManager(room_factory) as room_manager:
+        async with room_manager.use_room("room0") as room:
+            event = room.db.create_event(start="2025-01-31", stop="2026-01-31", author="John")
+            etag, update = room.get_snapshot()
+            assert room.get_snapshot() == (etag, update)
+            db = DB()
+            db.doc.apply_update(update)
+            assert db.events == {event}
+
+            # a deletion doesn't change the state vector, but it changes the snapshot
+            state = room.doc.get_state()
+            event.delete()
+            assert room.doc.get_state() == state
+            etag2, update = room.get_snapshot()
+            assert etag2 != etag
+            db = DB()
+            db.doc.apply_update(update)
+            assert db.events == set()
+
+
+class Client:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, message):
+        self.messages.append(message)
+
+
+class SendingClient(Client):
+    def __init__(self, messages):
+        super().__init__()
+        self._messages = iter(messages)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        for message in self._messages:
+            return message
+        raise StopAsyncIteration
+
+
+@pytest.mark.parametrize("broadcast_window", [0, 50])
+async def test_broadcast_window(update_dir, broadcast_window):
+    clock = FakeClock()
+    room_factory = partial(StoredRoom, FileStore(update_dir), broadcast_window=broadcast_window, broadcast_max_delay=100, clock=clock)
+    async with StoredRoomManager(room_factory) as room_manager:
+        async with room_manager.use_room("room0") as room:
+            clients = [Client(), Client()]
+            room._clients.update(clients)
+            map = room.doc.get("map", type=Map)
+            for i in range(10):
+                map[str(i)] = i
+                await clock.advance(1)
+            assert len(clients[0].messages) == (0 if broadcast_window else 10)
+            await clock.advance(100)
+            for client in clients:
+                assert len(client.messages) == (1 if broadcast_window else 10)
+                doc = Doc()
+                for message in client.messages:
+                    assert message[:2] == bytes([YMessageType.SYNC, YSyncMessageType.SYNC_UPDATE])
+                    doc.apply_update(Decoder(message[2:]).read_message())
+                assert doc.get("map", type=Map).to_py() == {str(i): i for i in range(10)}
+            room._clients.clear()
+
+
+async def test_broadcast_max_delay(update_dir):
+    clock = FakeClock()
+    room_factory = partial(StoredRoom, FileStore(update_dir), broadcast_window=5, broadcast_max_delay=10, clock=clock)
+    async with StoredRoomManager(room_factory) as room_manager:
+        async with room_manager.use_room("room0") as room:
+            client = Client()
+            room._clients.add(client)
+            map = room.doc.get("map", type=Map)
+            # the room keeps receiving updates, which are sent after the maximum delay
+            for i in range(30):
+                map[str(i)] = i
+                await clock.advance(1)
+                assert len(client.messages) == (i + 1) // 10
+            room._clients.clear()
+
+
+class FailingClient(Client):
+    async def send(self, message):
+        raise RuntimeError("Connection lost")
+
+
+class BlockedClient(Client):
+    async def send(self, message):
+        await sleep_forever()
+
+
+async def test_broadcast_errors(update_dir):
+    room_factory = partial(StoredRoom, FileStore(update_dir))
+    async with StoredRoomManager(room_factory) as room_manager:
+        async with room_manager.use_room("room0") as room:
+            # a client which cannot be sent a message is removed
+            client = Client()
+            room._clients.update([client, FailingClient()])
+            await room._broadcast(b"foo")
+            assert room._clients == {client}
+            assert client.messages == [b"foo"]
+
+            # a client is removed if the room is stopped while sending it a message
+            room._clients.add(BlockedClient())
+            async with create_task_group() as tg:
+                tg.start_soon(room._broadcast, b"bar")
+                await wait_all_tasks_blocked()
+                tg.cancel_scope.cancel()
+            assert room._clients <= {client}
+            room._clients.clear()
+
+
+@pytest.mark.parametrize("thread_threshold", [None, 0])
+async def test_thread_threshold(update_dir, thread_threshold):
+    remote_doc = Doc()
+    remote_doc.get("map", type=Map)["foo"] = "bar"
+    message = create_update_message(remote_doc.get_update())
+    metrics = ServerMetrics()
+    room_factory = partial(StoredRoom, FileStore(update_dir), thread_threshold=thread_threshold, metrics=metrics)
+    async with StoredRoomManager(room_factory) as room_manager:
+        async with room_manager.use_room("room0") as room:
+            threads = []
+            room.doc.observe(lambda event: threads.append(get_ident()))
+            client = Client()
+            room._clients.add(client)
+            size = room.size
+            await room.serve(SendingClient([message]))
+            await wait_until(lambda: len(client.messages) == 1 and room.size > size)
+            async with room.lock:
+                assert room.doc.get("map", type=Map).to_py() == {"foo": "bar"}
+            assert (threads != [get_ident()]) == (thread_threshold == 0)
+            # the update is broadcast and stored, wherever it was applied
+            assert len(client.messages) == 1
+            doc = Doc()
+            doc.apply_update(Decoder(client.messages[0][2:]).read_message())
+            assert doc.get("map", type=Map).to_py() == {"foo": "bar"}
+            assert len(await read_updates(Path(update_dir) / "room0.y")) == 1
+            assert metrics.update_apply.count == 1
+            room._clients.clear()
+
+    # the stored updates are replayed in a worker thread
+    async with StoredRoomManager(room_factory) as room_manager:
+        async with room_manager.use_room("room0") as room:
+            assert room.doc.get("map", type=Map).to_py() == {"foo": "bar"}
+
+
+async def test_serve_error(update_dir):
+    room_factory = partial(StoredRoom, FileStore(update_dir))
+    async with StoredRoomManager(room_factory) as room_manager:
+        async with room_manager.use_room("room0") as room:
+            # the client is removed if the room cannot send it the document
+            await room.serve(FailingClient())
+            assert room.client_nb == 0
+
+
+class WaitingClient(SendingClient):
+    async def __anext__(self):
+        for message in self._messages:
+            return message
+        await sleep_forever()
+
+
+@pytest.mark.parametrize("thread_threshold", [None, 0])
+async def test_compact_history(update_dir, thread_threshold):
+    room_factory = partial(StoredRoom, FileStore(update_dir), thread_threshold=thread_threshold)
+    async with StoredRoomManager(room_factory) as room_manager:
+        async with room_manager.use_room("room0") as room:
+            event = room.db.create_event(start="2025-01-31", stop="2026-01-31", author="John")
+            for i in range(10):
+                event.author = f"Paul{i}"
+            old_doc = Doc()
+            old_doc.apply_update(room.doc.get_update())
+            retired_client = room.doc.client_id
+            async with create_task_group() as tg:
+                # the connected clients are disconnected
+                await tg.start(room.serve, WaitingClient([create_sync_message(old_doc)]))
+                assert room.client_nb == 1
+                epoch = await room.compact_history()
+            assert room.client_nb == 0
+            assert room.epoch == epoch
+            assert room.db.get_event(str(event.uuid)).author == "Paul9"
+            # the changes to the previous document are not stored anymore
+            event.author = "Paul"
+            await sleep(0.1)
+
+            # a client with a document of the previous epoch is refused
+            with pytest.raises(StaleClientError):
+                await room.serve(SendingClient([create_sync_message(old_doc)]))
+            # a client with an empty document is served
+            client = SendingClient([create_sync_message(Doc())])
+            await room.serve(client)
+            doc = Doc()
+            for message in client.messages:
+                if message[:2] == bytes([YMessageType.SYNC, YSyncMessageType.SYNC_STEP2]):
+                    doc.apply_update(Decoder(message[2:]).read_message())
+            assert DB(doc).epoch == epoch
+
+    async with StoredRoomManager(room_factory) as room_manager:
+        async with room_manager.use_room("room0") as room:
+            assert room.epoch == epoch
+            assert room.db.get_event(str(event.uuid)).author == "Paul9"
+            assert room.db.retired_clients == {retired_client}
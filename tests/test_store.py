@@ -0,0 +1,296 @@
+import json
+import subprocess
+
+import anyio
+import pytest
+from pycrdt import Doc, Map
+
+from cocat import DB
+from cocat.app.metrics import Histogram
+from cocat.app.store import FileStore, SQLiteStore, UpdateFile, compact_file, compact_room, read_snapshot, read_updates
+
+
+pytestmark = pytest.mark.anyio
+
+async def test_update_file(tmp_path):
+    path = tmp_path / "room.y"
+    doc = Doc()
+    map = doc.get("map", type=Map)
+    async with UpdateFile(path, compaction_updates=10) as update_file:
+        async with doc.events() as events:
+            for i in range(11):
+                map[str(i)] = i
+                event = await events.receive()
+                await update_file.write(event.update)
+                assert update_file.needs_compaction == (i == 10)
+
+    doc = Doc()
+    async with UpdateFile(path) as update_file:
+        await update_file.load(doc)
+        assert not update_file.needs_compaction
+    assert doc.get("map", type=Map).to_py() == {str(i): i for i in range(11)}
+
+
+@pytest.mark.parametrize("fsync", ["update", "never"])
+async def test_compaction(tmp_path, fsync):
+    path = tmp_path / "room.y"
+    doc = Doc()
+    map = doc.get("map", type=Map)
+    async with UpdateFile(path, compaction_size=100, fsync=fsync) as update_file:
+        async with doc.events() as events:
+            for i in range(100):
+                map["key"] = i
+                event = await events.receive()
+                await update_file.write(event.update)
+            size = update_file.size
+            assert update_file.needs_compaction
+            await update_file.compact(doc)
+            assert not update_file.needs_compaction
+            assert update_file.size < size
+            assert await read_updates(update_file.path) == []
+            map["foo"] = "bar"
+            event = await events.receive()
+            await update_file.write(event.update)
+
+    doc = Doc()
+    async with UpdateFile(path, compaction_size=100) as update_file:
+        await update_file.load(doc)
+        assert not update_file.needs_compaction
+    assert doc.get("map", type=Map).to_py() == {"key": 99, "foo": "bar"}
+
+
+async def test_compact_file(tmp_path):
+    path = tmp_path / "room.y"
+    doc = Doc()
+    map = doc.get("map", type=Map)
+    async with UpdateFile(path) as update_file:
+        async with doc.events() as events:
+            for i in range(100):
+                map["key"] = i
+                event = await events.receive()
+                await update_file.write(event.update)
+
+    size_before, size_after = await compact_file(path)
+    assert size_after == path.stat().st_size + path.with_suffix(".snapshot").stat().st_size < size_before
+
+    doc = Doc()
+    async with UpdateFile(path) as update_file:
+        await update_file.load(doc)
+    assert doc.get("map", type=Map).to_py() == {"key": 99}
+
+
+async def test_compact_room_history(tmp_path):
+    db = DB()
+    event = db.create_event(start="2025-01-31", stop="2026-01-31", author="John")
+    for i in range(10):
+        event.author = f"Paul{i}"
+    store = FileStore(tmp_path)
+    async with store.start():
+        async with store.open("room0") as storage:
+            await storage.write(db.doc.get_update())
+
+        _, size = await compact_room(store, "room0", history=True)
+        doc = Doc()
+        async with store.open("room0") as storage:
+            await storage.load(doc)
+            assert storage.size == size
+    compacted = DB(doc)
+    assert compacted.epoch is not None
+    assert compacted.retired_clients == {db.doc.client_id}
+    assert compacted.get_event(str(event.uuid)).author == "Paul9"
+
+
+def test_compact_cli(tmp_path):
+    (tmp_path / "room0.y").write_bytes(b"0.0.1\x00")
+    (tmp_path / "room1.y").write_bytes(b"0.0.1\x00")
+    output = subprocess.check_output(["cocat", "compact", "--update-dir", str(tmp_path)]).decode()
+    assert "room0" in output
+    assert "room1" in output
+    output = subprocess.check_output(["cocat", "compact", "--update-dir", str(tmp_path), "--room", "room1"]).decode()
+    assert "room0" not in output
+    assert "room1" in output
+    process = subprocess.run(["cocat", "compact", "--update-dir", str(tmp_path), "--room", "room2"], capture_output=True)
+    assert process.returncode == 1
+    assert b"Room not found: room2" in process.stderr
+    assert not (tmp_path / "room2.y").exists()
+
+
+async def test_inspect_cli(tmp_path):
+    path = tmp_path / "room.y"
+    db = DB()
+    async with UpdateFile(path) as update_file:
+        async with db.doc.events() as events:
+            event = db.create_event(start="2025-01-31", stop="2026-01-31", author="John")
+            await update_file.write((await events.receive()).update)
+            event.delete()
+            await update_file.write((await events.receive()).update)
+
+    output = subprocess.check_output(["cocat", "inspect", str(path)]).decode()
+    report = json.loads(output)
+    assert report["events"] == {"live": 0, "deleted": 1}
+    assert report["storage"]["updates"] == 2
+    assert report["storage"]["update_bytes"] == path.stat().st_size
+
+
+async def test_version_mismatch(tmp_path):
+    path = tmp_path / "room.y"
+    path.write_bytes(b"0.0.0\x00")
+    async with UpdateFile(path) as update_file:
+        with pytest.raises(RuntimeError, match='File version mismatch'):
+            await update_file.load(Doc())
+
+
+async def test_empty_file(tmp_path):
+    path = tmp_path / "room.y"
+    path.write_bytes(b"")
+    assert await read_updates(anyio.Path(path)) == []
+    async with UpdateFile(path) as update_file:
+        await update_file.load(Doc())
+        await update_file.write(b"foo")
+    assert await read_updates(anyio.Path(path)) == [b"foo"]
+
+
+async def test_snapshot(tmp_path):
+    path = tmp_path / "room.y"
+    doc = Doc()
+    map = doc.get("map", type=Map)
+    async with UpdateFile(path) as update_file:
+        async with doc.events() as events:
+            map["foo"] = "bar"
+            event = await events.receive()
+            await update_file.write(event.update)
+            await update_file.compact(doc)
+            map["baz"] = 3
+            event = await events.receive()
+            await update_file.write(event.update)
+
+    state, update = await read_snapshot(anyio.Path(tmp_path / "room.snapshot"))
+    assert state != doc.get_state()
+    snapshot_doc = Doc()
+    snapshot_doc.apply_update(update)
+    assert snapshot_doc.get_state() == state
+    assert snapshot_doc.get("map", type=Map).to_py() == {"foo": "bar"}
+
+    doc = Doc()
+    async with UpdateFile(path) as update_file:
+        await update_file.load(doc)
+    assert doc.get("map", type=Map).to_py() == {"foo": "bar", "baz": 3}
+
+
+async def test_snapshot_version_mismatch(tmp_path):
+    path = anyio.Path(tmp_path / "room.snapshot")
+    await path.write_bytes(b"0.0.0\x00")
+    with pytest.raises(RuntimeError, match="Snapshot version mismatch"):
+        await read_snapshot(path)
+
+
+@pytest.mark.parametrize("fsync", ["update", "periodic", "never"])
+async def test_group_commit(tmp_path, fsync):
+    path = tmp_path / "room.y"
+    doc = Doc()
+    map = doc.get("map", type=Map)
+    async with UpdateFile(path, flush_interval=0.1, fsync=fsync, fsync_interval=0.05) as update_file:
+        async with doc.events() as events:
+            size = update_file.size
+            for i in range(10):
+                map[str(i)] = i
+                event = await events.receive()
+                await update_file.write(event.update)
+            assert update_file.size == size
+            await anyio.sleep(0.2)
+            assert update_file.size > size
+            assert len(await read_updates(update_file.path)) == 1
+            map["foo"] = "bar"
+            event = await events.receive()
+            await update_file.write(event.update)
+
+    updates = await read_updates(anyio.Path(path))
+    assert len(updates) == 2
+    doc = Doc()
+    for update in updates:
+        doc.apply_update(update)
+    assert doc.get("map", type=Map).to_py() == {**{str(i): i for i in range(10)}, "foo": "bar"}
+
+
+async def test_flush_size(tmp_path):
+    path = tmp_path / "room.y"
+    doc = Doc()
+    map = doc.get("map", type=Map)
+    flush_latency = Histogram()
+    async with UpdateFile(path, flush_interval=10, flush_size=100, flush_latency=flush_latency) as update_file:
+        async with doc.events() as events:
+            size = update_file.size
+            map["foo"] = "bar"
+            event = await events.receive()
+            await update_file.write(event.update)
+            assert update_file.size == size
+            map["baz"] = "x" * 100
+            event = await events.receive()
+            await update_file.write(event.update)
+            assert update_file.size > size
+            assert len(await read_updates(update_file.path)) == 1
+            assert flush_latency.count == 1
+
+
+@pytest.mark.parametrize("fsync", ["update", "periodic", "never"])
+async def test_sqlite_store(tmp_path, fsync):
+    store = SQLiteStore(tmp_path / "rooms.db", compaction_updates=10, fsync=fsync, fsync_interval=0.01)
+    async with store.start():
+        doc = Doc()
+        map = doc.get("map", type=Map)
+        async with store.open("room0") as storage:
+            await storage.load(doc)
+            async with doc.events() as events:
+                for i in range(11):
+                    map["key"] = i
+                    event = await events.receive()
+                    await storage.write(event.update)
+                    await anyio.sleep(0.01)
+                assert storage.needs_compaction
+                size = storage.size
+                await storage.compact(doc)
+                assert not storage.needs_compaction
+                assert storage.size < size
+                map["foo"] = "bar"
+                event = await events.receive()
+                await storage.write(event.update)
+
+        async with store.open("room1") as storage:
+            await storage.write(Doc().get_update())
+
+        assert await store.room_ids() == ["room0", "room1"]
+
+    async with store.start():
+        doc = Doc()
+        async with store.open("room0") as storage:
+            await storage.load(doc)
+            assert storage._tail_updates == 1
+        assert doc.get("map", type=Map).to_py() == {"key": 10, "foo": "bar"}
+
+
+async def test_file_store(tmp_path):
+    store = FileStore(tmp_path)
+    async with store.start():
+        doc = Doc()
+        async with store.open("room1") as storage:
+            doc.get("map", type=Map)["foo"] = "bar"
+            await storage.write(doc.get_update())
+            await storage.compact(doc)
+            assert await storage.snapshot_path.exists()
+        async with store.open("room0") as storage:
+            await storage.write(Doc().get_update())
+
+        assert await store.room_ids() == ["room0", "room1"]
+
+
+def test_compact_cli_sqlite(tmp_path):
+    async def write_update():
+        async with SQLiteStore(tmp_path / "rooms.db").start() as store:
+            async with store.open("room0") as storage:
+                doc = Doc()
+                doc.get("map", type=Map)["foo"] = "bar"
+                await storage.write(doc.get_update())
+
+    anyio.run(write_update)
+    output = subprocess.check_output(["cocat", "compact", "--update-dir", str(tmp_path), "--store", "sqlite"]).decode()
+    assert "Compacted room0" in output
@@ -0,0 +1,137 @@
+import uuid
+from dataclasses import dataclass, field
+from time import monotonic
+
+import pytest
+from fastapi_users.authentication.strategy import StrategyDestroyNotSupportedError
+
+from cocat.app import db
+from cocat.app.schemas import UserCreate, UserUpdate
+from cocat.app.users import AuthMetrics, CachedJWTStrategy, UserAuth, get_user_manager
+
+
+pytestmark = pytest.mark.anyio
+
+SECRET = uuid.uuid4().hex
+
+@dataclass
+class User:
+    id: uuid.UUID = field(default_factory=uuid.uuid4)
+
+
+class UserManager:
+    def __init__(self, users):
+        self.users = {user.id: user for user in users}
+        self.calls = 0
+
+    def parse_id(self, id):
+        return uuid.UUID(id)
+
+    async def get(self, id):
+        self.calls += 1
+        return self.users[id]
+
+
+async def test_cached_jwt_strategy():
+    user0, user1 = User(), User()
+    user_manager = UserManager([user0, user1])
+    strategy = CachedJWTStrategy(secret=SECRET, lifetime_seconds=3600, cache_size=1)
+    token0 = await strategy.write_token(user0)
+    token1 = await strategy.write_token(user1)
+
+    assert await strategy.read_token(token0, user_manager) is user0
+    assert await strategy.read_token(token0, user_manager) is user0
+    assert user_manager.calls == 1
+    assert strategy.metrics.cache_hits == 1
+
+    # the cache is bounded
+    assert await strategy.read_token(token1, user_manager) is user1
+    assert await strategy.read_token(token0, user_manager) is user0
+    assert user_manager.calls == 3
+
+    strategy.invalidate_user(user0.id)
+    assert await strategy.read_token(token0, user_manager) is user0
+    assert user_manager.calls == 4
+
+    with pytest.raises(StrategyDestroyNotSupportedError):
+        await strategy.destroy_token(token0, user0)
+    assert await strategy.read_token(token0, user_manager) is user0
+    assert user_manager.calls == 5
+
+    assert await strategy.read_token("invalid", user_manager) is None
+    assert await strategy.read_token(None, user_manager) is None
+
+    # an expired token is removed from the cache
+    user = strategy._cache[token0][0]
+    strategy._cache[token0] = (user, monotonic() - 1)
+    assert await strategy.read_token(token0, user_manager) is user0
+    assert user_manager.calls == 6
+
+
+async def test_cache_ttl():
+    user = User()
+    user_manager = UserManager([user])
+    strategy = CachedJWTStrategy(secret=SECRET, lifetime_seconds=3600, cache_ttl=0)
+    token = await strategy.write_token(user)
+    assert await strategy.read_token(token, user_manager) is user
+    assert await strategy.read_token(token, user_manager) is user
+    assert user_manager.calls == 2
+
+    # a token is not cached after it expires
+    strategy = CachedJWTStrategy(secret=SECRET, lifetime_seconds=1)
+    token = await strategy.write_token(user)
+    assert await strategy.read_token(token, user_manager) is user
+    _, expires = strategy._cache[token]
+    assert expires <= monotonic() + 1
+
+
+def test_auth_metrics():
+    metrics = AuthMetrics()
+    metrics.record(0.1)
+    metrics.record(0.3)
+    assert metrics.connections == 2
+    assert metrics.total_latency == pytest.approx(0.4)
+    assert metrics.max_latency == 0.3
+    assert metrics.latency.count == 2
+
+
+async def test_user_manager(tmp_path, monkeypatch, capsys, anyio_backend):
+    if anyio_backend == "trio":
+        pytest.skip("The database driver doesn't work on Trio")
+
+    monkeypatch.setattr(db, "async_session_maker", None)
+    await db.create_db_and_tables(str(tmp_path / "test.db"))
+    # the database is only created once
+    await db.create_db_and_tables(str(tmp_path / "other.db"))
+    assert not (tmp_path / "other.db").exists()
+
+    auth = UserAuth(cache_size=10)
+    assert auth.get_jwt_strategy() is auth.jwt_strategy
+    # every application has its own strategy
+    assert UserAuth().jwt_strategy is not auth.jwt_strategy
+    assert auth.jwt_strategy.cache_size == 10
+    async for session in db.get_async_session():
+        async for access_token_db in db.get_access_token_db(session):
+            assert access_token_db.session is session
+        async for user_db in db.get_user_db(session):
+            async for user_manager in get_user_manager(user_db):
+                user = await user_manager.create(UserCreate(email="paul@foo.com", password="pwd"))
+                assert "has registered" in capsys.readouterr().out
+                await user_manager.forgot_password(user)
+                assert "has forgot their password" in capsys.readouterr().out
+                await user_manager.request_verify(user)
+                assert "Verification requested" in capsys.readouterr().out
+
+                # a user manager without a strategy has no cached token to drop
+                user = await user_manager.update(UserUpdate(password="pwd1"), user)
+
+            # the cached tokens of a user are dropped when the user is updated or deleted
+            strategy = auth.jwt_strategy
+            async for user_manager in auth.get_user_manager(user_db):
+                token = await strategy.write_token(user)
+                assert await strategy.read_token(token, user_manager) == user
+                await user_manager.update(UserUpdate(password="pwd2"), user)
+                assert token not in strategy._cache
+                assert await strategy.read_token(token, user_manager) == user
+                await user_manager.delete(user)
+                assert token not in strategy._cache
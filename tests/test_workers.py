@@ -0,0 +1,216 @@
+import json
+import os
+import signal
+import subprocess
+import time
+from collections import Counter
+
+import httpx
+import pytest
+from anycorn import Config, serve
+from anyio import CancelScope, Event, create_task_group, fail_after, sleep
+from fastapi import FastAPI, Request, Response, WebSocket
+from httpx_ws import WebSocketDisconnect, WebSocketNetworkError, WebSocketUpgradeError, aconnect_ws
+
+from cocat import create_catalogue, load_catalogue, log_in, log_out, save_catalogue, set_config
+from cocat.app.proxy import HashRing, ProxyApp, forward_to_client
+
+
+@pytest.fixture()
+def workers_server(free_tcp_port: int, update_dir: str, db_path: str):
+    host = "127.0.0.1"
+    command = [
+        "cocat",
+        "serve",
+        "--host", host,
+        "--port", str(free_tcp_port),
+        "--update_dir", update_dir,
+        "--db_path", db_path,
+        "--workers", "2",
+    ]
+    p = subprocess.Popen(command)
+    url = f"http://{host}:{free_tcp_port}"
+    while True:
+        try:
+            httpx.get(url)
+        except httpx.TransportError:
+            time.sleep(0.1)
+        else:
+            break
+    yield host, free_tcp_port
+    os.kill(p.pid, signal.SIGINT)
+    p.wait()
+
+
+def test_hash_ring():
+    ring = HashRing(["a", "b", "c"])
+    keys = [f"room{i}" for i in range(1000)]
+    nodes = {key: ring.get(key) for key in keys}
+    assert all(ring.get(key) == node for key, node in nodes.items())
+    counts = Counter(nodes.values())
+    assert all(count > 200 for count in counts.values())
+
+    # only the keys of the removed node are moved
+    ring = HashRing(["a", "b"])
+    for key, node in nodes.items():
+        if node != "c":
+            assert ring.get(key) == node
+
+
+@pytest.mark.anyio
+async def test_workers(workers_server, user, superuser, tmp_path, anyio_backend):
+    if anyio_backend == "trio":
+        pytest.skip("Doesn't work on Trio")
+
+    host, port = workers_server
+    url = f"http://{host}:{port}"
+    set_config(
+        host=f"http://{host}",
+        port=port,
+        file_path=tmp_path / "updates.y",
+        room_id="room0",
+    )
+    log_in(*user)
+    catalogue = create_catalogue(name="cat", author="Paul")
+    await save_catalogue(catalogue)
+    set_config(file_path=tmp_path / "updates2.y")
+    assert catalogue == await load_catalogue("cat")
+
+    data = {"username": user[0], "password": user[1]}
+    async with httpx.AsyncClient(base_url=url) as client:
+        response = await client.post("/auth/jwt/login", data=data)
+        client.cookies = {"fastapiusersauth": response.cookies["fastapiusersauth"]}
+        event = {"start": "2025-01-01", "stop": "2025-01-02", "author": "Paul"}
+        for i in range(10):
+            response = await client.post(f"/room/room{i}/events:bulk", content=json.dumps(event))
+            assert response.status_code == 200
+            uuids = response.json()["events"]
+            response = await client.get(f"/room/room{i}/events")
+            assert [event["uuid"] for event in response.json()] == uuids
+
+        # the metrics of all the workers are returned
+        data = {"username": superuser[0], "password": superuser[1]}
+        response = await client.post("/auth/jwt/login", data=data)
+        client.cookies = {"fastapiusersauth": response.cookies["fastapiusersauth"]}
+        response = await client.get("/metrics")
+        samples = dict(line.rsplit(" ", 1) for line in response.text.splitlines() if not line.startswith("#"))
+        rooms = [int(samples[f'cocat_rooms_loaded{{worker="{i}"}}']) for i in range(2)]
+        assert sum(rooms) == 10
+
+    log_out()
+    with pytest.RaisesGroup(WebSocketUpgradeError):
+        await load_catalogue("cat")
+
+
+def create_worker(name: str) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/")
+    async def get_root():
+        return {}
+
+    @app.get("/metrics")
+    async def get_metrics(request: Request):
+        if request.headers.get("cookie") != "token=foo":
+            return Response("Unauthorized", status_code=401, media_type="text/plain")
+        return Response("# HELP rooms The rooms.\n# TYPE rooms gauge\nrooms 1\n", media_type="text/plain")
+
+    @app.post("/room/{id}/echo")
+    async def echo(id: str, request: Request):
+        return {"worker": name, "room": id, "body": (await request.body()).decode()}
+
+    @app.websocket("/room/{id}")
+    async def connect_room(id: str, websocket: WebSocket):
+        if id == "forbidden":
+            await websocket.close()
+            return
+        await websocket.accept()
+        if id == "stale":
+            await websocket.close(code=4409, reason="stale")
+            return
+        async for message in websocket.iter_bytes():
+            await websocket.send_bytes(name.encode() + message)
+
+    return app
+
+
+@pytest.mark.anyio
+async def test_proxy_app(free_tcp_port_factory):
+    port, *ports = [free_tcp_port_factory() for _ in range(3)]
+    workers = {f"http://127.0.0.1:{port}": f"worker{i}" for i, port in enumerate(ports)}
+    proxy = ProxyApp(list(workers))
+    room_ids = {proxy.get_worker_url(f"room{i}"): f"room{i}" for i in range(10)}
+    assert len(room_ids) == 2
+
+    # the proxy waits for the workers to be started
+    async with httpx.AsyncClient() as proxy._client:
+        with pytest.raises(TimeoutError):
+            await proxy._wait_for_workers(timeout=0.3)
+
+    shutdown = Event()
+    async with create_task_group() as tg, httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}") as client:
+        tg.start_soon(serve_app, proxy.app, port, shutdown)
+        for port, name in zip(ports, workers.values()):
+            tg.start_soon(serve_app, create_worker(name), port, shutdown)
+        with fail_after(10):
+            while True:
+                try:
+                    await client.get("/")
+                except httpx.TransportError:
+                    await sleep(0.1)
+                else:
+                    break
+
+        # the requests for a room are forwarded to the worker owning it
+        for worker_url, room_id in room_ids.items():
+            response = await client.post(f"/room/{room_id}/echo", content="foo")
+            assert response.json() == {"worker": workers[worker_url], "room": room_id, "body": "foo"}
+            async with aconnect_ws(f"/room/{room_id}", client) as websocket:
+                await websocket.send_bytes(b"foo")
+                assert await websocket.receive_bytes() == workers[worker_url].encode() + b"foo"
+
+        # the metrics of all the workers are merged, if the workers accept the request
+        response = await client.get("/metrics")
+        assert response.status_code == 401
+        response = await client.get("/metrics", headers={"cookie": "token=foo"})
+        assert response.text == "\n".join([
+            "# HELP rooms The rooms.",
+            "# TYPE rooms gauge",
+            'rooms{worker="0"} 1',
+            'rooms{worker="1"} 1',
+        ]) + "\n"
+
+        # the connection is refused if the worker refuses it
+        with pytest.raises(WebSocketUpgradeError):
+            async with aconnect_ws("/room/forbidden", client):
+                pass  # pragma: nocover
+
+        # the worker closing codes of the application are forwarded
+        async with aconnect_ws("/room/stale", client) as websocket:
+            with pytest.raises(WebSocketDisconnect) as exc_info:
+                await websocket.receive_bytes()
+        assert exc_info.value.code == 4409
+        assert exc_info.value.reason == "stale"
+
+        shutdown.set()
+
+
+async def serve_app(app, port, shutdown):
+    config = Config()
+    config.bind = [f"127.0.0.1:{port}"]
+    await serve(app, config, shutdown_trigger=shutdown.wait, mode="asgi")
+
+
+@pytest.mark.anyio
+async def test_forward_to_client():
+    class FakeWebSocket:
+        async def receive_bytes(self):
+            raise WebSocketNetworkError()
+
+        async def send_bytes(self, message):
+            pass  # pragma: nocover
+
+    # the connection to the client is closed if the connection to the worker is lost
+    with CancelScope() as scope:
+        await forward_to_client(FakeWebSocket(), FakeWebSocket(), scope)
+    assert scope.cancel_called